@@ -0,0 +1,77 @@
+from collections import namedtuple
+
+import numpy as np
+
+from token_counter import EVAL_TOKENIZER, get_tokenizer
+
+# Tokens [start, stop) of a document: their ids (a view of the document's
+# ids, or None without a tokenizer) and the text they were encoded from
+Window = namedtuple("Window", ["start", "stop", "ids", "text"])
+
+
+class TokenizedDocument:
+    """A document tokenized once, cut into token-exact windows for context sweeps.
+
+    Windows are located by the character offset of each token, so their text
+    is sliced straight out of the original, in time linear in its length,
+    rather than re-joined from words or re-encoded, and their ids are views
+    of one array. Sweeping a grid of sizes up to the whole document (e.g.
+    128k tokens) costs one encoding plus the windows themselves.
+
+    Without a tokenizer, every 4 characters count as a token.
+    """
+
+    def __init__(self, text, tokenizer_name=EVAL_TOKENIZER):
+        self.text = text
+        tokenizer = get_tokenizer(tokenizer_name)
+        if tokenizer is None:
+            self.ids = None
+            starts = np.arange(0, len(text), 4, dtype=np.int64)
+        else:
+            ids, starts = tokenizer.encode_with_offsets(text)
+            self.ids = np.asarray(ids, dtype=np.int32)
+            starts = np.asarray(starts, dtype=np.int64)
+        # bounds[i] is where token i starts; the first token takes any leading
+        # text, and the last one runs to the end
+        self.bounds = np.append(starts, len(text))
+        if len(starts):
+            self.bounds[0] = 0
+
+    @property
+    def num_tokens(self):
+        return len(self.bounds) - 1
+
+    def _boundary(self, i):
+        """Token `i`, clipped to the document, or the first token of its character.
+
+        A character encoded as several tokens cannot be split, so a window
+        bound inside it moves back to its first token.
+        """
+        i = min(max(i, 0), self.num_tokens)
+        return int(np.searchsorted(self.bounds, self.bounds[i]))
+
+    def window(self, start, stop):
+        """The window of tokens [start, stop), clipped to the document."""
+        start = self._boundary(start)
+        stop = max(start, self._boundary(stop))
+        ids = self.ids[start:stop] if self.ids is not None else None
+        text = self.text[self.bounds[start] : self.bounds[stop]]
+        return Window(start, stop, ids, text)
+
+    def prefixes(self, sizes):
+        """Yields the first `size` tokens for each of `sizes`, in the order given."""
+        for size in sizes:
+            yield self.window(0, size)
+
+    def windows(self, size, stride=None):
+        """Yields windows of `size` tokens every `stride` tokens (default: `size`).
+
+        The last window may be shorter, and ends at the end of the document.
+        """
+        stride = stride or size
+        start = 0
+        while True:
+            yield self.window(start, start + size)
+            if start + size >= self.num_tokens:
+                return
+            start += stride
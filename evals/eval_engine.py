@@ -0,0 +1,202 @@
+import random
+import threading
+import time
+from collections import Counter, defaultdict, deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# The outcome of one case: `response` on success, else the last `error`
+EvalResult = namedtuple(
+    "EvalResult", ["case", "response", "error", "attempts", "seconds"]
+)
+
+
+def estimate_tokens(case):
+    """Rough prompt size in tokens (about 4 characters each), for rate limiting."""
+    return len(case["prompt"]) // 4 + 1
+
+
+def rate_limit_delay(error):
+    """For a 429 (rate limited) error, the seconds the server asked to wait.
+
+    Returns None for any other error, 0 when a 429 names no Retry-After.
+    SDK errors (OpenAI, Groq, Llama Stack) and httpx.HTTPStatusError carry
+    the status code and response.
+    """
+    response = getattr(error, "response", None)
+    status = getattr(error, "status_code", None) or getattr(
+        response, "status_code", None
+    )
+    if status != 429:
+        return None
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return max(float(headers.get("retry-after", 0)), 0.0)
+    except ValueError:  # An HTTP date rather than seconds
+        return 0.0
+
+
+class TokenBucket:
+    """Admits `rate` tokens per second on average, in bursts of up to `capacity`.
+
+    `pause(seconds)` stops admitting anything for a while, e.g. after the
+    provider rejected a request as over its limit.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds):
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def acquire(self, tokens):
+        """Blocks until `tokens` (at most `capacity`) can be spent."""
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait_time = max(
+                    self.paused_until - now, (tokens - self.tokens) / self.rate
+                )
+            time.sleep(wait_time)
+
+
+def per_model(setting, model):
+    """A setting given either for all models or as {model: value, "default": value}."""
+    if isinstance(setting, dict):
+        return setting.get(model, setting.get("default"))
+    return setting
+
+
+class EvalEngine:
+    """Runs evaluation cases against rate-limited model APIs, streaming results.
+
+    Each case is a dict with at least "model" and "prompt"; `call(case)`
+    returns the model's response. `run(cases)` reads cases lazily, at most
+    `read_ahead` beyond those running, so memory stays flat however many
+    there are, and yields an EvalResult per case as soon as it completes
+    (not in input order; the result carries its case).
+
+    Per model, at most `concurrency` cases run at once and, with
+    `tokens_per_minute`, their estimated prompt tokens (`cost(case)`) are
+    admitted at that rate. Both may be dicts keyed by model, with a
+    "default" entry. A case rejected with a 429 is retried up to
+    `max_attempts` times, after the server's Retry-After or an exponential
+    backoff with jitter, and its model's limiter pauses meanwhile so the
+    other cases of that model back off too. Other errors are not retried.
+    """
+
+    def __init__(
+        self,
+        call,
+        concurrency=4,
+        tokens_per_minute=None,
+        cost=estimate_tokens,
+        max_attempts=6,
+        base_delay=1.0,
+        max_delay=60.0,
+        max_workers=64,
+        read_ahead=None,
+    ):
+        self.call = call
+        self.concurrency = concurrency
+        self.tokens_per_minute = tokens_per_minute
+        self.cost = cost
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_workers = max_workers
+        self.read_ahead = read_ahead or 2 * max_workers
+        self._limiters = {}
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+    def _count(self, outcome):
+        with self._lock:
+            self.stats[outcome] += 1
+
+    def limiter(self, model):
+        """The model's token bucket, or None if its rate is not limited."""
+        with self._lock:
+            if model not in self._limiters:
+                rate = per_model(self.tokens_per_minute, model)
+                self._limiters[model] = TokenBucket(rate / 60, rate) if rate else None
+            return self._limiters[model]
+
+    def backoff(self, attempt, retry_after=0.0):
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return max(retry_after, delay * random.uniform(0.5, 1.0))
+
+    def attempt(self, case):
+        """Runs one case, retrying rate limited requests; returns its EvalResult."""
+        limiter = self.limiter(case["model"])
+        start = time.monotonic()
+        for attempt in range(1, self.max_attempts + 1):
+            if limiter is not None:
+                limiter.acquire(self.cost(case))
+            try:
+                response = self.call(case)
+            except Exception as e:
+                retry_after = rate_limit_delay(e)
+                if retry_after is None or attempt == self.max_attempts:
+                    self._count("errors")
+                    return EvalResult(case, None, e, attempt, time.monotonic() - start)
+                self._count("rate_limited")
+                delay = self.backoff(attempt, retry_after)
+                if limiter is not None:
+                    limiter.pause(delay)
+                time.sleep(delay)
+                continue
+            self._count("completed")
+            return EvalResult(case, response, None, attempt, time.monotonic() - start)
+
+    def run(self, cases):
+        """Yields an EvalResult for every case, as they complete."""
+        cases = iter(cases)
+        waiting = defaultdict(deque)  # Cases read ahead, by model
+        num_waiting = 0
+        running = {}  # Future: its case
+        running_per_model = Counter()
+        exhausted = False
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            while True:
+                while not exhausted and num_waiting < self.read_ahead:
+                    case = next(cases, None)
+                    if case is None:
+                        exhausted = True
+                        break
+                    waiting[case["model"]].append(case)
+                    num_waiting += 1
+                for model, queue in waiting.items():
+                    limit = per_model(self.concurrency, model)
+                    while (
+                        queue
+                        and running_per_model[model] < limit
+                        and len(running) < self.max_workers
+                    ):
+                        case = queue.popleft()
+                        num_waiting -= 1
+                        running_per_model[model] += 1
+                        running[executor.submit(self.attempt, case)] = case
+                if not running:
+                    return
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    case = running.pop(future)
+                    running_per_model[case["model"]] -= 1
+                    yield future.result()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
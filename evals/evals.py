@@ -1,4 +1,5 @@
 import base64
+import hashlib
 import json
 import logging
 import time
@@ -7,6 +8,8 @@ from io import BytesIO
 import ollama
 from PIL import Image
 
+from inference_cache import cached
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
@@ -38,9 +41,7 @@ class LargeContextEval:
             if input_image:
                 response = self.generate_with_image(prompt, input_image)
             else:
-                response = ollama.generate(model=self.model_name, prompt=prompt).get(
-                    "response", ""
-                )
+                response = self.generate(prompt)
 
             end_time = time.time()
 
@@ -58,17 +59,38 @@ class LargeContextEval:
             self.results.append(result)
             logging.info(json.dumps(result, indent=2))
 
+    def generate(self, prompt):
+        """
+        Generate a text response, reusing the cached one for a repeated prompt.
+        """
+        request = {"provider": "ollama", "model": self.model_name, "prompt": prompt}
+        return cached(
+            request,
+            lambda: ollama.generate(model=self.model_name, prompt=prompt).get(
+                "response", ""
+            ),
+        )
+
     def generate_with_image(self, prompt, image_path):
         """
         Generate response using both text and an image.
         """
         with open(image_path, "rb") as img_file:
-            img_base64 = base64.b64encode(img_file.read()).decode("utf-8")
-
-        response = ollama.generate(
-            model=self.model_name, prompt=prompt, image=img_base64
+            image = img_file.read()
+        img_base64 = base64.b64encode(image).decode("utf-8")
+
+        request = {
+            "provider": "ollama",
+            "model": self.model_name,
+            "prompt": prompt,
+            "image_sha256": hashlib.sha256(image).hexdigest(),
+        }
+        return cached(
+            request,
+            lambda: ollama.generate(
+                model=self.model_name, prompt=prompt, image=img_base64
+            ).get("response", ""),
         )
-        return response
 
     def save_results(self, filename="eval_results.json"):
         """
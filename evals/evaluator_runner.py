@@ -1,7 +1,69 @@
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from config import getenv
 from datasets.evaluation_questions import evaluation_scenarios
+from eval_engine import EvalEngine
 from evaluator import simple_evaluator
-from inference.llama_api_client import query_llama_api
+from inference.llama_api_client import complete_llama_api
+
+# Per model: requests in flight and prompt tokens per minute (0: unlimited)
+EVAL_CONCURRENCY = int(getenv("EVAL_CONCURRENCY", "8"))
+EVAL_TOKENS_PER_MINUTE = int(getenv("EVAL_TOKENS_PER_MINUTE", "0"))
+EVAL_MAX_ATTEMPTS = int(getenv("EVAL_MAX_ATTEMPTS", "6"))
+
+
+def iter_cases(models, context_sizes):
+    """Yields one case per scenario, context size and model, lazily."""
+    for scenario in evaluation_scenarios:
+        for context_size in context_sizes:
+            for model in models:
+                yield {
+                    "scenario": scenario,
+                    "context_size": context_size,
+                    "model": model,
+                    "prompt": scenario["question"],
+                }
+
+
+def query_case(case):
+    return complete_llama_api(case["prompt"], case["model"], case["context_size"])
+
+
+def default_engine():
+    return EvalEngine(
+        query_case,
+        concurrency=EVAL_CONCURRENCY,
+        tokens_per_minute=EVAL_TOKENS_PER_MINUTE or None,
+        max_attempts=EVAL_MAX_ATTEMPTS,
+    )
+
+
+def iter_eval(models, context_sizes, engine=None):
+    """
+    Runs the evaluation for multiple models and context sizes, yielding each
+    scored result as soon as its request completes.
+
+    :param models: A set of model names to compare.
+    :param context_sizes: A list of context window sizes to test.
+    :param engine: The EvalEngine to run cases with (default: from EVAL_* settings).
+    """
+    engine = engine or default_engine()
+    for result in engine.run(iter_cases(models, context_sizes)):
+        case = result.case
+        scenario = case["scenario"]
+        if result.error is not None:
+            response = f"Error: {result.error}"
+        else:
+            response = result.response
+        yield {
+            "question": scenario["question"],
+            "expected": scenario["expected"],
+            "context_size": case["context_size"],
+            "model": case["model"],
+            "response": response[:50] + "...",
+            "score": simple_evaluator(response, scenario["expected"]),
+            "attempts": result.attempts,
+            "seconds": result.seconds,
+        }
+
 
 def run_eval(models, context_sizes):
     """
@@ -9,35 +71,6 @@ def run_eval(models, context_sizes):
 
     :param models: A set of model names to compare.
     :param context_sizes: A list of context window sizes to test.
-    :return: A list of evaluation results.
+    :return: A list of evaluation results, in order of completion.
     """
-    eval_results = []
-    tasks = []
-
-    # Use ThreadPoolExecutor for parallel execution
-    with ThreadPoolExecutor(max_workers=8) as executor:
-        for scenario in evaluation_scenarios:
-            for context_size in context_sizes:
-                for model in models:
-                    tasks.append(
-                        executor.submit(
-                            query_llama_api, scenario["question"], model, context_size
-                        )
-                    )
-
-        # Collect results as they complete
-        for future, (scenario, context_size, model) in zip(as_completed(tasks), [
-            (s, cs, m) for s in evaluation_scenarios for cs in context_sizes for m in models
-        ]):
-            response = future.result()
-            score = simple_evaluator(response, scenario["expected"])
-            eval_results.append({
-                "question": scenario["question"],
-                "expected": scenario["expected"],
-                "context_size": context_size,
-                "model": model,
-                "response": response[:50] + "...",
-                "score": score,
-            })
-
-    return eval_results
+    return list(iter_eval(models, context_sizes))
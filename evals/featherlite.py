@@ -2,6 +2,9 @@ import numpy as np
 import requests
 import together
 
+from context_sweep import TokenizedDocument
+from inference_cache import cached
+
 # Configuration
 API_KEY = "YOUR_LLAMA_API_KEY"
 MODEL = "meta-llama/Llama-3.3-70B-Instruct-Turbo"
@@ -29,40 +32,44 @@ def download_book(url):
     return ""
 
 
-def count_tokens_together(text):
-    """Counts the number of tokens in a given text using Together AI's API."""
-    response = client.chat.completions.create(
-        model=MODEL,
-        messages=[{"role": "user", "content": text}],
-        temperature=0,
-    )
-    return response.usage.prompt_tokens if response.usage else "Token count unavailable"
+def chat(content):
+    """Sends one user message and returns the reply, cached."""
+    messages = [{"role": "user", "content": content}]
+
+    def generate():
+        response = client.chat.completions.create(
+            model=MODEL, messages=messages, temperature=0
+        )
+        return response.choices[0].message.content
+
+    request = {
+        "provider": "together",
+        "model": MODEL,
+        "messages": messages,
+        "temperature": 0,
+    }
+    return cached(request, generate)
 
 
 def quick_evaluate(text):
     """Performs a quick evaluation by summarizing the text."""
-    response = client.chat.completions.create(
-        model=MODEL,
-        messages=[{"role": "user", "content": f"Summarize this passage: {text}"}],
-        temperature=0,
-    )
-    summary = response.choices[0].message.content
+    summary = chat(f"Summarize this passage: {text}")
     return len(summary.split())
 
 
 def process_text_chunks(clean_text, token_sizes):
     """Processes text chunks quickly by only counting tokens and generating a short summary."""
     results = []
-    words = clean_text.split()
+    # Tokenized once, locally; chunks are token-exact prefixes of the text, and
+    # a book shorter than a size gives fewer tokens (Token Count) than asked for
+    document = TokenizedDocument(clean_text)
 
-    for size in token_sizes:
-        chunk_text = " ".join(words[:size])
-        token_count = count_tokens_together(chunk_text)
-        summary_length = quick_evaluate(chunk_text)
+    for size, chunk in zip(token_sizes, document.prefixes(token_sizes)):
+        summary_length = quick_evaluate(chunk.text)
         results.append(
             {
                 "Chunk Size (Tokens)": size,
-                "Token Count": token_count,
+                "Token Count": chunk.stop,
                 "Summary Length": summary_length,
             }
         )
@@ -1,21 +1,55 @@
-from llama_stack_client import LlamaStackClient
-from config import getenv
+import os
+import sys
+
+from config import PROJECT_DIR, getenv
+from inference_cache import cached
+from token_counter import truncate_tokens
+
+# The provider registry lives with the Hagakure app; appended so that evals'
+# own modules (config, datasets) keep precedence.
+sys.path.append(os.path.join(PROJECT_DIR, "hagakure"))
+from providers import ProviderRegistry, llama_stack_provider
 
 # Load API credentials
 LLAMA_API_KEY = getenv("LLAMA_API_KEY")
 LLAMA_API_BASE_URL = getenv("LLAMA_API_BASE_URL")
 
-# Initialize Llama client
-llama_client = LlamaStackClient(base_url=LLAMA_API_BASE_URL, api_key=LLAMA_API_KEY)
+# One tuned connection pool shared by every evaluator thread. The SDK does not
+# retry 429s itself: EvalEngine does, pacing retries with its rate limiter.
+registry = ProviderRegistry(
+    max_connections=int(getenv("EVAL_MAX_CONNECTIONS", "64")),
+    max_keepalive_connections=int(getenv("EVAL_MAX_KEEPALIVE_CONNECTIONS", "32")),
+    timeout=float(getenv("EVAL_REQUEST_TIMEOUT", "300")),
+    max_retries=int(getenv("EVAL_MAX_RETRIES", "3")),
+    sdk_max_retries=0,
+)
+registry.register(
+    "llama_api",
+    llama_stack_provider,
+    model="llama3.3-70b-llama_api",
+    api_key=LLAMA_API_KEY,
+    base_url=LLAMA_API_BASE_URL,
+)
+
+def complete_llama_api(prompt, model="llama3.3-70b-llama_api", max_tokens=2048):
+    """Queries the Llama API like `query_llama_api`, but raises API errors (e.g. 429s)."""
+    # Truncate prompt to fit context window
+    truncated_prompt = truncate_tokens(prompt, max_tokens)
+    messages = [{"role": "user", "content": truncated_prompt}]
+
+    def generate():
+        response = registry.get("llama_api").with_model(model).generate(messages)
+        return response["content"] if response else None
+
+    content = cached(
+        {"provider": "llama_api", "model": model, "messages": messages}, generate
+    )
+    return content if content is not None else "Error: API request failed"
+
 
 def query_llama_api(prompt, model="llama3.3-70b-llama_api", max_tokens=2048):
     """Function to query the Llama API with a specified model and context length."""
-    truncated_prompt = prompt[:max_tokens]  # Truncate prompt to fit context window
     try:
-        response = llama_client.inference.chat_completion(
-            model_id=model,
-            messages=[{"role": "user", "content": truncated_prompt}],
-        )
-        return response.completion_message.content.text if response else "Error: API request failed"
+        return complete_llama_api(prompt, model, max_tokens)
     except Exception as e:
         return f"Error: {str(e)}"
@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from config import BASE_DIR, getenv
+
+# off: always query the model; record: reuse cached responses and store new
+# ones; replay: only use cached responses, a miss is an error; refresh: query
+# the model and overwrite what was cached
+MODES = ("off", "record", "replay", "refresh")
+CACHE_MODE = getenv("EVAL_CACHE_MODE", "record")
+CACHE_PATH = getenv(
+    "EVAL_CACHE_PATH", os.path.join(BASE_DIR, "inference_cache.sqlite3")
+)
+
+
+class CacheMiss(LookupError):
+    """Raised in replay mode for a request that was never recorded."""
+
+
+def request_key(request):
+    """A content address for a request: the SHA-256 of its canonical JSON."""
+    encoded = json.dumps(request, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class InferenceCache:
+    """Model responses stored in a local SQLite database, keyed by request.
+
+    A request is a JSON-serializable dict of everything that determines the
+    response: provider, model, prompt or messages and sampling parameters.
+    `call(request, fn)` returns the cached response to an identical request,
+    or calls `fn()` and stores its JSON-serializable result, depending on the
+    mode (see MODES). Errors raised by `fn` and empty results (None, "") are
+    not stored, so failed requests are retried on the next run.
+
+    Connections are per thread, and the database may be shared by several
+    processes, e.g. the shards of a LongBench run.
+    """
+
+    def __init__(self, path=CACHE_PATH, mode=CACHE_MODE):
+        if mode not in MODES:
+            raise ValueError(f"Unknown cache mode '{mode}', expected one of {MODES}.")
+        self.path = path
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        if mode != "off":
+            with self._connect() as db:
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    "key TEXT PRIMARY KEY, request TEXT, response TEXT, created REAL)"
+                )
+
+    def _connect(self):
+        """Returns this thread's connection; sqlite3 connections are not shareable."""
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=30)
+        return db
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, request):
+        """The cached response to `request`; raises CacheMiss if there is none."""
+        row = (
+            self._connect()
+            .execute(
+                "SELECT response FROM responses WHERE key = ?", (request_key(request),)
+            )
+            .fetchone()
+        )
+        if row is None:
+            raise CacheMiss(f"No cached response to request {request_key(request)}.")
+        return json.loads(row[0])
+
+    def put(self, request, response):
+        encoded = json.dumps(request, sort_keys=True, default=str)
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (request_key(request), encoded, json.dumps(response), time.time()),
+            )
+
+    def call(self, request, fn):
+        """Returns the response to `request`, from the cache or from `fn()`."""
+        if self.mode == "off":
+            return fn()
+        if self.mode != "refresh":
+            try:
+                response = self.get(request)
+                self._count(hit=True)
+                return response
+            except CacheMiss:
+                self._count(hit=False)
+                if self.mode == "replay":
+                    raise
+        response = fn()
+        if response:
+            self.put(request, response)
+        return response
+
+    def stats(self):
+        return {"mode": self.mode, "hits": self.hits, "misses": self.misses}
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_cache():
+    """The cache configured by EVAL_CACHE_MODE and EVAL_CACHE_PATH, opened on first use."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = InferenceCache()
+        return _default
+
+
+def cached(request, fn):
+    """Returns the response to `request` through the default cache."""
+    return default_cache().call(request, fn)
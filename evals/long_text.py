@@ -2,6 +2,9 @@ import requests
 from llama_stack_client import LlamaStackClient
 from llama_stack_client.types import UserMessage
 
+from context_sweep import TokenizedDocument
+from inference_cache import cached
+
 # Configuration
 MODEL = "llama3.3-70b-instruct"
 
@@ -36,7 +39,8 @@ def download_book(url):
 
 def query_model(query):
     """Queries the Llama model and retrieves a response."""
-    try:
+
+    def generate():
         response = client.inference.chat_completion(
             model_id=MODEL, messages=[UserMessage(role="user", content=query)]
         )
@@ -47,7 +51,12 @@ def query_model(query):
             content = " ".join(item.text for item in content if hasattr(item, "text"))
         elif hasattr(content, "text"):  # Handle single TextContentItem case
             content = content.text
+        return content
 
+    try:
+        content = cached(
+            {"provider": "llama_stack", "model": MODEL, "prompt": query}, generate
+        )
         return content if content else "No response"
 
     except Exception as e:
@@ -85,12 +94,13 @@ def evaluate_model_responses(passage):
 def process_text_chunks(clean_text, token_sizes):
     """Processes text chunks of different sizes and evaluates them."""
     results = []
-    words = clean_text.split()
+    document = TokenizedDocument(clean_text)
 
-    for size in token_sizes:
-        chunk_text = " ".join(words[:size])
-        evaluation = evaluate_model_responses(chunk_text)
-        results.append({"Chunk Size (Tokens)": size, **evaluation})
+    for size, chunk in zip(token_sizes, document.prefixes(token_sizes)):
+        evaluation = evaluate_model_responses(chunk.text)
+        results.append(
+            {"Chunk Size (Tokens)": size, "Token Count": chunk.stop, **evaluation}
+        )
 
     return results
 
@@ -114,6 +124,7 @@ for title, url in books.items():
 for res in chunk_comparisons:
     print(f"\nBook: {res['Title']}")
     print(f"Chunk Size (Tokens): {res['Chunk Size (Tokens)']}")
+    print(f"Token Count: {res['Token Count']}")
     print(f"Summary Length: {res['Summary Length']}")
     print(f"Theme Count: {res['Theme Count']}")
     print(f"Consistency Check: {res['Consistency Check']}")
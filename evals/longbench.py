@@ -1,6 +1,8 @@
+import argparse
 import json
 import os
 import pprint
+import zlib
 
 from datasets import load_dataset
 from dotenv import load_dotenv
@@ -9,23 +11,35 @@ from llama_stack_client.lib.inference.event_logger import EventLogger
 from llama_stack_client.types import UserMessage
 from tqdm import tqdm
 
+from eval_engine import EvalEngine
+from inference_cache import cached, default_cache
+
 # Load API keys from .env file
 load_dotenv()
 
 API_BASE_URL = os.getenv("API_BASE_URL")
 API_KEY = os.getenv("API_KEY")
 MODEL_ID = os.getenv("MODEL_ID", "llama3.3-70b-instruct")
+# Requests in flight, and prompt tokens per minute (0: unlimited)
+CONCURRENCY = int(os.getenv("LONGBENCH_CONCURRENCY", "8"))
+TOKENS_PER_MINUTE = int(os.getenv("LONGBENCH_TOKENS_PER_MINUTE", "0"))
+CHECKPOINT_FILE = "longbench_eval_results.jsonl"
+
+client = None
+
 
-# Ensure API key is set
-if not API_KEY:
-    raise ValueError("Missing API_KEY in .env file.")
+def connect():
+    """Initializes the Llama API client; summarizing results does not need it."""
+    global client
+    # Ensure API key is set
+    if not API_KEY:
+        raise ValueError("Missing API_KEY in .env file.")
 
-# Initialize Llama API Client
-client = LlamaStackClient(base_url=API_BASE_URL, api_key=API_KEY)
+    client = LlamaStackClient(base_url=API_BASE_URL, api_key=API_KEY)
 
-# List available models (debugging step)
-available_models = client.models.list()
-pprint.pprint(available_models)
+    # List available models (debugging step)
+    available_models = client.models.list()
+    pprint.pprint(available_models)
 
 
 # Load LongBench v2 dataset (train split)
@@ -36,10 +50,9 @@ def load_longbench():
     return dataset
 
 
-# Query Llama API using the LLaMA model
-def query_llama(question, context, choices):
+def build_prompt(question, context, choices):
     # Format the prompt properly with multiple-choice options
-    prompt = f"""Context:\n{context}\n\n
+    return f"""Context:\n{context}\n\n
 Question: {question}
 A) {choices['A']}
 B) {choices['B']}
@@ -48,30 +61,68 @@ D) {choices['D']}
 
 Which option is correct? Answer only with 'A', 'B', 'C', or 'D'."""
 
-    try:
+
+def complete(prompt):
+    """Sends one prompt to the model; API errors (e.g. 429s) are raised.
+
+    Responses go through the inference cache, so re-runs only query the
+    model for prompts it has not answered yet.
+    """
+
+    def generate():
         response = client.inference.chat_completion(
             messages=[UserMessage(role="user", content=prompt)],
             model_id=MODEL_ID,
             stream=False,
         )
+        content = response.completion_message.content
+        if isinstance(content, list):
+            content = " ".join(item.text for item in content if hasattr(item, "text"))
+        elif hasattr(content, "text"):
+            content = content.text
+        return content.strip()
 
-        # Debugging: Print the response structure
-        print(f"🔍 Raw Response: {response}")
+    request = {"provider": "llama_stack", "model": MODEL_ID, "prompt": prompt}
+    return cached(request, generate)
 
-        # Try extracting content correctly
-        return response.message.content.strip()
 
-    except Exception as e:
-        print(f"❌ Llama API Error: {e}")
-        return None
+def parse_shard(shard):
+    """Parses "i/n" (0 <= i < n) into (i, n)."""
+    index, count = (int(part) for part in shard.split("/"))
+    if not 0 <= index < count:
+        raise ValueError(f"Invalid shard '{shard}', expected i/n with 0 <= i < n.")
+    return index, count
 
 
-# Evaluate model performance
-def evaluate():
-    dataset = load_longbench()
-    results = []
+def in_shard(sample_id, shard):
+    """Assigns samples to shards by a stable hash of their id."""
+    index, count = shard
+    return zlib.crc32(sample_id.encode("utf-8")) % count == index
+
+
+def read_checkpoint(path):
+    """Yields the results saved in a JSONL checkpoint.
 
-    for sample in tqdm(dataset, desc="Evaluating"):
+    A last line cut short by a crash is removed, so appending can resume.
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        data = f.read()
+        complete_size = data.rfind(b"\n") + 1
+        if complete_size < len(data):
+            f.truncate(complete_size)
+    for line in data[:complete_size].splitlines():
+        if line.strip():
+            yield json.loads(line)
+
+
+def iter_cases(dataset, shard, done):
+    """Yields a case per valid sample of the shard that is not in `done`."""
+    for i, sample in enumerate(dataset):
+        sample_id = sample.get("_id") or str(i)
+        if sample_id in done or not in_shard(sample_id, shard):
+            continue
         question = sample.get("question", "")
         context = sample.get("context", "")
         correct_answer = sample.get("answer", "")
@@ -86,36 +137,112 @@ def evaluate():
         if not question or not context or not correct_answer:
             continue  # Skip invalid samples
 
-        # Get model prediction
-        model_output = query_llama(question, context, choices)
+        yield {
+            "id": sample_id,
+            "model": MODEL_ID,
+            "question": question,
+            "expected": correct_answer,
+            "prompt": build_prompt(question, context, choices),
+        }
 
-        # Compare with correct answer
-        is_correct = model_output == correct_answer
 
-        results.append(
-            {
-                "question": question,
-                "expected": correct_answer,
-                "model_output": model_output,
-                "correct": is_correct,
-            }
-        )
+def summarize(paths):
+    """Prints the accuracy over the results in the given checkpoints."""
+    results = {}
+    for path in paths:
+        for result in read_checkpoint(path):
+            results[result["id"]] = result["correct"]
 
     # Prevent division by zero
     if not results:
         print("No valid results collected. Check dataset structure or API response.")
-        return
+        return None
+
+    accuracy = sum(results.values()) / len(results)
+    print(f"Accuracy: {accuracy:.2%} over {len(results)} samples")
+    return accuracy
 
-    # Calculate accuracy
-    accuracy = sum(1 for r in results if r["correct"]) / len(results)
-    print(f"Accuracy: {accuracy:.2%}")
 
-    # Save results to JSON file
-    with open("longbench_eval_results.json", "w") as f:
-        json.dump(results, f, indent=4)
+# Evaluate model performance
+def evaluate(
+    checkpoint=CHECKPOINT_FILE,
+    shard=(0, 1),
+    concurrency=CONCURRENCY,
+    tokens_per_minute=TOKENS_PER_MINUTE,
+):
+    """Evaluates the shard's samples, appending each result to `checkpoint`.
+
+    Samples whose id is already in the checkpoint are skipped, so an
+    interrupted run resumes where it stopped. Samples the API failed on are
+    not saved, and are retried by the next run.
+    """
+    # Replaying cached responses needs no API access
+    if default_cache().mode != "replay":
+        connect()
+    dataset = load_longbench()
+    done = {result["id"] for result in read_checkpoint(checkpoint)}
+    print(f"Resuming: {len(done)} samples already in {checkpoint}.")
+
+    engine = EvalEngine(
+        lambda case: complete(case["prompt"]),
+        concurrency=concurrency,
+        tokens_per_minute=tokens_per_minute or None,
+        max_workers=concurrency,
+    )
+    failed = 0
+    with open(checkpoint, "a") as f:
+        results = engine.run(iter_cases(dataset, shard, done))
+        for result in tqdm(results, desc="Evaluating"):
+            case = result.case
+            if result.error is not None:
+                print(f"❌ Llama API Error on {case['id']}: {result.error}")
+                failed += 1
+                continue
+            record = {
+                "id": case["id"],
+                "question": case["question"],
+                "expected": case["expected"],
+                "model_output": result.response,
+                # Compare with correct answer
+                "correct": result.response == case["expected"],
+            }
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
 
-    print("Results saved to longbench_eval_results.json")
+    if failed:
+        print(f"{failed} samples failed; run again to retry them.")
+    summarize([checkpoint])
+    print(f"Inference cache: {default_cache().stats()}")
+    print(f"Results saved to {checkpoint}")
 
 
 if __name__ == "__main__":
-    evaluate()
+    parser = argparse.ArgumentParser(description="Evaluate a model on LongBench v2.")
+    parser.add_argument(
+        "--shard",
+        default="0/1",
+        help="Evaluate only shard i of n (e.g. 0/4), to split a run across processes",
+    )
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--tokens-per-minute", type=int, default=TOKENS_PER_MINUTE)
+    parser.add_argument(
+        "--checkpoint",
+        help=f"JSONL results file (default: {CHECKPOINT_FILE}, or one per shard)",
+    )
+    parser.add_argument(
+        "--summarize",
+        nargs="+",
+        metavar="CHECKPOINT",
+        help="Only print the accuracy over these checkpoints, e.g. every shard's",
+    )
+    args = parser.parse_args()
+
+    if args.summarize:
+        summarize(args.summarize)
+    else:
+        shard = parse_shard(args.shard)
+        checkpoint = args.checkpoint or CHECKPOINT_FILE
+        if not args.checkpoint and shard[1] > 1:
+            checkpoint = f"longbench_eval_results.shard-{shard[0]}-of-{shard[1]}.jsonl"
+        evaluate(checkpoint, shard, args.concurrency, args.tokens_per_minute)
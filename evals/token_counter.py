@@ -0,0 +1,83 @@
+import functools
+import os
+
+from config import getenv
+
+# The Llama tokenizer to count with: a tokenizer.json file or a Hugging Face
+# model id (meta-llama repositories are gated and need HF_TOKEN). Without one,
+# tiktoken's cl100k_base, close to Llama 3's vocabulary, approximates it.
+EVAL_TOKENIZER = getenv("EVAL_TOKENIZER", "meta-llama/Llama-3.3-70B-Instruct")
+
+
+class HuggingFaceTokenizer:
+    """A Hugging Face `tokenizers` tokenizer, without special tokens."""
+
+    def __init__(self, name):
+        from tokenizers import Tokenizer
+
+        path = name
+        if not os.path.exists(name):
+            from huggingface_hub import hf_hub_download
+
+            path = hf_hub_download(name, "tokenizer.json")
+        self.tokenizer = Tokenizer.from_file(path)
+        self.tokenizer.no_truncation()
+        self.tokenizer.no_padding()
+        self.name = name
+
+    def encode_batch(self, texts):
+        encodings = self.tokenizer.encode_batch(texts, add_special_tokens=False)
+        return [encoding.ids for encoding in encodings]
+
+    def encode_with_offsets(self, text):
+        """Token ids and the character offset each token starts at."""
+        encoding = self.tokenizer.encode(text, add_special_tokens=False)
+        return encoding.ids, [start for start, _ in encoding.offsets]
+
+    def decode(self, ids):
+        return self.tokenizer.decode(ids, skip_special_tokens=False)
+
+
+class TiktokenTokenizer:
+    """A tiktoken encoding; special token text is encoded as ordinary text."""
+
+    def __init__(self, name="cl100k_base"):
+        import tiktoken
+
+        self.encoding = tiktoken.get_encoding(name)
+        self.name = name
+
+    def encode_batch(self, texts):
+        return self.encoding.encode_ordinary_batch(texts)
+
+    def encode_with_offsets(self, text):
+        """Token ids and the character offset each token starts at."""
+        ids = self.encoding.encode_ordinary(text)
+        _, starts = self.encoding.decode_with_offsets(ids)
+        return ids, starts
+
+    def decode(self, ids):
+        return self.encoding.decode(ids)
+
+
+@functools.lru_cache(maxsize=None)
+def get_tokenizer(name=EVAL_TOKENIZER):
+    """Loads a tokenizer once per name; None if neither it nor cl100k_base loads."""
+    for load, arg in ((HuggingFaceTokenizer, name), (TiktokenTokenizer, "cl100k_base")):
+        try:
+            return load(arg)
+        except Exception as e:
+            print(f"[WARNING] Could not load tokenizer '{arg}': {e}")
+    print("[WARNING] No tokenizer available, estimating ~4 characters per token.")
+    return None
+
+
+def truncate_tokens(text, max_tokens, tokenizer_name=EVAL_TOKENIZER):
+    """Returns the longest prefix of `text` that is at most `max_tokens` tokens."""
+    tokenizer = get_tokenizer(tokenizer_name)
+    if tokenizer is None:
+        return text[: max_tokens * 4]
+    ids = tokenizer.encode_batch([text])[0]
+    if len(ids) <= max_tokens:
+        return text
+    return tokenizer.decode(ids[:max_tokens])
@@ -1,11 +1,42 @@
-import ollama
+import argparse
+import json
+import threading
+import time
+import uuid
+
 from dotenv import load_dotenv
-from flask import Flask, redirect, render_template_string, request, session, url_for
-from groq import Groq
-from llama_stack_client import LlamaStackClient
-from llama_stack_client.types import CompletionMessage, UserMessage
-from openai import OpenAI
-from rag import add_document, retrieve_context
+from flask import (
+    Flask,
+    Response,
+    jsonify,
+    redirect,
+    render_template_string,
+    request,
+    session,
+    stream_with_context,
+    url_for,
+)
+from context_budget import ContextBudget
+from conversation_store import create_conversation_store
+import metrics
+from providers import (
+    ProviderRegistry,
+    groq_provider,
+    llama_stack_provider,
+    ollama_provider,
+    openai_provider,
+)
+import rag
+from rag import (
+    add_document,
+    batching_stats,
+    cache_stats,
+    embed_query,
+    index_stats,
+    retrieve_hits,
+)
+from response_cache import ResponseCache, conversation_tail
+from routing import Router
 from config import getenv
 
 GROQ_API_KEY = getenv("GROQ_API_KEY")
@@ -14,13 +45,13 @@ LLAMA_STACK_BASE_URL = getenv("LLAMA_STACK_BASE_URL")
 OPENAI_API_KEY = getenv("OPENAI_API_KEY")
 OPENAI_BASE_URL = getenv("OPENAI_BASE_URL")
 
-# Ensure API keys are set
-if not GROQ_API_KEY:
-    raise ValueError("Missing GROQ_API_KEY in .env file.")
-if not LLAMA_STACK_API_KEY or not LLAMA_STACK_BASE_URL:
-    raise ValueError("Missing Llama Stack API configuration in .env file.")
-if not OPENAI_API_KEY or not OPENAI_BASE_URL:
-    raise ValueError("Missing OpenAI API configuration in .env file.")
+# Providers to serve, in menu order; the first is the default. Providers are
+# created, and their SDK imported, on first use, so a missing API key only
+# fails requests to that provider.
+PROVIDERS = getenv("HAGAKURE_PROVIDERS", "groq,ollama,llama_stack,openai")
+# Load the embedding model, knowledge base and providers in a background
+# thread at startup instead of on the first request
+WARM_UP = getenv("HAGAKURE_WARM_UP", "0") == "1"
 
 app = Flask(__name__)
 app.secret_key = "session_random_key"
@@ -29,11 +60,87 @@ app_model_groq = "llama3-8b-8192"
 app_model_llama_stack = "llama3.3-70b-instruct"
 app_model_openai = app_model_llama_stack
 
-groq_client = Groq(api_key=GROQ_API_KEY)
-llama_stack_client = LlamaStackClient(
-    base_url=LLAMA_STACK_BASE_URL, api_key=LLAMA_STACK_API_KEY
+# All provider SDKs share the registry's connection pools. Generations are
+# long requests, so the pools are sized for hundreds of concurrent streams.
+registry = ProviderRegistry(
+    max_connections=int(getenv("HAGAKURE_MAX_CONNECTIONS", "500")),
+    max_keepalive_connections=int(getenv("HAGAKURE_MAX_KEEPALIVE_CONNECTIONS", "100")),
+    keepalive_expiry=float(getenv("HAGAKURE_KEEPALIVE_EXPIRY", "30")),
+    timeout=float(getenv("HAGAKURE_REQUEST_TIMEOUT", "120")),
+    max_retries=int(getenv("HAGAKURE_MAX_RETRIES", "2")),
+)
+registry.register("groq", groq_provider, model=app_model_groq, api_key=GROQ_API_KEY)
+registry.register(
+    "ollama",
+    ollama_provider,
+    model=app_model_ollama,
+    host=getenv("OLLAMA_HOST"),
+    embedding_model=getenv("OLLAMA_EMBEDDING_MODEL"),
+)
+registry.register(
+    "llama_stack",
+    llama_stack_provider,
+    model=app_model_llama_stack,
+    api_key=LLAMA_STACK_API_KEY,
+    base_url=LLAMA_STACK_BASE_URL,
+    embedding_model=getenv("LLAMA_STACK_EMBEDDING_MODEL"),
+)
+registry.register(
+    "openai",
+    openai_provider,
+    model=app_model_openai,
+    api_key=OPENAI_API_KEY,
+    base_url=OPENAI_BASE_URL,
+    embedding_model=getenv("OPENAI_EMBEDDING_MODEL"),
 )
-openai_client = OpenAI(base_url=OPENAI_BASE_URL, api_key=OPENAI_API_KEY)
+registry.select(PROVIDERS.split(","))
+
+# Routing mode: requests go to the session's provider, are hedged to the next
+# provider of the route if no token arrived within HAGAKURE_HEDGE_AFTER seconds
+# (0 disables hedging), and fall back to it on errors. A provider failing
+# HAGAKURE_BREAKER_FAILURES times in a row is skipped for HAGAKURE_BREAKER_RESET
+# seconds. The route defaults to all served providers, in menu order.
+ROUTING = getenv("HAGAKURE_ROUTING", "0") == "1"
+FALLBACK_PROVIDERS = getenv("HAGAKURE_FALLBACK_PROVIDERS", "")
+router = Router(
+    registry,
+    hedge_after=float(getenv("HAGAKURE_HEDGE_AFTER", "2")),
+    failure_threshold=int(getenv("HAGAKURE_BREAKER_FAILURES", "3")),
+    reset_timeout=float(getenv("HAGAKURE_BREAKER_RESET", "30")),
+)
+
+# Response cache: a reply is reused for the same provider, model, last
+# HAGAKURE_RESPONSE_CACHE_TAIL turns of the conversation, retrieved documents
+# and prompt. The semantic tier also reuses it for prompts whose MiniLM
+# embedding has a cosine similarity of at least HAGAKURE_RESPONSE_CACHE_THRESHOLD.
+RESPONSE_CACHE = getenv("HAGAKURE_RESPONSE_CACHE", "0") == "1"
+RESPONSE_CACHE_SEMANTIC = getenv("HAGAKURE_RESPONSE_CACHE_SEMANTIC", "1") == "1"
+RESPONSE_CACHE_TAIL = int(getenv("HAGAKURE_RESPONSE_CACHE_TAIL", "2"))
+response_cache = (
+    ResponseCache(
+        getenv("HAGAKURE_RESPONSE_CACHE_DB", "response_cache.sqlite3"),
+        dim=rag.EMBEDDING_DIM,
+        max_entries=int(getenv("HAGAKURE_RESPONSE_CACHE_SIZE", "10000")),
+        embed=embed_query if RESPONSE_CACHE_SEMANTIC else None,
+        threshold=float(getenv("HAGAKURE_RESPONSE_CACHE_THRESHOLD", "0.95")),
+    )
+    if RESPONSE_CACHE
+    else None
+)
+
+# Conversations live server-side, keyed by a session id; only the id and the
+# selected provider travel in the session cookie. Use the sqlite backend when
+# several worker processes serve the app.
+conversation_store = create_conversation_store(
+    getenv("HAGAKURE_CONVERSATION_STORE", "memory"),
+    path=getenv("HAGAKURE_CONVERSATION_DB", "conversations.sqlite3"),
+    max_sessions=int(getenv("HAGAKURE_MAX_SESSIONS", "10000")),
+)
+
+# Chat histories are trimmed to each model's context window, keeping room for
+# the response. Dropped turns are optionally summarized by the same provider.
+RESPONSE_TOKENS = int(getenv("HAGAKURE_RESPONSE_TOKENS", "1024"))
+SUMMARIZE_HISTORY = getenv("HAGAKURE_SUMMARIZE_HISTORY", "0") == "1"
 
 HTML_TEMPLATE = """
 <!DOCTYPE html>
@@ -54,6 +161,56 @@ HTML_TEMPLATE = """
         function changeProvider() {
             document.getElementById('providerForm').submit();
         }
+
+        // Streams the completion over Server-Sent Events and renders tokens as they
+        // arrive. The server stores the turn once the stream completes.
+        async function streamPrompt(event) {
+            event.preventDefault();
+            const form = event.target;
+            const conversation = document.getElementById('conversation');
+            const promptDiv = document.createElement('div');
+            const responseDiv = document.createElement('div');
+            responseDiv.className = 'response';
+            conversation.append(promptDiv, responseDiv, document.createElement('hr'));
+            promptDiv.textContent = 'You: ' + form.prompt.value;
+
+            const response = await fetch('{{ url_for('stream') }}', {
+                method: 'POST',
+                body: new URLSearchParams(new FormData(form)),
+            });
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                let boundary;
+                while ((boundary = buffer.indexOf('\n\n')) >= 0) {
+                    const message = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
+                    let eventName = 'message';
+                    let data = '';
+                    for (const line of message.split('\n')) {
+                        if (line.startsWith('event: ')) eventName = line.slice(7);
+                        else if (line.startsWith('data: ')) data += line.slice(6);
+                    }
+                    const payload = JSON.parse(data);
+                    if (eventName === 'done') {
+                        promptDiv.textContent = 'You: ' + payload.prompt;
+                        const debug = document.getElementById('debug');
+                        debug.style.display = 'block';
+                        debug.querySelector('pre').textContent = payload.debug_info;
+                    } else if (eventName === 'error') {
+                        responseDiv.textContent += '\n[Error] ' + payload.error;
+                    } else {
+                        responseDiv.textContent += payload.delta;
+                    }
+                }
+            }
+            form.reset();
+            return false;
+        }
     </script>
 </head>
 <body>
@@ -73,142 +230,289 @@ HTML_TEMPLATE = """
 
     <form method="post" id="providerForm">
         <select name="provider" onchange="changeProvider()">
-            <option value="groq" {% if session.get('provider', 'groq') == 'groq' %}selected{% endif %}>Groq</option>
-            <option value="ollama" {% if session.get('provider') == 'ollama' %}selected{% endif %}>Ollama</option>
-            <option value="llama_stack" {% if session.get('provider') == 'llama_stack' %}selected{% endif %}>Llama Stack</option>
-            <option value="openai" {% if session.get('provider') == 'openai' %}selected{% endif %}>OpenAI</option>
+            {% if 'groq' in providers %}<option value="groq" {% if session.get('provider', providers[0]) == 'groq' %}selected{% endif %}>Groq</option>{% endif %}
+            {% if 'ollama' in providers %}<option value="ollama" {% if session.get('provider') == 'ollama' %}selected{% endif %}>Ollama</option>{% endif %}
+            {% if 'llama_stack' in providers %}<option value="llama_stack" {% if session.get('provider') == 'llama_stack' %}selected{% endif %}>Llama Stack</option>{% endif %}
+            {% if 'openai' in providers %}<option value="openai" {% if session.get('provider') == 'openai' %}selected{% endif %}>OpenAI</option>{% endif %}
         </select>
     </form>
     
-    <form method="post">
+    <form method="post" onsubmit="return streamPrompt(event)">
         <textarea name="prompt" placeholder="Enter your prompt here"></textarea><br><br>
         <button type="submit">Submit</button>
         <button type="button" onclick="location.href='{{ url_for('reset') }}'">Reset Conversation</button>
     </form>
 
-    <div class="conversation">
-        {% for item in session.get(session.get('provider', 'groq') + '_conversation', []) %}
+    <div class="conversation" id="conversation">
+        {% for item in conversation %}
             <div><strong>You:</strong> {{ item['prompt'] }}</div>
             <div class="response"><strong>Model ({{ item['provider'] }}):</strong> {{ item['response'] }}</div>
             <hr>
         {% endfor %}
     </div>
     
-    {% if session.get('debug_info') %}
-    <div class="debug">
+    <div class="debug" id="debug" {% if not debug_info %}style="display: none"{% endif %}>
         <h3>Debug Information</h3>
-        <pre>{{ session['debug_info'] }}</pre>
+        <pre>{{ debug_info or '' }}</pre>
     </div>
-    {% endif %}
 </body>
 </html>
 """
 
 
+def enhance_prompt(prompt):
+    """Retrieves relevant documents for RAG and combines them with the user input.
+
+    Returns (enhanced prompt, retrieved doc ids, debug info).
+    """
+    with metrics.span("retrieval"):
+        hits, rag_debug_info = retrieve_hits(prompt)
+    retrieved_context = "\n\n".join(hit.text for hit in hits)
+    enhanced_prompt = f"Context:\n{retrieved_context}\n\nUser Prompt: {prompt}"
+    debug_info = f"[INFO] Final prompt sent to LLM:\n{enhanced_prompt}\n"
+    debug_info += f"[INFO] RAG Processing Details:\n{rag_debug_info}\n"
+    return enhanced_prompt, [hit.doc_id for hit in hits], debug_info
+
+
+def summarizer(provider):
+    """Returns a function that summarizes a transcript with the given provider."""
+
+    def summarize(transcript):
+        messages = [
+            {
+                "role": "user",
+                "content": "Summarize this conversation in a few sentences, keeping "
+                f"names, facts and decisions:\n\n{transcript}",
+            }
+        ]
+        return registry.get(provider).generate(messages)["content"]
+
+    return summarize
+
+
+context_budgets = {
+    provider: ContextBudget(
+        model,
+        reserve_tokens=RESPONSE_TOKENS,
+        summarize=summarizer(provider) if SUMMARIZE_HISTORY else None,
+    )
+    for provider, model in (
+        ("groq", app_model_groq),
+        ("ollama", app_model_ollama),
+        ("llama_stack", app_model_llama_stack),
+        ("openai", app_model_openai),
+    )
+}
+
+
+def prepare_messages(provider, context, enhanced_prompt, prompt):
+    """Adds the new user turn to a chat history and fits it into the model's budget.
+
+    Returns (history to store, messages to send, debug info).
+    """
+    with metrics.span("prompt_assembly"):
+        # Ollama histories used to be stored as token ids; they cannot be carried over
+        context = [message for message in context or [] if isinstance(message, dict)]
+        context.append({"role": "user", "content": enhanced_prompt, "prompt": prompt})
+        return context_budgets[provider].prepare(context)
+
+
+def route_for(provider):
+    """The session's provider followed by its fallbacks."""
+    fallbacks = (
+        FALLBACK_PROVIDERS.split(",") if FALLBACK_PROVIDERS else registry.names()
+    )
+    return [provider] + [
+        name for name in fallbacks if name != provider and name in registry
+    ]
+
+
+def routed_messages(provider, context, messages):
+    """Returns a function giving the messages to send to each provider of a route."""
+
+    def messages_for(name):
+        if name == provider:
+            return messages
+        # Fit the history into the fallback model's own context window
+        return context_budgets[name].prepare(context)[1]
+
+    return messages_for
+
+
+def routing_debug_info(result):
+    if not result.get("routing"):
+        return ""
+    return "[INFO] Routing: " + "; ".join(result["routing"]) + "\n"
+
+
+def complete(provider, context, messages):
+    """Generates a reply, through the router in routing mode.
+
+    Returns (assistant message, provider that answered, routing debug info).
+    """
+    if not ROUTING:
+        started = time.perf_counter()
+        message = registry.get(provider).generate(messages)
+        metrics.record_generation(
+            provider,
+            None,
+            time.perf_counter() - started,
+            messages,
+            message.get("content") or "",
+        )
+        return message, provider, ""
+    result = {}
+    deltas = router.stream(
+        route_for(provider), routed_messages(provider, context, messages), result
+    )
+    for _ in metrics.observe_stream(deltas, result, messages):
+        pass
+    return result["message"], result["provider"], routing_debug_info(result)
+
+
+def stream_response(provider, context, messages, result):
+    """Streams a reply, through the router in routing mode."""
+    if not ROUTING:
+        result["provider"] = provider
+        deltas = registry.get(provider).stream(messages, result)
+    else:
+        deltas = router.stream(
+            route_for(provider), routed_messages(provider, context, messages), result
+        )
+    return metrics.observe_stream(deltas, result, messages, metrics.current_trace())
+
+
+def cached_response(provider, context, prompt, doc_ids):
+    """Looks up a cached reply to the newest turn of `context`.
+
+    Returns (cache scope, assistant message or None, debug info).
+    """
+    if response_cache is None:
+        return None, None, ""
+    tail = conversation_tail(context[:-1], RESPONSE_CACHE_TAIL)
+    model = context_budgets[provider].model
+    scope = response_cache.scope(provider, model, tail, doc_ids)
+    with metrics.span("response_cache"):
+        hit = response_cache.get(scope, prompt)
+    metrics.record_cache("response", hit is not None)
+    if hit is None:
+        return scope, None, "[INFO] Response cache miss\n"
+    message, kind, similarity = hit
+    return (
+        scope,
+        message,
+        f"[INFO] Response cache hit ({kind}, similarity {similarity:.3f})\n",
+    )
+
+
+def cache_response(scope, prompt, message):
+    if scope is not None and message.get("content"):
+        response_cache.put(scope, prompt, message)
+
+
+def replay(message, provider, result):
+    """Streams a cached reply as a single delta."""
+    result["message"], result["provider"] = message, provider
+    yield message["content"]
+
+
+def start_warm_up():
+    """Loads the embedding model, knowledge base and providers in a daemon thread."""
+
+    def warm_up():
+        rag.warm_up()
+        registry.warm_up()
+        print("[INFO] Warm-up complete.")
+
+    thread = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def current_provider(session):
+    """The session's provider, or the default one if it is not being served."""
+    provider = session.get("provider")
+    return provider if provider in registry else registry.names()[0]
+
+
+def session_id():
+    """Returns the id of the browser's server-side conversation state."""
+    if "sid" not in session:
+        session["sid"] = uuid.uuid4().hex
+    return session["sid"]
+
+
 @app.route("/", methods=["GET", "POST"])
 def index():
-    provider = session.get("provider", "groq")
+    sid = session_id()
+    provider = current_provider(session)
     conversation_key = f"{provider}_conversation"
     context_key = f"{provider}_context"
     debug_info = ""
     response = ""
 
-    if conversation_key not in session:
-        session[conversation_key] = []
-
     if request.method == "POST":
         new_provider = request.form.get("provider")
-        if new_provider and new_provider != provider:
+        if new_provider in registry and new_provider != provider:
             session["provider"] = new_provider
-            session.pop("debug_info", None)  # Clear debug info when provider changes
+            # Clear debug info when provider changes
+            conversation_store.delete(sid, "debug_info")
             return redirect(url_for("index"))
 
         prompt = request.form.get("prompt")
         if prompt:
-            # Retrieve relevant documents for RAG
-            retrieved_context, rag_debug_info = retrieve_context(prompt)
-
-            # Combine retrieved context with user input
-            enhanced_prompt = f"Context:\n{retrieved_context}\n\nUser Prompt: {prompt}"
-            debug_info += f"[INFO] Final prompt sent to LLM:\n{enhanced_prompt}\n"
-            debug_info += f"[INFO] RAG Processing Details:\n{rag_debug_info}\n"
+            trace = metrics.start_trace("index", provider=provider)
+            enhanced_prompt, doc_ids, rag_debug_info = enhance_prompt(prompt)
+            debug_info += rag_debug_info
 
-            if provider == "groq":
-                context = session.get(context_key, [])
-                context.append({"role": "user", "content": enhanced_prompt})
+            context, messages, budget_debug_info = prepare_messages(
+                provider,
+                conversation_store.get(sid, context_key),
+                enhanced_prompt,
+                prompt,
+            )
+            debug_info += budget_debug_info
+            scope, assistant_message, cache_debug_info = cached_response(
+                provider, context, prompt, doc_ids
+            )
+            debug_info += cache_debug_info
+            answered_by = provider
 
-                debug_info += f"Calling Groq API: groq_client.chat.completions.create with parameters:\n"
-                debug_info += f"  Model: {app_model_groq}\n"
-                debug_info += f"  Messages: {context}\n"
+            if assistant_message is None:
+                debug_info += f"Calling {provider}: generate with parameters:\n"
+                debug_info += f"  Model: {context_budgets[provider].model}\n"
+                debug_info += f"  Messages: {messages}\n"
 
-                groq_response = groq_client.chat.completions.create(
-                    messages=context,
-                    model=app_model_groq,
-                )
-                response = groq_response.choices[0].message.content
-                context.append({"role": "assistant", "content": response})
-                session[context_key] = context
-
-            elif provider == "ollama":
-                context = session.get(context_key)
-                debug_info += "Calling Ollama API\n"
-                result = ollama.generate(
-                    model=app_model_ollama, prompt=enhanced_prompt, context=context
-                )
-                response = result["response"]
-                session[context_key] = result.get("context")
-
-            elif provider == "llama_stack":
-                context = session.get(context_key, [])
-                user_message = {"role": "user", "content": enhanced_prompt}
-                context.append(user_message)
-
-                debug_info += f"Calling Llama API: llama_stack_client.inference.chat_completion with parameters:\n"
-                debug_info += f"  Model: {app_model_llama_stack}\n"
-                debug_info += f"  Prompt: {enhanced_prompt}\n"
-                debug_info += f"  Context: {context}\n"
-
-                llama_response = llama_stack_client.inference.chat_completion(
-                    messages=context,
-                    model_id=app_model_llama_stack,
-                )
-                response_text = llama_response.completion_message.content.text
-                assistant_message = {
-                    "role": "assistant",
-                    "content": response_text,
-                    "stop_reason": llama_response.completion_message.stop_reason,
-                }
-                response = response_text
-                context.append(assistant_message)
-                session[context_key] = context
-
-            elif provider == "openai":
-                context = session.get(context_key, [])
-                context.append({"role": "user", "content": enhanced_prompt})
-
-                debug_info += f"Calling OpenAI API: openai_client.chat.completions.create with parameters:\n"
-                debug_info += f"  Model: {app_model_openai}\n"
-                debug_info += f"  Prompt: {enhanced_prompt}\n"
-                debug_info += f"  Context: {context}\n"
-
-                completion = openai_client.chat.completions.create(
-                    model=app_model_openai,
-                    messages=context,
+                assistant_message, answered_by, routing_debug = complete(
+                    provider, context, messages
                 )
-                response = completion.choices[0].message.content
-                context.append({"role": "assistant", "content": response})
-                session[context_key] = context
+                debug_info += routing_debug
+                cache_response(scope, prompt, assistant_message)
+            response = assistant_message["content"]
+            context.append(assistant_message)
+            conversation_store.set(sid, context_key, context)
 
-            session.setdefault(conversation_key, []).append(
-                {"prompt": enhanced_prompt, "response": response, "provider": provider}
+            conversation_store.append(
+                sid,
+                conversation_key,
+                {
+                    "prompt": enhanced_prompt,
+                    "response": response,
+                    "provider": answered_by,
+                },
             )
-            session["debug_info"] = debug_info
+            conversation_store.set(sid, "debug_info", debug_info)
+            trace.finish()
 
     else:
-        session.pop("debug_info", None)  # Clear debug info when page is refreshed
+        # Clear debug info when page is refreshed
+        conversation_store.delete(sid, "debug_info")
 
     return render_template_string(
         HTML_TEMPLATE,
+        providers=registry.names(),
+        conversation=conversation_store.items(sid, conversation_key),
+        debug_info=conversation_store.get(sid, "debug_info"),
         app_model_ollama=app_model_ollama,
         app_model_groq=app_model_groq,
         app_model_llama_stack=app_model_llama_stack,
@@ -216,14 +520,127 @@ def index():
     )
 
 
+def sse(payload, event=None):
+    """Formats one Server-Sent Event with a JSON payload."""
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(payload)}\n\n"
+
+
+@app.route("/stream", methods=["POST"])
+def stream():
+    sid = session_id()
+    provider = current_provider(session)
+    prompt = request.form.get("prompt")
+    if not prompt:
+        return jsonify(error="Missing prompt."), 400
+
+    context_key = f"{provider}_context"
+    trace = metrics.start_trace("stream", provider=provider)
+    enhanced_prompt, doc_ids, debug_info = enhance_prompt(prompt)
+    context, messages, budget_debug_info = prepare_messages(
+        provider, conversation_store.get(sid, context_key), enhanced_prompt, prompt
+    )
+    debug_info += budget_debug_info
+    scope, cached, cache_debug_info = cached_response(
+        provider, context, prompt, doc_ids
+    )
+    debug_info += cache_debug_info
+    if cached is None:
+        debug_info += f"Streaming from {provider}\n"
+
+    def events():
+        result = {}
+        response = ""
+        if cached is not None:
+            deltas = replay(cached, provider, result)
+        else:
+            deltas = stream_response(provider, context, messages, result)
+        try:
+            for delta in deltas:
+                response += delta
+                yield sse({"delta": delta})
+        except Exception as e:
+            routing_debug = routing_debug_info(result)
+            trace.set(error=str(e))
+            trace.finish()
+            yield sse({"error": f"{e}\n{routing_debug}".strip()}, event="error")
+            return
+
+        # The conversation is only written once the stream has completed
+        full_debug_info = debug_info + routing_debug_info(result)
+        if cached is None:
+            cache_response(scope, prompt, result["message"])
+        conversation_store.set(sid, context_key, context + [result["message"]])
+        conversation_store.append(
+            sid,
+            f"{provider}_conversation",
+            {
+                "prompt": enhanced_prompt,
+                "response": response,
+                "provider": result["provider"],
+            },
+        )
+        conversation_store.set(sid, "debug_info", full_debug_info)
+        trace.finish()
+        yield sse(
+            {"prompt": enhanced_prompt, "debug_info": full_debug_info}, event="done"
+        )
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.route("/reset")
 def reset():
-    provider = session.get("provider", "groq")
-    session.pop(f"{provider}_conversation", None)
-    session.pop(f"{provider}_context", None)
-    session.pop("debug_info", None)
+    provider = current_provider(session)
+    conversation_store.delete(
+        session_id(), f"{provider}_conversation", f"{provider}_context", "debug_info"
+    )
     return redirect(url_for("index"))
 
 
+@app.route("/stats")
+def stats():
+    return jsonify(
+        index=index_stats(),
+        query_cache=cache_stats(),
+        embedding_batcher=batching_stats(),
+        response_cache=response_cache.stats() if response_cache else None,
+        circuit_breakers=router.stats(),
+    )
+
+
+@app.route("/metrics")
+def prometheus_metrics():
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve the Hagakure app.")
+    parser.add_argument(
+        "--providers",
+        help="Comma-separated providers to serve (default: HAGAKURE_PROVIDERS)",
+    )
+    parser.add_argument(
+        "--warm-up",
+        action="store_true",
+        help="Load models and providers in the background at startup",
+    )
+    return parser.parse_args()
+
+
+if WARM_UP:
+    start_warm_up()
+
+
 if __name__ == "__main__":
+    args = parse_args()
+    if args.providers:
+        registry.select(args.providers.split(","))
+    if args.warm_up and not WARM_UP:
+        start_warm_up()
     app.run(debug=True, host="127.0.0.1", port=5001)
@@ -0,0 +1,312 @@
+import contextlib
+import time
+import uuid
+from urllib.parse import parse_qsl
+
+import jinja2
+import uvicorn
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.sessions import SessionMiddleware
+from starlette.responses import (
+    HTMLResponse,
+    JSONResponse,
+    RedirectResponse,
+    Response,
+    StreamingResponse,
+)
+from starlette.routing import Route
+
+from app import (
+    HTML_TEMPLATE,
+    ROUTING,
+    WARM_UP,
+    app as flask_app,
+    app_model_groq,
+    app_model_llama_stack,
+    app_model_ollama,
+    app_model_openai,
+    cache_response,
+    cached_response,
+    context_budgets,
+    conversation_store,
+    current_provider,
+    enhance_prompt,
+    parse_args,
+    prepare_messages,
+    registry,
+    response_cache,
+    route_for,
+    routed_messages,
+    router,
+    routing_debug_info,
+    sse,
+    start_warm_up,
+)
+import metrics
+from rag import batching_stats, cache_stats, index_stats
+
+template = jinja2.Environment(autoescape=True).from_string(HTML_TEMPLATE)
+
+
+def session_id(session):
+    """Returns the id of the browser's server-side conversation state."""
+    if "sid" not in session:
+        session["sid"] = uuid.uuid4().hex
+    return session["sid"]
+
+
+def stream_response(provider, context, messages, result):
+    """Streams a reply asynchronously, through the router in routing mode."""
+    if not ROUTING:
+        result["provider"] = provider
+        deltas = registry.get(provider).astream(messages, result)
+    else:
+        deltas = router.astream(
+            route_for(provider), routed_messages(provider, context, messages), result
+        )
+    return metrics.aobserve_stream(deltas, result, messages, metrics.current_trace())
+
+
+async def replay(message, provider, result):
+    """Streams a cached reply as a single delta."""
+    result["message"], result["provider"] = message, provider
+    yield message["content"]
+
+
+async def generate(provider, context_key, sid, enhanced_prompt, doc_ids, prompt):
+    """Sends the prompt to the selected provider and updates the stored context."""
+    # Budgeting may summarize old turns with a blocking call
+    context, messages, debug_info = await run_in_threadpool(
+        prepare_messages,
+        provider,
+        conversation_store.get(sid, context_key),
+        enhanced_prompt,
+        prompt,
+    )
+    scope, assistant_message, cache_debug_info = await run_in_threadpool(
+        cached_response, provider, context, prompt, doc_ids
+    )
+    debug_info += cache_debug_info
+    if assistant_message is not None:
+        context.append(assistant_message)
+        conversation_store.set(sid, context_key, context)
+        return assistant_message["content"], provider, debug_info
+
+    debug_info += f"Calling {provider}: agenerate\n"
+    debug_info += f"  Model: {context_budgets[provider].model}\n"
+    if ROUTING:
+        result = {}
+        try:
+            async for _ in stream_response(provider, context, messages, result):
+                pass
+        finally:
+            debug_info += routing_debug_info(result)
+        assistant_message, provider = result["message"], result["provider"]
+    else:
+        started = time.perf_counter()
+        assistant_message = await registry.get(provider).agenerate(messages)
+        metrics.record_generation(
+            provider,
+            None,
+            time.perf_counter() - started,
+            messages,
+            assistant_message.get("content") or "",
+        )
+    await run_in_threadpool(cache_response, scope, prompt, assistant_message)
+    context.append(assistant_message)
+    conversation_store.set(sid, context_key, context)
+    return assistant_message["content"], provider, debug_info
+
+
+async def read_form(request):
+    """Parses the page's url-encoded form without needing python-multipart."""
+    return dict(parse_qsl((await request.body()).decode("utf-8")))
+
+
+async def index(request):
+    session = request.session
+    sid = session_id(session)
+    provider = current_provider(session)
+    conversation_key = f"{provider}_conversation"
+    context_key = f"{provider}_context"
+
+    if request.method == "POST":
+        form = await read_form(request)
+        new_provider = form.get("provider")
+        if new_provider in registry and new_provider != provider:
+            session["provider"] = new_provider
+            # Clear debug info when provider changes
+            conversation_store.delete(sid, "debug_info")
+            return RedirectResponse(request.url_for("index"), status_code=303)
+
+        prompt = form.get("prompt")
+        if prompt:
+            trace = metrics.start_trace("index", provider=provider)
+            # Retrieval is CPU bound, so it runs off the event loop
+            enhanced_prompt, doc_ids, debug_info = await run_in_threadpool(
+                enhance_prompt, prompt
+            )
+            response, answered_by, provider_debug_info = await generate(
+                provider, context_key, sid, enhanced_prompt, doc_ids, prompt
+            )
+            conversation_store.append(
+                sid,
+                conversation_key,
+                {
+                    "prompt": enhanced_prompt,
+                    "response": response,
+                    "provider": answered_by,
+                },
+            )
+            conversation_store.set(sid, "debug_info", debug_info + provider_debug_info)
+            trace.finish()
+
+    else:
+        # Clear debug info when page is refreshed
+        conversation_store.delete(sid, "debug_info")
+
+    return HTMLResponse(
+        template.render(
+            session=session,
+            url_for=lambda name: request.url_for(name).path,
+            providers=registry.names(),
+            conversation=conversation_store.items(sid, conversation_key),
+            debug_info=conversation_store.get(sid, "debug_info"),
+            app_model_ollama=app_model_ollama,
+            app_model_groq=app_model_groq,
+            app_model_llama_stack=app_model_llama_stack,
+            app_model_openai=app_model_openai,
+        )
+    )
+
+
+async def reset(request):
+    session = request.session
+    provider = current_provider(session)
+    conversation_store.delete(
+        session_id(session),
+        f"{provider}_conversation",
+        f"{provider}_context",
+        "debug_info",
+    )
+    return RedirectResponse(request.url_for("index"))
+
+
+async def stream(request):
+    session = request.session
+    sid = session_id(session)
+    provider = current_provider(session)
+    prompt = (await read_form(request)).get("prompt")
+    if not prompt:
+        return JSONResponse({"error": "Missing prompt."}, status_code=400)
+
+    context_key = f"{provider}_context"
+    trace = metrics.start_trace("stream", provider=provider)
+    enhanced_prompt, doc_ids, debug_info = await run_in_threadpool(
+        enhance_prompt, prompt
+    )
+    context, messages, budget_debug_info = await run_in_threadpool(
+        prepare_messages,
+        provider,
+        conversation_store.get(sid, context_key),
+        enhanced_prompt,
+        prompt,
+    )
+    debug_info += budget_debug_info
+    scope, cached, cache_debug_info = await run_in_threadpool(
+        cached_response, provider, context, prompt, doc_ids
+    )
+    debug_info += cache_debug_info
+    if cached is None:
+        debug_info += f"Streaming from {provider}\n"
+
+    async def events():
+        result = {}
+        response = ""
+        if cached is not None:
+            deltas = replay(cached, provider, result)
+        else:
+            deltas = stream_response(provider, context, messages, result)
+        try:
+            async for delta in deltas:
+                response += delta
+                yield sse({"delta": delta})
+        except Exception as e:
+            routing_debug = routing_debug_info(result)
+            trace.set(error=str(e))
+            trace.finish()
+            yield sse({"error": f"{e}\n{routing_debug}".strip()}, event="error")
+            return
+
+        # The conversation is only written once the stream has completed
+        full_debug_info = debug_info + routing_debug_info(result)
+        if cached is None:
+            await run_in_threadpool(cache_response, scope, prompt, result["message"])
+        conversation_store.set(sid, context_key, context + [result["message"]])
+        conversation_store.append(
+            sid,
+            f"{provider}_conversation",
+            {
+                "prompt": enhanced_prompt,
+                "response": response,
+                "provider": result["provider"],
+            },
+        )
+        conversation_store.set(sid, "debug_info", full_debug_info)
+        trace.finish()
+        yield sse(
+            {"prompt": enhanced_prompt, "debug_info": full_debug_info}, event="done"
+        )
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def stats(request):
+    return JSONResponse(
+        {
+            "index": index_stats(),
+            "query_cache": cache_stats(),
+            "embedding_batcher": batching_stats(),
+            "response_cache": response_cache.stats() if response_cache else None,
+            "circuit_breakers": router.stats(),
+        }
+    )
+
+
+async def prometheus_metrics(request):
+    body, content_type = metrics.render()
+    return Response(body, headers={"Content-Type": content_type})
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    yield
+    await registry.aclose()
+
+
+app = Starlette(
+    routes=[
+        Route("/", index, methods=["GET", "POST"]),
+        Route("/stream", stream, methods=["POST"]),
+        Route("/reset", reset),
+        Route("/stats", stats),
+        Route("/metrics", prometheus_metrics),
+    ],
+    middleware=[Middleware(SessionMiddleware, secret_key=flask_app.secret_key)],
+    lifespan=lifespan,
+)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.providers:
+        registry.select(args.providers.split(","))
+    if args.warm_up and not WARM_UP:
+        start_warm_up()
+    uvicorn.run(app, host="127.0.0.1", port=5001)
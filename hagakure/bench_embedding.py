@@ -0,0 +1,165 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# Backend name: (rag embedding backend, quantized)
+BACKENDS = {
+    "pytorch": ("sentence_transformers", False),
+    "onnx-fp32": ("onnx", False),
+    "onnx-int8": ("onnx", True),
+}
+
+WORDS = (
+    "the samurai code of honor loyalty duty master retainer death morning evening "
+    "secret order number shipped warehouse library search index python model "
+    "language vector embedding document question answer context window token"
+).split()
+
+
+def sample_texts(n, seed):
+    """Passages of the knowledge base if it has enough, else random word salad."""
+    from doc_store import DocStore
+    from rag import DOC_STORE_PATH
+
+    rng = np.random.default_rng(seed)
+    if os.path.exists(f"{DOC_STORE_PATH}.idx"):
+        # Read-only: repairing needs the write lock, which a benchmark does not take
+        store = DocStore(DOC_STORE_PATH, repair=False)
+        if len(store) >= n:
+            return [store[int(i)] for i in rng.choice(len(store), n, replace=False)]
+    return [" ".join(rng.choice(WORDS, size=rng.integers(8, 160))) for _ in range(n)]
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+
+
+def run_backend(name, num_texts, num_queries, batch_size, threads, output):
+    """Measures one backend in this process and saves its embeddings to `output`."""
+    from rag import load_embedding_model
+
+    backend, quantized = BACKENDS[name]
+    if backend == "sentence_transformers" and threads:
+        import torch
+
+        torch.set_num_threads(threads)
+    texts = sample_texts(num_texts, seed=0)
+    queries = sample_texts(num_queries, seed=1)
+
+    start = time.perf_counter()
+    model = load_embedding_model(backend, quantized=quantized, threads=threads)
+    load_time = time.perf_counter() - start
+    model.encode(texts[:batch_size], batch_size=batch_size)  # Warm-up
+
+    start = time.perf_counter()
+    embeddings = model.encode(texts, batch_size=batch_size, normalize_embeddings=True)
+    throughput = len(texts) / (time.perf_counter() - start)
+
+    # One query at a time, as the app embeds them without batching
+    latencies = []
+    query_embeddings = []
+    for query in queries:
+        start = time.perf_counter()
+        query_embeddings.append(model.encode(query, normalize_embeddings=True))
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    np.savez(output, texts=embeddings, queries=np.array(query_embeddings))
+    return {
+        "load_s": load_time,
+        "throughput": throughput,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def recall_at_k(reference, candidate, k):
+    """Mean share of the reference top-k passages the candidate also ranks top-k."""
+    ref_top = np.argsort(-reference["queries"] @ reference["texts"].T, axis=1)[:, :k]
+    top = np.argsort(-candidate["queries"] @ candidate["texts"].T, axis=1)[:, :k]
+    return np.mean([len(set(r) & set(c)) / k for r, c in zip(ref_top, top)])
+
+
+def report(name, result, cosines=None, recall=None, top_k=None):
+    line = (
+        f"{name:<10} load={result['load_s']:.1f}s "
+        f"throughput={result['throughput']:.0f}/s "
+        f"p50={result['p50_ms']:.2f}ms p99={result['p99_ms']:.2f}ms "
+        f"rss={result['peak_rss_mb']:.0f}MB"
+    )
+    if cosines is not None:
+        line += f" cosine_min={cosines.min():.4f} recall@{top_k}={recall:.3f}"
+    print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare throughput, latency, memory and agreement of the "
+        "embedding backends."
+    )
+    parser.add_argument(
+        "--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS)
+    )
+    parser.add_argument("--num-texts", type=int, default=2_000)
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=0, help="0: library default")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--worker", choices=BACKENDS, help=argparse.SUPPRESS)
+    parser.add_argument("--output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        result = run_backend(
+            args.worker,
+            args.num_texts,
+            args.num_queries,
+            args.batch_size,
+            args.threads,
+            args.output,
+        )
+        print(json.dumps(result))
+        sys.exit()
+
+    print(
+        f"{args.num_texts} texts (batch size {args.batch_size}), "
+        f"{args.num_queries} single queries, threads={args.threads or 'default'}"
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        embeddings = {}
+        for name in args.backends:
+            # Each backend runs in its own process, so its memory is measured alone
+            output = os.path.join(tmp, f"{name}.npz")
+            worker = subprocess.run(
+                [sys.executable, __file__, "--worker", name, "--output", output]
+                + ["--num-texts", str(args.num_texts)]
+                + ["--num-queries", str(args.num_queries)]
+                + ["--batch-size", str(args.batch_size)]
+                + ["--threads", str(args.threads)],
+                capture_output=True,
+                text=True,
+            )
+            if worker.returncode:
+                print(f"{name:<10} failed:\n{worker.stderr.strip()}")
+                continue
+            result = json.loads(worker.stdout.strip().splitlines()[-1])
+            embeddings[name] = np.load(output)
+            reference = embeddings.get("pytorch")
+            if reference is None or name == "pytorch":
+                report(name, result)
+                continue
+            cosines = np.sum(reference["texts"] * embeddings[name]["texts"], axis=1)
+            report(
+                name,
+                result,
+                cosines,
+                recall_at_k(reference, embeddings[name], args.top_k),
+                args.top_k,
+            )
@@ -0,0 +1,194 @@
+import argparse
+import os
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+from index_factory import (
+    INDEX_TYPES,
+    base_index,
+    build_index,
+    set_search_params,
+    train_index,
+    wrap_ids,
+)
+from live_index import LiveIndex
+
+DIM = 384  # MiniLM embedding size
+
+
+def random_embeddings(n, dim, seed):
+    """Generates clustered, normalized vectors that loosely resemble text embeddings."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(n // 100, 1), dim)).astype(np.float32)
+    vectors = centers[rng.integers(len(centers), size=n)]
+    vectors += 0.3 * rng.standard_normal((n, dim)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def load_knowledge_base_vectors():
+    """Reads the vectors of the existing knowledge base index."""
+    from rag import FAISS_INDEX_FILE
+
+    index = base_index(faiss.read_index(FAISS_INDEX_FILE))
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def measure(index, queries, top_k):
+    """Runs one query at a time, as the app does, and returns results and latencies."""
+    latencies = []
+    results = np.empty((len(queries), top_k), dtype=np.int64)
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        _, indices = index.search(query.reshape(1, -1), top_k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results[i] = indices[0]
+    return results, np.array(latencies)
+
+
+def recall_at_k(results, ground_truth):
+    """Fraction of the exact top-k neighbours that were returned."""
+    hits = sum(len(set(r) & set(g)) for r, g in zip(results, ground_truth))
+    return hits / ground_truth.size
+
+
+def report(name, params, recall, latencies, build_time):
+    print(
+        f"{name:<10} {params:<14} recall={recall:.3f} "
+        f"p50={np.percentile(latencies, 50):.3f}ms "
+        f"p99={np.percentile(latencies, 99):.3f}ms "
+        f"build={build_time:.1f}s"
+    )
+
+
+def check_deletes(index_type, vectors, nlist=16, pq_m=8, hnsw_m=32):
+    """Checks that search returns the right ids after deletes, adds and compaction.
+
+    Half the vectors get ids 1000.., the first 100 of them are deleted and the
+    other half is added under new ids. Before compaction, each search must
+    return `k` ids, none of them deleted. After, results are compared with an
+    index built from the remaining vectors directly (for HNSW, whose graph
+    differs, each vector must find itself first). Returns the number of
+    wrong ids.
+    """
+    half = len(vectors) // 2
+    ids = np.arange(1000, 1000 + len(vectors), dtype=np.int64)
+    keep = np.ones(len(vectors), dtype=bool)
+    keep[:100] = False
+
+    def new_index():
+        index = build_index(index_type, DIM, nlist=nlist, pq_m=pq_m, hnsw_m=hnsw_m)
+        train_index(index, vectors)
+        return index
+
+    def configure(index):
+        set_search_params(index, nprobe=nlist, ef_search=256)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "index.faiss")
+        index = new_index()
+        index.add(vectors[:half])
+        faiss.write_index(wrap_ids(index, ids[:half]), path)
+        live = LiveIndex(
+            path, os.path.join(tmp, "wal.log"), DIM, None, configure=configure
+        )
+        live.remove(ids[:100])
+        live.add(ids[half:], vectors[half:])
+        _, pending = live.search(vectors[keep], 10)
+        live.compact()
+        _, results = live.search(vectors[keep], 1)
+
+    if index_type == "hnsw":
+        expected = ids[keep]
+    else:
+        reference = new_index()
+        reference.add(vectors[keep])
+        reference = wrap_ids(reference, ids[keep])
+        configure(reference)
+        _, expected = reference.search(vectors[keep], 1)
+    wrong = (results.ravel() != np.ravel(expected)).sum()
+    wrong += ((pending < 0) | np.isin(pending, ids[:100])).sum()
+    return int(wrong)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare recall and latency of each index type against the flat baseline."
+    )
+    parser.add_argument("--num-vectors", type=int, default=200_000)
+    parser.add_argument("--num-queries", type=int, default=1_000)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--metric", choices=["ip", "l2"], default="ip")
+    parser.add_argument("--nlist", type=int, default=1024)
+    parser.add_argument("--pq-m", type=int, default=48)
+    parser.add_argument("--hnsw-m", type=int, default=32)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 16, 64])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 64, 256])
+    parser.add_argument(
+        "--from-knowledge-base",
+        action="store_true",
+        help="Benchmark on the vectors of the existing knowledge base",
+    )
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument(
+        "--check-deletes",
+        action="store_true",
+        help="Only check that every index type returns the right ids after deletes",
+    )
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(args.threads)
+    if args.check_deletes:
+        vectors = random_embeddings(2000, DIM, seed=0)
+        failures = {t: check_deletes(t, vectors) for t in INDEX_TYPES}
+        for index_type, wrong in failures.items():
+            print(f"{index_type:<10} {'ok' if not wrong else f'{wrong} wrong ids'}")
+        raise SystemExit(1 if any(failures.values()) else 0)
+    if args.from_knowledge_base:
+        vectors = load_knowledge_base_vectors()
+    else:
+        vectors = random_embeddings(args.num_vectors, DIM, seed=0)
+    # Queries are perturbed database vectors, so they have true near neighbours
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.integers(len(vectors), size=args.num_queries)].copy()
+    queries += 0.05 * rng.standard_normal(queries.shape).astype(np.float32)
+    faiss.normalize_L2(queries)
+
+    print(f"{len(vectors)} vectors, {len(queries)} queries, top_k={args.top_k}")
+    for index_type in INDEX_TYPES:
+        start = time.perf_counter()
+        index = build_index(
+            index_type,
+            DIM,
+            metric=args.metric,
+            nlist=args.nlist,
+            pq_m=args.pq_m,
+            hnsw_m=args.hnsw_m,
+        )
+        train_index(index, vectors)
+        index.add(vectors)
+        build_time = time.perf_counter() - start
+
+        if index_type == "flat":
+            ground_truth, latencies = measure(index, queries, args.top_k)
+            report(index_type, "exact", 1.0, latencies, build_time)
+            continue
+
+        if index_type == "hnsw":
+            sweep = [("efSearch", {"ef_search": ef}) for ef in args.ef_search]
+        else:
+            sweep = [("nprobe", {"nprobe": nprobe}) for nprobe in args.nprobe]
+        for name, params in sweep:
+            set_search_params(index, **params)
+            results, latencies = measure(index, queries, args.top_k)
+            value = next(iter(params.values()))
+            report(
+                index_type,
+                f"{name}={value}",
+                recall_at_k(results, ground_truth),
+                latencies,
+                build_time,
+            )
@@ -0,0 +1,89 @@
+import re
+from collections import namedtuple
+
+# Long texts are tokenized a block of characters at a time, so memory use does
+# not grow with the size of a single document.
+BLOCK_CHARS = 20_000
+
+_WORD = re.compile(r"\S+")
+
+# A retrieved chunk: its score, doc store id, source document and span therein
+Hit = namedtuple("Hit", ["score", "doc_id", "source", "start", "end", "text"])
+
+
+def iter_token_spans(text, tokenizer=None, block_chars=BLOCK_CHARS):
+    """Yields the (start, end) character span of every token in `text`.
+
+    `tokenizer` is a Hugging Face fast tokenizer (e.g. the embedding model's);
+    without one, whitespace-separated words stand in for tokens.
+    """
+    pos = 0
+    while pos < len(text):
+        end = min(pos + block_chars, len(text))
+        if end < len(text):
+            # Cut blocks on whitespace so no token straddles two blocks
+            cut = max(text.rfind(" ", pos, end), text.rfind("\n", pos, end))
+            if cut > pos:
+                end = cut
+        block = text[pos:end]
+        if tokenizer is None:
+            spans = ((m.start(), m.end()) for m in _WORD.finditer(block))
+        else:
+            spans = tokenizer(
+                block, add_special_tokens=False, return_offsets_mapping=True
+            )["offset_mapping"]
+        for start, stop in spans:
+            yield pos + start, pos + stop
+        pos = end
+
+
+def chunk_spans(text, tokenizer=None, max_tokens=200, overlap=32):
+    """Yields (start, end) character spans of overlapping token windows over `text`.
+
+    Each window holds at most `max_tokens` tokens, and consecutive windows
+    share `overlap` tokens so that passages cut at a boundary still appear
+    whole in one of them.
+    """
+    if not 0 <= overlap < max_tokens:
+        raise ValueError("overlap must be smaller than max_tokens.")
+    window = []
+    new_tokens = 0
+    for span in iter_token_spans(text, tokenizer):
+        window.append(span)
+        new_tokens += 1
+        if len(window) == max_tokens:
+            yield window[0][0], window[-1][1]
+            window = window[max_tokens - overlap :]
+            new_tokens = 0
+    if new_tokens:
+        yield window[0][0], window[-1][1]
+
+
+def merge_adjacent(hits):
+    """Merges hits on consecutive chunks of the same source into one passage.
+
+    Chunks of a source are stored under consecutive doc ids, so consecutive
+    ids with the same source are neighbouring windows; their overlap is only
+    kept once. The result keeps the best score of each merged group and is
+    ordered by it.
+    """
+    merged = []
+    for hit in sorted(hits, key=lambda h: h.doc_id):
+        if merged:
+            last = merged[-1]
+            if hit.source == last.source and hit.doc_id == last.doc_id + 1:
+                if hit.start < last.end:
+                    text = last.text + hit.text[last.end - hit.start :]
+                else:
+                    text = last.text + " " + hit.text
+                merged[-1] = Hit(
+                    max(hit.score, last.score),
+                    hit.doc_id,
+                    hit.source,
+                    last.start,
+                    hit.end,
+                    text,
+                )
+                continue
+        merged.append(hit)
+    return sorted(merged, key=lambda h: h.score, reverse=True)
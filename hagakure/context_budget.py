@@ -0,0 +1,134 @@
+import functools
+
+# Context windows of the models the app uses, in tokens
+MODEL_CONTEXT_TOKENS = {
+    "llama3": 8192,
+    "llama3-8b-8192": 8192,
+    "llama3.3-70b-instruct": 128_000,
+}
+DEFAULT_CONTEXT_TOKENS = 8192
+
+# Keys kept in stored messages for bookkeeping but never sent to a provider
+STORE_ONLY_KEYS = ("prompt", "summary")
+
+# Per-message overhead of chat formatting (role markers, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@functools.lru_cache(maxsize=1)
+def get_encoding():
+    """Loads the local tokenizer once; None if it is unavailable."""
+    try:
+        import tiktoken
+
+        # Llama 3 uses a tiktoken BPE with a vocabulary close to cl100k_base
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def count_tokens(text):
+    """Counts tokens locally, estimating ~4 characters per token without a tokenizer."""
+    encoding = get_encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def message_tokens(message):
+    return count_tokens(message.get("content") or "") + MESSAGE_OVERHEAD_TOKENS
+
+
+def strip_rag_context(message):
+    """Returns an old user turn without the retrieved context it was sent with."""
+    if message.get("role") == "user" and message.get("prompt"):
+        return {**message, "content": message["prompt"]}
+    return message
+
+
+def outgoing(message):
+    """Drops the bookkeeping keys a provider would reject."""
+    return {k: v for k, v in message.items() if k not in STORE_ONLY_KEYS}
+
+
+class ContextBudget:
+    """Keeps a chat history within a model's context window.
+
+    The system prompt and the newest turn are always kept. Older user turns
+    are sent without their retrieved context, and the oldest turns are dropped
+    once the history no longer fits in `max_tokens - reserve_tokens`, leaving
+    `reserve_tokens` for the response. With a `summarize` callable (text in,
+    summary out), dropped turns are folded into a summary kept as a system
+    message, for which a quarter of the budget is set aside.
+    """
+
+    def __init__(self, model, max_tokens=None, reserve_tokens=1024, summarize=None):
+        self.model = model
+        self.max_tokens = max_tokens or MODEL_CONTEXT_TOKENS.get(
+            model, DEFAULT_CONTEXT_TOKENS
+        )
+        self.reserve_tokens = reserve_tokens
+        self.summarize = summarize
+
+    @property
+    def budget(self):
+        return self.max_tokens - self.reserve_tokens
+
+    @property
+    def summary_tokens(self):
+        return self.budget // 4
+
+    def prepare(self, history):
+        """Fits `history`, whose last message is the new user turn, into the budget.
+
+        Returns (history to store, messages to send, debug info). The stored
+        history has dropped turns and stale context removed, so it stays
+        bounded too.
+        """
+        system = [m for m in history if m.get("role") == "system"]
+        turns = [m for m in history if m.get("role") != "system"]
+        newest, older = turns[-1], turns[:-1]
+
+        budget = self.budget - (self.summary_tokens if self.summarize else 0)
+        used = sum(message_tokens(m) for m in system) + message_tokens(newest)
+        kept = []
+        for message in reversed(older):
+            tokens = message_tokens(strip_rag_context(message))
+            if used + tokens > budget:
+                break
+            used += tokens
+            kept.append(message)
+        kept.reverse()
+        # Never start the kept history with an orphaned assistant reply
+        while kept and kept[0].get("role") == "assistant":
+            used -= message_tokens(strip_rag_context(kept.pop(0)))
+        dropped = older[: len(older) - len(kept)]
+
+        debug_info = f"[INFO] Context budget ({self.model}): {used}/{self.budget} tokens"
+        if dropped:
+            debug_info += f", dropped {len(dropped)} old messages"
+            if self.summarize:
+                system = self._summarized(system, dropped)
+                debug_info += " into a summary"
+        debug_info += "\n"
+
+        stored = system + [strip_rag_context(m) for m in kept] + [newest]
+        messages = [outgoing(m) for m in stored]
+        return stored, messages, debug_info
+
+    def _summarized(self, system, dropped):
+        """Folds dropped turns, and any earlier summary, into one summary message."""
+        previous = [m for m in system if m.get("summary")]
+        others = [m for m in system if not m.get("summary")]
+        to_summarize = previous + [strip_rag_context(m) for m in dropped]
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in to_summarize)
+        summary = self.summarize(transcript)
+        # The summary must fit its share of the budget (~4 characters per token)
+        summary = summary[: self.summary_tokens * 4]
+        return others + [
+            {
+                "role": "system",
+                "content": f"Summary of the earlier conversation:\n{summary}",
+                "summary": True,
+            }
+        ]
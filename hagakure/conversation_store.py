@@ -0,0 +1,123 @@
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+class InMemoryConversationStore:
+    """Per-session conversation state kept in process memory.
+
+    Values are stored as-is, so nothing is serialized per request. The least
+    recently used sessions are dropped beyond `max_sessions`.
+    """
+
+    def __init__(self, max_sessions=10_000):
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _state(self, sid):
+        state = self._sessions.get(sid)
+        if state is None:
+            state = self._sessions[sid] = {}
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        self._sessions.move_to_end(sid)
+        return state
+
+    def get(self, sid, key, default=None):
+        with self._lock:
+            return self._state(sid).get(key, default)
+
+    def set(self, sid, key, value):
+        with self._lock:
+            self._state(sid)[key] = value
+
+    def items(self, sid, key):
+        """Returns the list stored under `key`, in insertion order."""
+        with self._lock:
+            return list(self._state(sid).get(key, []))
+
+    def append(self, sid, key, item):
+        with self._lock:
+            self._state(sid).setdefault(key, []).append(item)
+
+    def delete(self, sid, *keys):
+        with self._lock:
+            state = self._state(sid)
+            for key in keys:
+                state.pop(key, None)
+
+
+class SQLiteConversationStore:
+    """Per-session conversation state in a local SQLite database.
+
+    Scalar values are JSON rows keyed by (sid, key). List items are separate
+    rows, so appending a turn writes one row instead of the whole history.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS state ("
+                "sid TEXT, key TEXT, value TEXT, PRIMARY KEY (sid, key))"
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS items ("
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, sid TEXT, key TEXT, value TEXT)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS items_sid_key ON items (sid, key)")
+
+    def _connect(self):
+        """Returns this thread's connection; sqlite3 connections are not shareable."""
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=30)
+        return db
+
+    def get(self, sid, key, default=None):
+        row = (
+            self._connect()
+            .execute("SELECT value FROM state WHERE sid = ? AND key = ?", (sid, key))
+            .fetchone()
+        )
+        return json.loads(row[0]) if row else default
+
+    def set(self, sid, key, value):
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO state (sid, key, value) VALUES (?, ?, ?)",
+                (sid, key, json.dumps(value)),
+            )
+
+    def items(self, sid, key):
+        """Returns the list stored under `key`, in insertion order."""
+        rows = self._connect().execute(
+            "SELECT value FROM items WHERE sid = ? AND key = ? ORDER BY seq", (sid, key)
+        )
+        return [json.loads(value) for (value,) in rows]
+
+    def append(self, sid, key, item):
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO items (sid, key, value) VALUES (?, ?, ?)",
+                (sid, key, json.dumps(item)),
+            )
+
+    def delete(self, sid, *keys):
+        with self._connect() as db:
+            for key in keys:
+                db.execute("DELETE FROM state WHERE sid = ? AND key = ?", (sid, key))
+                db.execute("DELETE FROM items WHERE sid = ? AND key = ?", (sid, key))
+
+
+def create_conversation_store(backend, path=None, max_sessions=10_000):
+    """Builds the configured store: "memory" or "sqlite"."""
+    if backend == "memory":
+        return InMemoryConversationStore(max_sessions=max_sessions)
+    if backend == "sqlite":
+        return SQLiteConversationStore(path)
+    raise ValueError(f"Unknown conversation store '{backend}', expected memory or sqlite.")
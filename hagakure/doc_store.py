@@ -0,0 +1,281 @@
+import mmap
+import os
+import threading
+
+import numpy as np
+
+# Per-document metadata: the source document a chunk came from and the chunk's
+# character span within that source.
+META_DTYPE = np.dtype([("source", "<u8"), ("start", "<u8"), ("end", "<u8")])
+
+
+class DocStore:
+    """Append-only document store backed by memory-mapped files.
+
+    `<path>.bin` holds the UTF-8 encoded documents back to back and
+    `<path>.idx` holds one uint64 end offset per document, so document `i`
+    is read lazily as `data[ends[i - 1]:ends[i]]` without loading the rest of
+    the store. `<path>.meta` holds one META_DTYPE record per document. All
+    files are only ever appended to, and pages are shared between every
+    process that maps them.
+
+    Readers may run in several threads while the store is remapped: the
+    mappings are swapped as one tuple, and replaced ones are never closed
+    while a reader may still hold them, only released once unreferenced.
+
+    The id ranges of each source's documents are kept in memory, built when
+    the store is opened and extended as documents are mapped, so looking up
+    a source's documents does not scan the metadata.
+    """
+
+    def __init__(self, path, repair=True):
+        self.data_path = f"{path}.bin"
+        self.offsets_path = f"{path}.idx"
+        self.meta_path = f"{path}.meta"
+        self._pending = []
+        # (ends, meta, data) mappings, replaced as a whole
+        self._maps = (
+            np.zeros(0, dtype=np.uint64),
+            np.zeros(0, dtype=META_DTYPE),
+            None,
+        )
+        self._lock = threading.RLock()  # Serializes remapping
+        # source -> [start, stop) id ranges of its committed documents, which
+        # cover the first `_ranged` documents
+        self._source_ranges = {}
+        self._ranged = 0
+        for p in (self.data_path, self.offsets_path, self.meta_path):
+            if not os.path.exists(p):
+                open(p, "ab").close()
+        self._next_source = 0
+        if repair:
+            self.repair()
+        else:
+            self.refresh()
+
+    @property
+    def _ends(self):
+        return self._maps[0]
+
+    @property
+    def _meta(self):
+        return self._maps[1]
+
+    @property
+    def _data(self):
+        return self._maps[2]
+
+    def _map(self):
+        """(Re)maps the files after they have grown.
+
+        Offsets are mapped first: data and metadata are written before them,
+        so the new mappings cover every document the offsets commit.
+        """
+        ends = self._map_array(self.offsets_path, np.uint64)
+        meta = self._map_array(self.meta_path, META_DTYPE)
+        data = None
+        if os.path.getsize(self.data_path):
+            with open(self.data_path, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        with self._lock:
+            self._maps = (ends, meta, data)
+            self._index_sources(ends, meta)
+
+    def _index_sources(self, ends, meta):
+        """Adds the documents mapped since the last call to the source ranges."""
+        n = min(len(ends), len(meta))
+        if n < self._ranged:
+            # The store was cut: rebuild from the start
+            self._source_ranges = {}
+            self._ranged = 0
+        sources = np.asarray(meta["source"][self._ranged : n])
+        if not len(sources):
+            return
+        bounds = np.flatnonzero(sources[1:] != sources[:-1]) + 1
+        starts = np.concatenate([[0], bounds]) + self._ranged
+        stops = np.concatenate([bounds, [len(sources)]]) + self._ranged
+        for source, start, stop in zip(
+            sources[starts - self._ranged].tolist(), starts.tolist(), stops.tolist()
+        ):
+            ranges = self._source_ranges.setdefault(source, [])
+            if ranges and ranges[-1][1] == start:
+                ranges[-1] = (ranges[-1][0], stop)
+            else:
+                ranges.append((start, stop))
+        self._ranged = n
+
+    @staticmethod
+    def _map_array(path, dtype):
+        """Maps the complete records of a file, ignoring a partly appended one."""
+        n = os.path.getsize(path) // np.dtype(dtype).itemsize
+        if n:
+            return np.memmap(path, dtype=dtype, mode="r", shape=(n,))
+        return np.zeros(0, dtype=dtype)
+
+    def repair(self):
+        """Cuts writes torn by a crash and backfills missing metadata.
+
+        Only safe while no other process is writing to the store.
+        """
+        self._map()
+        self._discard_torn_writes()
+        if len(self._meta) < len(self._ends):
+            self._backfill_meta()
+        self._update_next_source()
+
+    def _update_next_source(self):
+        if len(self._meta):
+            self._next_source = max(
+                self._next_source, int(self._meta["source"].max()) + 1
+            )
+
+    def _discard_torn_writes(self):
+        """Cuts data and metadata written by a flush that never wrote its offsets."""
+        size = int(self._ends[-1]) if len(self._ends) else 0
+        torn = os.path.getsize(self.data_path) > size or len(self._meta) > len(self._ends)
+        if torn:
+            # Only bytes past the committed documents are cut, which no
+            # reader maps, so the current mappings stay valid
+            n = len(self._ends)
+            os.truncate(self.data_path, size)
+            meta_size = min(os.path.getsize(self.meta_path), n * META_DTYPE.itemsize)
+            os.truncate(self.meta_path, meta_size)
+            self._map()
+
+    def _backfill_meta(self):
+        """Gives documents stored before metadata existed their own source each."""
+        rows = np.zeros(len(self._ends) - len(self._meta), dtype=META_DTYPE)
+        for row, i in enumerate(range(len(self._meta), len(self._ends))):
+            rows[row] = (i, 0, len(self[i]))
+        with open(self.meta_path, "ab") as f:
+            f.write(rows.tobytes())
+        self._map()
+
+    def __len__(self):
+        return len(self._ends) + len(self._pending)
+
+    def __getitem__(self, i):
+        ends, _, data = self._maps
+        if i < 0:
+            i += len(ends) + len(self._pending)
+        committed = len(ends)
+        if i >= committed:
+            return self._pending[i - committed][0]
+        start = int(ends[i - 1]) if i else 0
+        return data[start : int(ends[i])].decode("utf-8")
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def meta(self, i):
+        """Returns (source id, start, end) of document `i` within its source."""
+        ends, meta, _ = self._maps
+        if i < 0:
+            i += len(ends) + len(self._pending)
+        committed = len(ends)
+        if i >= committed:
+            return self._pending[i - committed][1]
+        source, start, end = meta[i].tolist()
+        return source, start, end
+
+    def ids_of_source(self, source):
+        """Ids of the documents (chunks) that came from a source document."""
+        with self._lock:
+            committed = len(self._ends)
+            ranges = [
+                np.arange(start, min(stop, committed))
+                for start, stop in self._source_ranges.get(source, ())
+            ]
+        pending = [
+            committed + i
+            for i, (_, meta) in enumerate(self._pending)
+            if meta[0] == source
+        ]
+        return np.concatenate(ranges + [pending]).astype(np.int64)
+
+    def new_source_id(self):
+        """Allocates the id for the next source document."""
+        source = self._next_source
+        self._next_source += 1
+        return source
+
+    def append(self, text, meta=None):
+        if meta is None:
+            meta = (self.new_source_id(), 0, len(text))
+        self._pending.append((text, meta))
+
+    def extend(self, texts, metas=None):
+        if metas is None:
+            metas = [None] * len(texts)
+        for text, meta in zip(texts, metas):
+            self.append(text, meta)
+
+    def flush(self):
+        """Appends pending documents to disk and remaps the store."""
+        if not self._pending:
+            return
+        end = int(self._ends[-1]) if len(self._ends) else 0
+        ends = []
+        with open(self.data_path, "ab") as f:
+            for text, _ in self._pending:
+                encoded = text.encode("utf-8")
+                f.write(encoded)
+                end += len(encoded)
+                ends.append(end)
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self.meta_path, "ab") as f:
+            metas = [meta for _, meta in self._pending]
+            f.write(np.array(metas, dtype=META_DTYPE).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        # Offsets are written last: they decide how many documents are committed
+        with open(self.offsets_path, "ab") as f:
+            f.write(np.asarray(ends, dtype=np.uint64).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with self._lock:
+            self._map()
+            self._pending = []
+
+    def refresh(self):
+        """Maps documents flushed by another process since the store was opened."""
+        with self._lock:
+            size = os.path.getsize(self.offsets_path)
+            if size >= self._ends.nbytes + 8 or size < self._ends.nbytes:
+                self._map()
+                self._update_next_source()
+
+    def truncate(self, n):
+        """Drops every document from `n` on, e.g. ones written after the last index save.
+
+        Unlike other writes, this is unsafe while other threads read the store,
+        and other processes must reopen it: documents written after the cut
+        reuse the dropped ids.
+        """
+        if n >= len(self):
+            return
+        committed = len(self._ends)
+        if n >= committed:
+            del self._pending[n - committed :]
+            return
+        self._pending = []
+        size = int(self._ends[n - 1]) if n else 0
+        self.close()
+        os.truncate(self.data_path, size)
+        os.truncate(self.offsets_path, n * np.dtype(np.uint64).itemsize)
+        os.truncate(self.meta_path, n * META_DTYPE.itemsize)
+        self._map()
+
+    def close(self):
+        """Releases the file mappings; no other thread may be reading the store."""
+        with self._lock:
+            data = self._data
+            self._maps = (
+                np.zeros(0, dtype=np.uint64),
+                np.zeros(0, dtype=META_DTYPE),
+                None,
+            )
+        if data is not None:
+            data.close()
@@ -0,0 +1,98 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class EmbeddingBatcher:
+    """Gathers concurrent embedding requests into micro-batches.
+
+    `submit(text)` returns a future of the text's embedding. A worker thread
+    takes the first pending text, waits up to `max_wait` seconds for more (or
+    until `max_batch_size` are pending), and embeds them all with a single
+    `encode(texts)` call, which returns one row per text. Texts submitted
+    while a batch is being encoded join the next one, so under load batches
+    grow without waiting. Identical texts in a batch are encoded once.
+
+    The worker starts on first use, and again in a forked child process,
+    which does not inherit its parent's threads.
+    """
+
+    def __init__(self, encode, max_batch_size=64, max_wait=0.005, on_batch=None):
+        self.encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.on_batch = on_batch
+        self.batches = 0
+        self.texts = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _ensure_worker(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                    threading.Thread(
+                        target=self._run,
+                        args=(self._queue,),
+                        name="embedding-batcher",
+                        daemon=True,
+                    ).start()
+                    self._pid = os.getpid()
+
+    def submit(self, text):
+        """Returns a Future of the embedding of `text`."""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def embed(self, text):
+        return self.submit(text).result()
+
+    def _collect(self, pending):
+        """Blocks for one request, then gathers more for up to max_wait seconds."""
+        batch = [pending.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout > 0:
+                    batch.append(pending.get(timeout=timeout))
+                else:
+                    batch.append(pending.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self, pending):
+        while True:
+            batch = self._collect(pending)
+            batch = [(text, f) for text, f in batch if f.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            texts = list(dict.fromkeys(text for text, _ in batch))
+            try:
+                embeddings = self.encode(texts)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            rows = dict(zip(texts, embeddings))
+            for text, future in batch:
+                future.set_result(rows[text])
+            self.batches += 1
+            self.texts += len(batch)
+            if self.on_batch is not None:
+                self.on_batch(len(texts))
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "texts": self.texts,
+            "mean_batch_size": self.texts / self.batches if self.batches else 0.0,
+            "pending": self._queue.qsize(),
+        }
@@ -0,0 +1,337 @@
+import os
+import struct
+
+import faiss
+import numpy as np
+
+# Supported index types and their faiss.index_factory descriptions
+INDEX_TYPES = {
+    "flat": "Flat",
+    "ivf_flat": "IVF{nlist},Flat",
+    "ivf_pq": "IVF{nlist},PQ{pq_m}",
+    "hnsw": "HNSW{hnsw_m},Flat",
+}
+
+# Similarity metrics: inner product (cosine on normalized embeddings) or L2
+METRICS = {"ip": faiss.METRIC_INNER_PRODUCT, "l2": faiss.METRIC_L2}
+
+# faiss warns below 39 training points per centroid
+MIN_POINTS_PER_CENTROID = 39
+
+
+def build_index(index_type, dim, metric="ip", nlist=1024, pq_m=48, hnsw_m=32):
+    """Creates an empty index of the given type and metric."""
+    if index_type not in INDEX_TYPES:
+        raise ValueError(
+            f"Unknown index type '{index_type}', expected one of {sorted(INDEX_TYPES)}."
+        )
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric '{metric}', expected one of {sorted(METRICS)}.")
+    description = INDEX_TYPES[index_type].format(nlist=nlist, pq_m=pq_m, hnsw_m=hnsw_m)
+    return faiss.index_factory(dim, description, METRICS[metric])
+
+
+def metric_of(index):
+    """Returns the METRICS key matching an existing index."""
+    return "ip" if index.metric_type == faiss.METRIC_INNER_PRODUCT else "l2"
+
+
+def cosine_scores(index, distances):
+    """Converts search distances to cosine similarities, assuming normalized vectors.
+
+    Inner-product results already are cosine similarities; squared L2 distances
+    between unit vectors relate to them as d = 2 - 2 * cos.
+    """
+    if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+        return distances
+    return 1 - distances / 2
+
+
+def base_index(index):
+    """The index an IndexIDMap wraps, or `index` itself."""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def wrap_ids(index, ids=None):
+    """Wraps `index` in an IndexIDMap2 whose vectors have the given ids.
+
+    `ids` default to the vectors' positions, the ids they had unwrapped.
+    """
+    if ids is None:
+        ids = np.arange(index.ntotal, dtype=np.int64)
+    # IndexIDMap2 only wraps empty indexes; the vectors are kept as they are
+    ntotal = index.ntotal
+    index.ntotal = 0
+    wrapped = faiss.IndexIDMap2(index)
+    index.ntotal = wrapped.ntotal = ntotal
+    faiss.copy_array_to_vector(np.asarray(ids, dtype=np.int64), wrapped.id_map)
+    wrapped.construct_rev_map()
+    return wrapped
+
+
+def ids_of(index):
+    """The ids of the vectors of an IndexIDMap2, in storage order."""
+    if isinstance(index, MappedFlatIndex):
+        return np.asarray(index.ids)
+    return faiss.vector_to_array(index.id_map)
+
+
+class MappedFlatIndex:
+    """A flat IndexIDMap2 file searched in place, its vectors mapped with np.memmap.
+
+    Before 1.11, faiss copies the vectors of a flat index into memory when
+    it reads one, even with IO_FLAG_MMAP. Mapping them instead opens an
+    index of any size at once, and processes share its pages in the OS page
+    cache. Read-only: it supports what LiveIndex asks of a snapshot.
+    Raises ValueError for a file holding any other index.
+    """
+
+    # Index types written for IndexFlatIP, IndexFlatL2 and IndexFlat
+    FOURCCS = (b"IxFI", b"IxF2", b"IxFl")
+
+    def __init__(self, path):
+        self._live = None  # (exclude, bitmap) of the last search with exclusions
+        with open(path, "rb") as f:
+            header = f.read(41)
+        # Index header: d, ntotal, two unused fields, is_trained, metric_type
+        if len(header) < 41 or header[:4] != b"IxM2":
+            raise ValueError(f"{path} is not an IndexIDMap2.")
+        self.d, self.ntotal = struct.unpack_from("<iq", header, 4)
+        (self.metric_type,) = struct.unpack_from("<i", header, 33)
+        if self.metric_type not in METRICS.values() or header[37:] not in self.FOURCCS:
+            raise ValueError(f"{path} does not hold a flat index.")
+        # The file ends with the vectors and the id map, each after its length
+        ids_offset = os.path.getsize(path) - 8 * self.ntotal
+        vectors_offset = ids_offset - 8 - 4 * self.d * self.ntotal
+        with open(path, "rb") as f:
+            f.seek(vectors_offset - 8)
+            (num_values,) = struct.unpack("<Q", f.read(8))
+            f.seek(ids_offset - 8)
+            (num_ids,) = struct.unpack("<Q", f.read(8))
+        if num_ids != self.ntotal or num_values not in (
+            self.d * self.ntotal,
+            4 * self.d * self.ntotal,
+        ):
+            raise ValueError(f"{path} has an unexpected flat index layout.")
+        if self.ntotal:
+            self.vectors = np.memmap(
+                path,
+                dtype=np.float32,
+                mode="r",
+                offset=vectors_offset,
+                shape=(self.ntotal, self.d),
+            )
+            self.ids = np.memmap(
+                path, dtype=np.int64, mode="r", offset=ids_offset, shape=(self.ntotal,)
+            )
+        else:
+            self.vectors = np.zeros((0, self.d), dtype=np.float32)
+            self.ids = np.zeros(0, dtype=np.int64)
+
+    def search(self, queries, k, exclude=None):
+        """Exact search, like `faiss.Index.search`; missing results have id -1.
+
+        Vectors whose ids are in `exclude` are skipped while searching.
+        """
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        if not self.ntotal:
+            worst = np.inf if self.metric_type == faiss.METRIC_L2 else -np.inf
+            return (
+                np.full((len(queries), k), worst, dtype=np.float32),
+                np.full((len(queries), k), -1, dtype=np.int64),
+            )
+        live = self._live_rows(exclude)
+        if live is None:
+            distances, labels = faiss.knn(
+                queries, self.vectors, k, metric=self.metric_type
+            )
+        else:
+            distances, labels = self._knn(queries, k, live)
+        return distances, np.where(labels < 0, -1, self.ids[np.maximum(labels, 0)])
+
+    def _live_rows(self, exclude):
+        """A bitmap of the rows whose ids are not in `exclude`, or None for all rows.
+
+        The bitmap of the last `exclude` array is kept: LiveIndex replaces its
+        deleted ids rather than modifying them.
+        """
+        if exclude is None or not len(exclude):
+            return None
+        cached = self._live
+        if cached is not None and cached[0] is exclude:
+            return cached[1]
+        excluded = np.isin(self.ids, exclude)
+        live = None
+        if excluded.any():
+            live = np.packbits(~excluded, bitorder="little")
+        self._live = (exclude, live)
+        return live
+
+    def _knn(self, queries, k, live):
+        """`faiss.knn` restricted to the rows set in the `live` bitmap."""
+        selector = faiss.IDSelectorBitmap(self.ntotal, faiss.swig_ptr(live))
+        distances = np.empty((len(queries), k), dtype=np.float32)
+        labels = np.empty((len(queries), k), dtype=np.int64)
+        args = (
+            faiss.swig_ptr(queries),
+            faiss.swig_ptr(np.ascontiguousarray(self.vectors)),
+            self.d,
+            len(queries),
+            self.ntotal,
+            k,
+            faiss.swig_ptr(distances),
+            faiss.swig_ptr(labels),
+        )
+        if self.metric_type == faiss.METRIC_L2:
+            faiss.knn_L2sqr(*args, None, selector)
+        else:
+            faiss.knn_inner_product(*args, selector)
+        return distances, labels
+
+
+def remove_vectors(index, ids):
+    """Removes vectors by id from an IndexIDMap2 and returns the resulting index.
+
+    Only flat indexes renumber their vectors on removal as IndexIDMap2
+    expects; IVF and HNSW indexes are rebuilt without the removed vectors.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    inner = base_index(index)
+    index_type = index_type_of(inner)
+    if index_type == "flat":
+        index.remove_ids(faiss.IDSelectorBatch(ids))
+        return index
+    all_ids = ids_of(index)
+    keep = ~np.isin(all_ids, ids)
+    if index_type != "hnsw":
+        return wrap_ids(rebuild_ivf(inner, keep), all_ids[keep])
+    rebuilt = faiss.IndexHNSWFlat(
+        inner.d, inner.hnsw.nb_neighbors(1), inner.metric_type
+    )
+    rebuilt.hnsw.efConstruction = inner.hnsw.efConstruction
+    rebuilt.hnsw.efSearch = inner.hnsw.efSearch
+    rebuilt = faiss.IndexIDMap2(rebuilt)
+    for start, vectors in zip(range(0, inner.ntotal, 100_000), iter_vectors(inner)):
+        mask = keep[start : start + len(vectors)]
+        rebuilt.add_with_ids(vectors[mask], all_ids[start : start + len(vectors)][mask])
+    return rebuilt
+
+
+def rebuild_ivf(index, keep):
+    """A copy of an IVF index holding only the vectors where `keep` is true.
+
+    Their codes are copied list by list, not re-encoded, and they are
+    renumbered in order, as IndexIDMap2 expects after a removal.
+    """
+    ivf = faiss.extract_index_ivf(index)
+    rebuilt = faiss.clone_index(index)
+    rebuilt.reset()
+    rebuilt_ivf = faiss.extract_index_ivf(rebuilt)
+    labels = np.cumsum(keep) - 1  # Old label: new label
+    code_size = ivf.invlists.code_size
+    for list_no in range(ivf.nlist):
+        size = ivf.invlists.list_size(list_no)
+        if not size:
+            continue
+        old = faiss.rev_swig_ptr(ivf.invlists.get_ids(list_no), size)
+        codes = faiss.rev_swig_ptr(ivf.invlists.get_codes(list_no), size * code_size)
+        mask = keep[old]
+        if not mask.any():
+            continue
+        new = np.ascontiguousarray(labels[old[mask]], dtype=np.int64)
+        kept = np.ascontiguousarray(codes.reshape(size, code_size)[mask])
+        rebuilt_ivf.invlists.add_entries(
+            list_no, len(new), faiss.swig_ptr(new), faiss.swig_ptr(kept)
+        )
+    rebuilt_ivf.ntotal = rebuilt.ntotal = int(keep.sum())
+    if ivf.direct_map.type != faiss.DirectMap.NoMap:
+        rebuilt_ivf.make_direct_map()
+    return rebuilt
+
+
+def index_type_of(index):
+    """Returns the INDEX_TYPES key matching an existing index."""
+    index = base_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVFFlat):
+        return "ivf_flat"
+    return "flat"
+
+
+def min_train_size(index_type, nlist=1024):
+    """Number of vectors needed before an index of this type can be trained."""
+    if index_type in ("ivf_flat", "ivf_pq"):
+        return nlist * MIN_POINTS_PER_CENTROID
+    return 0
+
+
+def train_index(index, vectors, sample_size=100_000, seed=1234):
+    """Trains the index on a random sample of `vectors`, if it needs training."""
+    if index.is_trained:
+        return
+    if len(vectors) > sample_size:
+        rng = np.random.default_rng(seed)
+        vectors = vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))]
+    index.train(np.ascontiguousarray(vectors, dtype=np.float32))
+
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    """Applies the query-time recall/latency tunables that apply to `index`."""
+    index = base_index(index)
+    index_type = index_type_of(index)
+    if index_type in ("ivf_flat", "ivf_pq") and nprobe:
+        faiss.extract_index_ivf(index).nprobe = nprobe
+    elif index_type == "hnsw" and ef_search:
+        index.hnsw.efSearch = ef_search
+
+
+def search_excluding(index, queries, k, ids):
+    """Searches `index` like `index.search`, leaving out the vectors with `ids`.
+
+    The ids are skipped during the search (an IDSelector, or a mask for a
+    MappedFlatIndex), so `k` results are found without fetching extra ones.
+    The index's nprobe or efSearch still applies.
+    """
+    if isinstance(index, MappedFlatIndex):
+        return index.search(queries, k, exclude=ids)
+    if not len(ids):
+        return index.search(queries, k)
+    batch = faiss.IDSelectorBatch(np.ascontiguousarray(ids, dtype=np.int64))
+    selector = faiss.IDSelectorNot(batch)
+    inner = base_index(index)
+    index_type = index_type_of(inner)
+    if index_type in ("ivf_flat", "ivf_pq"):
+        params = faiss.SearchParametersIVF(
+            sel=selector, nprobe=faiss.extract_index_ivf(inner).nprobe
+        )
+    elif index_type == "hnsw":
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=inner.hnsw.efSearch)
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    return index.search(queries, k, params=params)
+
+
+def iter_vectors(index, chunk_size=100_000):
+    """Yields the vectors stored in a flat index, chunk by chunk."""
+    for start in range(0, index.ntotal, chunk_size):
+        yield index.reconstruct_n(start, min(chunk_size, index.ntotal - start))
+
+
+def migrate_index(flat_index, target, sample_size=100_000, chunk_size=100_000):
+    """Copies every vector of a flat index into `target`, training it first.
+
+    Vector ids are preserved, since vectors are added in their original order.
+    """
+    if not target.is_trained:
+        sample = min(sample_size, flat_index.ntotal)
+        rng = np.random.default_rng(1234)
+        ids = np.sort(rng.choice(flat_index.ntotal, sample, replace=False))
+        target.train(flat_index.reconstruct_batch(ids))
+    for vectors in iter_vectors(flat_index, chunk_size):
+        target.add(vectors)
+    return target
@@ -0,0 +1,305 @@
+import hashlib
+import json
+import os
+import re
+import struct
+import threading
+from collections import Counter, defaultdict
+
+import numpy as np
+
+# BM25 term frequency saturation and document length normalization
+K1 = 1.2
+B = 0.75
+# Below this many documents, document frequencies say little about how common
+# a term is, so no query term is pruned as too common
+PRUNE_MIN_DOCS = 100
+
+MAGIC = b"HGLX"
+_TERM = re.compile(r"\w+")
+
+# Dropped from queries: they match most documents and carry no meaning
+STOPWORDS = frozenset(
+    """a about above after again against all am an and any are as at be because
+    been before being below between both but by can could did do does doing
+    down during each few for from further had has have having he her here hers
+    herself him himself his how i if in into is it its itself just me more most
+    my myself no nor not now of off on once only or other our ours ourselves
+    out over own same she should so some such than that the their theirs them
+    themselves then there these they this those through to too under until up
+    very was we were what when where which while who whom why will with would
+    you your yours yourself yourselves""".split()
+)
+
+
+def tokenize(text):
+    """Lowercased words; identifiers such as "4417-B" split into "4417" and "b"."""
+    return _TERM.findall(text.lower())
+
+
+def query_terms(query):
+    """The terms of a query that are searched: its tokens without stopwords."""
+    return [term for term in tokenize(query) if term not in STOPWORDS]
+
+
+def term_hash(term):
+    """A stable 64-bit id for a term, so the snapshot stores no strings."""
+    digest = hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") & 0x7FFFFFFFFFFFFFFF
+
+
+def write_arrays(path, header, arrays):
+    """Writes named numpy arrays to one file, 8-byte aligned so they can be mapped.
+
+    The file is written to a temporary path and renamed over `path`.
+    """
+    header = dict(header, arrays={})
+    offset = 0
+    for name, array in arrays.items():
+        header["arrays"][name] = [array.dtype.str, offset, len(array)]
+        offset += -(-array.nbytes // 8) * 8
+    encoded = json.dumps(header).encode("utf-8")
+    encoded += b" " * (-(len(MAGIC) + 4 + len(encoded)) % 8)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC + struct.pack("<I", len(encoded)) + encoded)
+        for array in arrays.values():
+            f.write(array.tobytes())
+            f.write(b"\0" * (-array.nbytes % 8))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_arrays(path):
+    """Maps the arrays of a file written by `write_arrays`; returns (header, arrays)."""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a lexical index.")
+        (size,) = struct.unpack("<I", f.read(4))
+        header = json.loads(f.read(size))
+    start = len(MAGIC) + 4 + size
+    arrays = {}
+    for name, (dtype, offset, length) in header.pop("arrays").items():
+        if length:
+            arrays[name] = np.memmap(
+                path, dtype=dtype, mode="r", offset=start + offset, shape=(length,)
+            )
+        else:
+            arrays[name] = np.zeros(0, dtype=dtype)
+    return header, arrays
+
+
+class LexicalIndex:
+    """A BM25 inverted index over the documents of a DocStore.
+
+    Like LiveIndex, it is a snapshot plus the documents added since. The
+    snapshot at `path` covers the first `num_docs` documents: sorted term
+    hashes, each with a slice of the postings (uint32 document ids and
+    uint16 term frequencies), and every document's length, all memory-mapped.
+    The doc store itself serves as the log: `refresh(store)` tokenizes the
+    documents appended since into an in-memory delta, in the writer as it
+    ingests and in other processes as they pick up changes. `compact`
+    merges both into a new snapshot, dropping deleted documents.
+
+    Deleted documents stay in the postings until compaction; `search` is
+    given a liveness check to leave them out.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()  # Guards the delta and snapshot swaps
+        self._refresh_lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        header, arrays = {"num_docs": 0, "total_length": 0}, {}
+        identity = None
+        if os.path.exists(self.path):
+            identity = os.stat(self.path).st_ino
+            header, arrays = read_arrays(self.path)
+        with self._lock:
+            self._identity = identity
+            self.num_docs = header["num_docs"]
+            self._total_length = header["total_length"]
+            self._terms = arrays.get("terms", np.zeros(0, dtype=np.int64))
+            self._offsets = arrays.get("offsets", np.zeros(1, dtype=np.uint64))
+            self._docs = arrays.get("docs", np.zeros(0, dtype=np.uint32))
+            self._tfs = arrays.get("tfs", np.zeros(0, dtype=np.uint16))
+            self._lengths = arrays.get("lengths", np.zeros(0, dtype=np.uint32))
+            self._live_docs = header.get("live_docs", 0)
+            # Delta: documents from num_docs on
+            self._postings = defaultdict(lambda: ([], []))
+            self._delta_lengths = []
+
+    @property
+    def end(self):
+        """Id of the first document not indexed yet."""
+        return self.num_docs + len(self._delta_lengths)
+
+    def _add(self, texts):
+        postings = self._postings
+        for text in texts:
+            counts = Counter(tokenize(text))
+            doc = self.end
+            for term, tf in counts.items():
+                docs, tfs = postings[term_hash(term)]
+                docs.append(doc)
+                tfs.append(min(tf, 0xFFFF))
+            self._delta_lengths.append(sum(counts.values()))
+
+    def refresh(self, store):
+        """Indexes the documents of `store` added since, reloading a new snapshot."""
+        with self._refresh_lock:
+            exists = os.path.exists(self.path)
+            if (os.stat(self.path).st_ino if exists else None) != self._identity:
+                self._load()
+            if len(store) > self.end:
+                texts = [store[i] for i in range(self.end, len(store))]
+                with self._lock:
+                    self._add(texts)
+
+    def _document_frequency(self, term):
+        """Number of documents containing a term, in the snapshot and delta."""
+        key = term_hash(term)
+        i = np.searchsorted(self._terms, key)
+        df = 0
+        if i < len(self._terms) and self._terms[i] == key:
+            df = int(self._offsets[i + 1]) - int(self._offsets[i])
+        if key in self._postings:
+            df += len(self._postings[key][0])
+        return df
+
+    def _postings_of(self, term):
+        """(document ids, term frequencies) of a term in the snapshot and delta."""
+        key = term_hash(term)
+        i = np.searchsorted(self._terms, key)
+        docs, tfs = [], []
+        if i < len(self._terms) and self._terms[i] == key:
+            start, stop = int(self._offsets[i]), int(self._offsets[i + 1])
+            docs.append(self._docs[start:stop].astype(np.int64))
+            tfs.append(self._tfs[start:stop].astype(np.float32))
+        if key in self._postings:
+            delta_docs, delta_tfs = self._postings[key]
+            docs.append(np.array(delta_docs, dtype=np.int64))
+            tfs.append(np.array(delta_tfs, dtype=np.float32))
+        if not docs:
+            return None
+        return np.concatenate(docs), np.concatenate(tfs)
+
+    def search(self, query, k, is_live=None, max_df=1.0, min_match=0.0):
+        """Returns the ids and BM25 scores of the `k` best matching documents.
+
+        Stopwords and, once there are PRUNE_MIN_DOCS documents, terms found in
+        more than a `max_df` fraction of them are not searched: they tell few
+        documents apart and have the longest postings. A document must match query
+        terms holding at least a `min_match` fraction of the query's total
+        idf. `is_live(ids)`, if given, filters out deleted documents.
+        """
+        empty = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        # Postings are gathered under the lock, scored outside it: snapshot
+        # arrays are never modified and the delta's are copied
+        with self._lock:
+            num_docs = self._live_docs + len(self._delta_lengths)
+            if not num_docs:
+                return empty
+            avg_length = (self._total_length + sum(self._delta_lengths)) / num_docs
+            delta_lengths = np.array(self._delta_lengths, dtype=np.float32)
+            snapshot_docs, snapshot_lengths = self.num_docs, self._lengths
+            terms, total_idf = [], 0.0
+            for term, count in Counter(query_terms(query)).items():
+                df = self._document_frequency(term)
+                if not df or (num_docs >= PRUNE_MIN_DOCS and df > max_df * num_docs):
+                    continue
+                idf = np.log1p((max(num_docs - df, 0) + 0.5) / (df + 0.5))
+                terms.append((count, idf, self._postings_of(term)))
+                total_idf += count * idf
+        if not terms:
+            return empty
+        all_docs, all_scores, all_idf = [], [], []
+        for count, idf, (docs, tfs) in terms:
+            in_snapshot = docs < snapshot_docs
+            lengths = np.empty(len(docs), dtype=np.float32)
+            lengths[in_snapshot] = snapshot_lengths[docs[in_snapshot]]
+            lengths[~in_snapshot] = delta_lengths[docs[~in_snapshot] - snapshot_docs]
+            norm = K1 * (1 - B + B * lengths / max(avg_length, 1e-9))
+            all_docs.append(docs)
+            all_scores.append(count * idf * tfs * (K1 + 1) / (tfs + norm))
+            all_idf.append(np.full(len(docs), count * idf))
+        docs, inverse = np.unique(np.concatenate(all_docs), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores))
+        if min_match:
+            matched = np.bincount(inverse, weights=np.concatenate(all_idf))
+            keep = matched >= min_match * total_idf
+            docs, scores = docs[keep], scores[keep]
+        order = np.argsort(-scores, kind="stable")
+        if is_live is None:
+            top = order[:k]
+        else:
+            # Only the best documents are checked, a batch at a time
+            top, batch = [], max(4 * k, 64)
+            for start in range(0, len(order), batch):
+                ids = order[start : start + batch]
+                top.extend(ids[is_live(docs[ids])].tolist())
+                if len(top) >= k:
+                    break
+            top = np.array(top[:k], dtype=np.int64)
+        return docs[top], scores[top].astype(np.float32)
+
+    def compact(self, is_live):
+        """Writes the snapshot and delta into a new snapshot without deleted documents.
+
+        `is_live(ids)` returns which of `ids` are still indexed.
+        """
+        with self._refresh_lock:
+            self._compact(is_live)
+
+    def _compact(self, is_live):
+        with self._lock:
+            end = self.end
+            terms = [np.repeat(self._terms, np.diff(self._offsets).astype(np.int64))]
+            docs = [np.asarray(self._docs, dtype=np.int64)]
+            tfs = [np.asarray(self._tfs)]
+            for key, (delta_docs, delta_tfs) in self._postings.items():
+                terms.append(np.full(len(delta_docs), key, dtype=np.int64))
+                docs.append(np.array(delta_docs, dtype=np.int64))
+                tfs.append(np.array(delta_tfs, dtype=np.uint16))
+            lengths = np.concatenate(
+                [self._lengths, np.array(self._delta_lengths, dtype=np.uint32)]
+            )
+        terms, docs, tfs = (
+            np.concatenate(terms),
+            np.concatenate(docs),
+            np.concatenate(tfs),
+        )
+        live = is_live(np.arange(end, dtype=np.int64))
+        keep = live[docs]
+        terms, docs, tfs = terms[keep], docs[keep], tfs[keep]
+        order = np.lexsort((docs, terms))
+        terms, docs, tfs = terms[order], docs[order], tfs[order]
+        unique_terms, starts = np.unique(terms, return_index=True)
+        lengths[~live] = 0
+        write_arrays(
+            self.path,
+            {
+                "num_docs": int(end),
+                "live_docs": int(live.sum()),
+                "total_length": int(lengths.sum()),
+            },
+            {
+                "terms": unique_terms.astype(np.int64),
+                "offsets": np.append(starts, len(terms)).astype(np.uint64),
+                "docs": docs.astype(np.uint32),
+                "tfs": tfs.astype(np.uint16),
+                "lengths": lengths.astype(np.uint32),
+            },
+        )
+        self._load()
+
+    def stats(self):
+        return {
+            "snapshot_docs": self.num_docs,
+            "delta_docs": len(self._delta_lengths),
+            "terms": len(self._terms),
+            "postings": len(self._docs),
+        }
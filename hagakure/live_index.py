@@ -0,0 +1,227 @@
+import os
+import threading
+
+import faiss
+import numpy as np
+
+from index_factory import (
+    MappedFlatIndex,
+    base_index,
+    ids_of,
+    remove_vectors,
+    search_excluding,
+)
+from wal import ADD, DELETE, WriteAheadLog
+
+
+class LiveIndex:
+    """A FAISS index snapshot plus the changes logged since it was written.
+
+    The snapshot is an IndexIDMap2 read from `path` (memory-mapped with
+    `mmap`, flat ones as a MappedFlatIndex) that is never modified in place.
+    Every change is first appended to the write-ahead log at `wal_path`, so
+    ingestion costs I/O in the size of the batch, not of the corpus. Vectors
+    added since the snapshot are held in a small in-memory flat index (the
+    delta); snapshot vectors deleted since are skipped when searching.
+
+    `compact()` writes the snapshot and the log into a new snapshot, replaces
+    the file atomically and starts a new log. Other processes follow with
+    `refresh()`, which replays records appended to the log, or reloads the
+    snapshot when the log was replaced by a compaction.
+
+    `new_index()` returns the empty IndexIDMap2 used until a snapshot is
+    written, and `configure(index)` is applied to every snapshot loaded.
+    Only one process may write at a time.
+    """
+
+    def __init__(self, path, wal_path, dim, new_index, mmap=True, configure=None):
+        self.path = path
+        self.dim = dim
+        self.new_index = new_index
+        self.mmap = mmap
+        self.configure = configure
+        self.wal = WriteAheadLog(wal_path, dim)
+        self._lock = threading.Lock()  # Guards the delta and state swaps
+        self._write_lock = threading.RLock()
+        self._load()
+
+    def _read_snapshot(self, mmap):
+        if not os.path.exists(self.path):
+            return self.new_index()
+        flags = 0
+        if mmap:
+            try:
+                return MappedFlatIndex(self.path)
+            except ValueError:
+                pass
+            # IO_FLAG_MMAP maps IVF lists only; IO_FLAG_MMAP_IFC (faiss >=
+            # 1.11) maps the whole file, HNSW storage included, but fails on
+            # IVF lists when combined with IO_FLAG_MMAP
+            flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+            flags |= faiss.IO_FLAG_READ_ONLY
+        return faiss.read_index(self.path, flags)
+
+    def _load(self):
+        """(Re)loads the snapshot and replays the whole log over it."""
+        with self._write_lock:
+            # The log is read first: a snapshot written after it is only
+            # newer, and replaying older records over it changes nothing.
+            records, offset, identity = self.wal.read(0)
+            snapshot = self._read_snapshot(self.mmap)
+            if self.configure is not None:
+                self.configure(snapshot)
+            snapshot_ids = ids_of(snapshot)
+            if np.any(snapshot_ids[1:] < snapshot_ids[:-1]):
+                snapshot_ids = np.sort(snapshot_ids)
+            with self._lock:
+                self.snapshot = snapshot
+                self._snapshot_ids = snapshot_ids
+                self.delta = faiss.IndexIDMap2(
+                    faiss.IndexFlat(self.dim, snapshot.metric_type)
+                )
+                self._delta_ids = set()
+                self.deleted = np.zeros(0, dtype=np.int64)
+                self._apply(records)
+            self._offset = offset
+            self._identity = identity
+
+    @property
+    def metric_type(self):
+        return self.snapshot.metric_type
+
+    @property
+    def ntotal(self):
+        return self.snapshot.ntotal - len(self.deleted) + self.delta.ntotal
+
+    @property
+    def pending(self):
+        """Number of logged additions and deletions not yet compacted."""
+        return self.delta.ntotal + len(self.deleted)
+
+    def _in_snapshot(self, ids):
+        pos = np.searchsorted(self._snapshot_ids, ids)
+        found = np.zeros(len(ids), dtype=bool)
+        inside = pos < len(self._snapshot_ids)
+        found[inside] = self._snapshot_ids[pos[inside]] == ids[inside]
+        return found
+
+    def _is_live(self, ids):
+        live = self._in_snapshot(ids) & ~np.isin(ids, self.deleted)
+        return live | np.isin(ids, list(self._delta_ids))
+
+    def _apply(self, records):
+        """Applies log records; replaying one that was already applied is a no-op."""
+        for op, ids, vectors in records:
+            if op == ADD:
+                new = ~self._is_live(ids)
+                if new.any():
+                    self.delta.add_with_ids(vectors[new], ids[new])
+                    self._delta_ids.update(ids[new].tolist())
+            elif op == DELETE:
+                in_delta = np.isin(ids, list(self._delta_ids))
+                if in_delta.any():
+                    self.delta.remove_ids(faiss.IDSelectorBatch(ids[in_delta]))
+                    self._delta_ids.difference_update(ids[in_delta].tolist())
+                gone = ids[self._in_snapshot(ids) & ~in_delta]
+                self.deleted = np.union1d(self.deleted, gone)
+
+    def contains(self, ids):
+        """Which of `ids` are live: added and not deleted since."""
+        with self._lock:
+            return self._is_live(np.asarray(ids, dtype=np.int64))
+
+    def _write(self, op, ids, vectors=None):
+        with self._write_lock:
+            self.refresh()
+            # Cuts a record torn by a crash of the previous writer
+            self.wal.truncate(self._offset)
+            self.wal.append(op, ids, vectors)
+            with self._lock:
+                self._apply([(op, ids, vectors)])
+            self._offset = self.wal.size()
+
+    def add(self, ids, vectors):
+        """Logs and adds vectors under the given ids, which must be new."""
+        ids = np.asarray(ids, dtype=np.int64)
+        self._write(ADD, ids, np.ascontiguousarray(vectors, dtype=np.float32))
+
+    def remove(self, ids):
+        """Logs and deletes the live ones of `ids`; returns how many there were."""
+        with self._write_lock:
+            ids = np.asarray(ids, dtype=np.int64)
+            live = ids[self.contains(ids)]
+            if len(live):
+                self._write(DELETE, live)
+            return len(live)
+
+    def search(self, queries, k):
+        """Searches the snapshot and the delta, like `faiss.Index.search`."""
+        with self._lock:
+            snapshot, deleted = self.snapshot, self.deleted
+            results = []
+            if self.delta.ntotal:
+                results.append(self.delta.search(queries, k))
+        # Snapshot searches need no lock: snapshots are replaced, never modified.
+        # Deleted vectors are skipped by the search itself.
+        if snapshot.ntotal or not results:
+            results.append(search_excluding(snapshot, queries, k, deleted))
+
+        distances = np.concatenate([d for d, _ in results], axis=1)
+        ids = np.concatenate([i for _, i in results], axis=1)
+        invalid = ids < 0
+        ascending = self.metric_type != faiss.METRIC_INNER_PRODUCT
+        keys = np.where(invalid, np.inf, distances if ascending else -distances)
+        order = np.argsort(keys, axis=1, kind="stable")[:, :k]
+        distances = np.take_along_axis(distances, order, axis=1)
+        ids = np.take_along_axis(np.where(invalid, -1, ids), order, axis=1)
+        if ids.shape[1] < k:
+            pad = k - ids.shape[1]
+            distances = np.pad(distances, ((0, 0), (0, pad)))
+            ids = np.pad(ids, ((0, 0), (0, pad)), constant_values=-1)
+        return distances, ids
+
+    def refresh(self):
+        """Picks up changes logged by another process; returns whether any were."""
+        with self._write_lock:
+            records, offset, identity = self.wal.read(self._offset)
+            if identity != self._identity:
+                self._load()
+                return True
+            if not records:
+                return False
+            with self._lock:
+                self._apply(records)
+            self._offset = offset
+            return True
+
+    def compact(self, transform=None):
+        """Writes the logged changes into a new snapshot and starts a new log.
+
+        `transform(index)`, if given, may return a replacement for the new
+        snapshot, e.g. one migrated to another index type.
+        """
+        with self._write_lock:
+            self.refresh()
+            if not self.pending and transform is None and os.path.exists(self.path):
+                return
+            index = self._read_snapshot(mmap=False)
+            if len(self.deleted):
+                index = remove_vectors(index, self.deleted)
+            if self.delta.ntotal:
+                vectors = base_index(self.delta).reconstruct_n(0, self.delta.ntotal)
+                index.add_with_ids(vectors, ids_of(self.delta))
+            if transform is not None:
+                index = transform(index)
+            tmp_path = f"{self.path}.tmp"
+            faiss.write_index(index, tmp_path)
+            os.replace(tmp_path, self.path)
+            self.wal.reset()
+            self._load()
+
+    def stats(self):
+        return {
+            "snapshot": self.snapshot.ntotal,
+            "delta": self.delta.ntotal,
+            "deleted": len(self.deleted),
+            "wal_bytes": self._offset,
+        }
@@ -0,0 +1,201 @@
+import contextlib
+import contextvars
+import json
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+
+from config import getenv
+from context_budget import count_tokens, message_tokens
+
+# Print one JSON line with the timings and counters of each prompt request
+JSON_LOG = getenv("HAGAKURE_JSON_LOG", "0") == "1"
+
+LATENCY_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    120,
+)
+TOKEN_BUCKETS = (16, 64, 256, 1024, 4096, 16384, 65536, 131072)
+
+stage_seconds = Histogram(
+    "hagakure_stage_seconds",
+    "Duration of request stages: embedding, search, retrieval, prompt_assembly",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+time_to_first_token_seconds = Histogram(
+    "hagakure_time_to_first_token_seconds",
+    "Time from sending a generation request to its first token",
+    ["provider"],
+    buckets=LATENCY_BUCKETS,
+)
+generation_seconds = Histogram(
+    "hagakure_generation_seconds",
+    "Duration of a generation, until its last token",
+    ["provider"],
+    buckets=LATENCY_BUCKETS,
+)
+request_seconds = Histogram(
+    "hagakure_request_seconds",
+    "Duration of a prompt request, end to end",
+    ["endpoint"],
+    buckets=LATENCY_BUCKETS,
+)
+tokens = Histogram(
+    "hagakure_tokens",
+    "Tokens sent to (in) and received from (out) a provider per generation",
+    ["provider", "direction"],
+    buckets=TOKEN_BUCKETS,
+)
+embedding_batch_size = Histogram(
+    "hagakure_embedding_batch_size",
+    "Distinct queries embedded per micro-batch",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+cache_lookups = Counter(
+    "hagakure_cache_lookups_total",
+    "Cache lookups by cache (embedding, search, response) and result",
+    ["cache", "result"],
+)
+
+_current_trace = contextvars.ContextVar("hagakure_trace", default=None)
+
+
+class Trace:
+    """Timings and counters of one request, logged as one JSON line when finished."""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.spans = {}
+        self.fields = {}
+
+    def add_span(self, name, seconds):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def finish(self):
+        seconds = time.perf_counter() - self.started
+        request_seconds.labels(self.endpoint).observe(seconds)
+        if JSON_LOG:
+            spans = {name: round(value, 6) for name, value in self.spans.items()}
+            record = {"endpoint": self.endpoint, "seconds": round(seconds, 6)}
+            print(json.dumps({**record, "spans": spans, **self.fields}))
+
+
+def start_trace(endpoint, **fields):
+    """Starts the trace that spans and cache lookups of this request report to."""
+    trace = Trace(endpoint)
+    trace.set(**fields)
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextlib.contextmanager
+def span(stage):
+    """Times a request stage into its histogram and the current trace."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        stage_seconds.labels(stage).observe(seconds)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_span(stage, seconds)
+
+
+def record_cache(cache, hit):
+    cache_lookups.labels(cache, "hit" if hit else "miss").inc()
+    trace = _current_trace.get()
+    if trace is not None:
+        # The first lookup counts: the response cache embeds the prompt again
+        trace.fields.setdefault("cache_hits", {}).setdefault(cache, hit)
+
+
+def record_generation(provider, first_token, seconds, messages, response, trace=None):
+    """Records one generation of `response` from `messages`.
+
+    `first_token` is None when the generation was not streamed.
+    """
+    provider = provider or "unknown"
+    tokens_in = sum(message_tokens(message) for message in messages)
+    tokens_out = count_tokens(response)
+    if first_token is not None:
+        time_to_first_token_seconds.labels(provider).observe(first_token)
+    generation_seconds.labels(provider).observe(seconds)
+    tokens.labels(provider, "in").observe(tokens_in)
+    tokens.labels(provider, "out").observe(tokens_out)
+    trace = trace or _current_trace.get()
+    if trace is not None:
+        if first_token is not None:
+            trace.add_span("time_to_first_token", first_token)
+        trace.add_span("generation", seconds)
+        trace.set(provider=provider, tokens_in=tokens_in, tokens_out=tokens_out)
+
+
+def observe_stream(deltas, result, messages, trace=None):
+    """Passes response deltas through, recording the generation once it ends.
+
+    The provider is read from result["provider"], which routed streams only
+    set once a provider has answered.
+    """
+    started = time.perf_counter()
+    first_token = None
+    response = ""
+    for delta in deltas:
+        if first_token is None:
+            first_token = time.perf_counter() - started
+        response += delta
+        yield delta
+    record_generation(
+        result.get("provider"),
+        first_token,
+        time.perf_counter() - started,
+        messages,
+        response,
+        trace,
+    )
+
+
+async def aobserve_stream(deltas, result, messages, trace=None):
+    """Async version of `observe_stream`."""
+    started = time.perf_counter()
+    first_token = None
+    response = ""
+    async for delta in deltas:
+        if first_token is None:
+            first_token = time.perf_counter() - started
+        response += delta
+        yield delta
+    record_generation(
+        result.get("provider"),
+        first_token,
+        time.perf_counter() - started,
+        messages,
+        response,
+        trace,
+    )
+
+
+def render():
+    """Returns (body, content type) of the Prometheus text exposition."""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,246 @@
+import argparse
+import inspect
+import json
+import os
+
+import numpy as np
+
+EXPORT_INFO_FILE = "export.json"
+MODEL_FILE = "model.onnx"
+QUANTIZED_MODEL_FILE = "model_int8.onnx"
+
+# Texts the exported model is checked on against the PyTorch model
+CHECK_TEXTS = [
+    "What is the secret code mentioned in the document?",
+    "FAISS is a library developed by Facebook AI Research for fast similarity search.",
+    "Python is a programming language widely used for AI and machine learning.",
+    "The samurai should be prepared for death every morning and every evening.",
+    "OpenAI developed the GPT models which power modern chat applications.",
+    "Order 4417-B shipped on 12 March to the warehouse in Rotterdam.",
+    "short",
+    " ".join(["A long passage that fills the model's maximum sequence length."] * 40),
+]
+
+
+def cosine_agreement(reference, candidate):
+    """Cosine similarity between matching rows of two embedding matrices."""
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    candidate = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+    return np.sum(reference * candidate, axis=1)
+
+
+def export(model_name, output_dir, quantize=True, min_cosine=0.98):
+    """Exports a sentence transformer to ONNX, with an int8 dynamically quantized copy.
+
+    Mean pooling is exported with the encoder, so the ONNX model outputs
+    sentence embeddings directly. The exported models are checked against
+    the PyTorch model on CHECK_TEXTS: a cosine similarity below `min_cosine`
+    on any of them raises ValueError, as their embeddings would not match
+    those already in the index. Returns the export info that is saved with
+    the models.
+    """
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name, device="cpu")
+    pooling = model[1].get_config_dict()
+    # sentence-transformers 3 has one flag per mode, later versions a mode name
+    mean_only = pooling.get("pooling_mode", "mean") == "mean" and all(
+        value is (key == "pooling_mode_mean_tokens")
+        for key, value in pooling.items()
+        if key.startswith("pooling_mode_")
+    )
+    if not mean_only:
+        raise ValueError(f"Only mean pooling can be exported, not {pooling}.")
+
+    class MeanPooledEncoder(torch.nn.Module):
+        def __init__(self, encoder):
+            super().__init__()
+            self.encoder = encoder
+
+        def forward(self, input_ids, attention_mask, token_type_ids):
+            hidden = self.encoder(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                token_type_ids=token_type_ids,
+            )[0]
+            mask = attention_mask.unsqueeze(-1).to(hidden.dtype)
+            return (hidden * mask).sum(1) / mask.sum(1).clamp(min=1e-9)
+
+    os.makedirs(output_dir, exist_ok=True)
+    model.tokenizer.save_pretrained(output_dir)
+    sample = model.tokenizer(["export sample"], return_tensors="pt")
+    names = ["input_ids", "attention_mask", "token_type_ids"]
+    model_path = os.path.join(output_dir, MODEL_FILE)
+    # Newer PyTorch releases default to the dynamo exporter; keep the tracing one
+    options = (
+        {"dynamo": False}
+        if "dynamo" in inspect.signature(torch.onnx.export).parameters
+        else {}
+    )
+    torch.onnx.export(
+        MeanPooledEncoder(model[0].auto_model.eval()),
+        tuple(sample[name] for name in names),
+        model_path,
+        input_names=names,
+        output_names=["sentence_embedding"],
+        dynamic_axes={
+            **{name: {0: "batch", 1: "sequence"} for name in names},
+            "sentence_embedding": {0: "batch"},
+        },
+        opset_version=14,
+        **options,
+    )
+    if quantize:
+        quantize_dynamic(
+            model_path,
+            os.path.join(output_dir, QUANTIZED_MODEL_FILE),
+            weight_type=QuantType.QInt8,
+        )
+
+    info = {
+        "model": model_name,
+        "dimension": model.get_sentence_embedding_dimension(),
+        "max_seq_length": model.max_seq_length,
+    }
+    with open(os.path.join(output_dir, EXPORT_INFO_FILE), "w") as f:
+        json.dump(info, f)
+
+    reference = model.encode(CHECK_TEXTS, normalize_embeddings=True)
+    for quantized in [False, True] if quantize else [False]:
+        onnx_model = OnnxEmbeddingModel(output_dir, quantized=quantized)
+        agreement = cosine_agreement(
+            reference, onnx_model.encode(CHECK_TEXTS, normalize_embeddings=True)
+        )
+        key = "int8" if quantized else "fp32"
+        info[f"{key}_min_cosine"] = float(agreement.min())
+        print(
+            f"[INFO] {key}: cosine to PyTorch min={agreement.min():.4f} "
+            f"mean={agreement.mean():.4f}"
+        )
+        if agreement.min() < min_cosine:
+            raise ValueError(
+                f"{key} ONNX embeddings differ from the PyTorch model: cosine "
+                f"{agreement.min():.4f} < {min_cosine}."
+            )
+    with open(os.path.join(output_dir, EXPORT_INFO_FILE), "w") as f:
+        json.dump(info, f)
+    return info
+
+
+class FastTokenizer:
+    """A tokenizer saved by `export`, on the `tokenizers` library alone.
+
+    Calling it supports what chunking.py asks of a Hugging Face fast tokenizer
+    (token offsets), without importing transformers, which imports PyTorch.
+    `batch` returns padded and truncated model inputs.
+    """
+
+    def __init__(self, model_dir, max_length):
+        from tokenizers import Tokenizer
+
+        path = os.path.join(model_dir, "tokenizer.json")
+        with open(os.path.join(model_dir, "tokenizer_config.json")) as f:
+            pad_token = json.load(f)["pad_token"]
+        self.tokenizer = Tokenizer.from_file(path)
+        self.tokenizer.no_truncation()
+        self.tokenizer.no_padding()
+        self.batch_tokenizer = Tokenizer.from_file(path)
+        self.batch_tokenizer.enable_truncation(max_length)
+        self.batch_tokenizer.enable_padding(
+            pad_id=self.batch_tokenizer.token_to_id(pad_token), pad_token=pad_token
+        )
+
+    def __call__(self, text, add_special_tokens=True, return_offsets_mapping=False):
+        encoding = self.tokenizer.encode(text, add_special_tokens=add_special_tokens)
+        result = {"input_ids": encoding.ids, "attention_mask": encoding.attention_mask}
+        if return_offsets_mapping:
+            result["offset_mapping"] = encoding.offsets
+        return result
+
+    def batch(self, texts):
+        encodings = self.batch_tokenizer.encode_batch(texts)
+        return {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array(
+                [e.attention_mask for e in encodings], dtype=np.int64
+            ),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+
+
+class OnnxEmbeddingModel:
+    """A sentence transformer exported by `export`, run with ONNX Runtime.
+
+    Implements the parts of the SentenceTransformer interface rag.py uses:
+    `encode`, `tokenizer` and `get_sentence_embedding_dimension`, without
+    importing PyTorch or transformers. `threads` caps ONNX Runtime's
+    intra-op threads.
+    """
+
+    def __init__(self, model_dir, quantized=True, threads=None):
+        import onnxruntime
+
+        with open(os.path.join(model_dir, EXPORT_INFO_FILE)) as f:
+            self.info = json.load(f)
+        self.max_seq_length = self.info["max_seq_length"]
+        self.tokenizer = FastTokenizer(model_dir, self.max_seq_length)
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        model_file = QUANTIZED_MODEL_FILE if quantized else MODEL_FILE
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, model_file),
+            options,
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def get_sentence_embedding_dimension(self):
+        return self.info["dimension"]
+
+    def encode(self, sentences, batch_size=32, normalize_embeddings=False, **kwargs):
+        """Embeds a string or a list of strings, like SentenceTransformer.encode."""
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        embeddings = np.empty(
+            (len(sentences), self.get_sentence_embedding_dimension()), dtype=np.float32
+        )
+        # Similar lengths are batched together, to minimize padding
+        order = np.argsort([-len(sentence) for sentence in sentences], kind="stable")
+        for start in range(0, len(sentences), batch_size):
+            rows = order[start : start + batch_size]
+            inputs = self.tokenizer.batch([sentences[i] for i in rows])
+            feed = {name: inputs[name] for name in self.input_names}
+            embeddings[rows] = self.session.run(None, feed)[0]
+        if normalize_embeddings:
+            embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings[0] if single else embeddings
+
+
+if __name__ == "__main__":
+    from rag import EMBEDDING_MODEL_NAME, ONNX_MODEL_DIR
+
+    parser = argparse.ArgumentParser(
+        description="Export the embedding model to ONNX, with an int8 quantized copy."
+    )
+    parser.add_argument("--model", default=EMBEDDING_MODEL_NAME)
+    parser.add_argument("--output-dir", default=ONNX_MODEL_DIR)
+    parser.add_argument("--no-quantize", action="store_true")
+    parser.add_argument(
+        "--min-cosine",
+        type=float,
+        default=0.98,
+        help="Fail if an exported model's embeddings are less similar to PyTorch's",
+    )
+    args = parser.parse_args()
+
+    export(
+        args.model,
+        args.output_dir,
+        quantize=not args.no_quantize,
+        min_cosine=args.min_cosine,
+    )
+    print(f"[INFO] Exported {args.model} to {args.output_dir}")
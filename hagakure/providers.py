@@ -0,0 +1,445 @@
+import copy
+import threading
+
+import httpx
+
+
+class Provider:
+    """A chat model behind one of the supported inference APIs.
+
+    Every provider takes chat messages (dicts with "role" and "content") and
+    returns the assistant message to append to the history, so callers need
+    no per-provider message handling. `stream` and `astream` yield text deltas
+    and, when given a `result` dict, leave the final assistant message in
+    result["message"]. Where the SDK's stream can be closed from another
+    thread, `stream` also leaves it in result["stream"] as soon as the
+    request is sent, so a caller can abort it before the first delta.
+    """
+
+    def __init__(self, name, model, embedding_model=None):
+        self.name = name
+        self.model = model
+        self.embedding_model = embedding_model
+
+    def generate(self, messages):
+        raise NotImplementedError
+
+    def stream(self, messages, result=None):
+        raise NotImplementedError
+
+    async def agenerate(self, messages):
+        raise NotImplementedError
+
+    async def astream(self, messages, result=None):
+        raise NotImplementedError
+        yield
+
+    def outgoing(self, messages):
+        """Keeps only the message keys this API accepts.
+
+        A routed conversation can carry another provider's keys (stop_reason).
+        """
+        return [{"role": m["role"], "content": m["content"]} for m in messages]
+
+    def with_model(self, model):
+        """Returns this provider for another model, sharing its clients."""
+        provider = copy.copy(self)
+        provider.model = model
+        return provider
+
+    def embed(self, texts):
+        raise NotImplementedError(
+            f"Provider '{self.name}' does not provide embeddings."
+        )
+
+    def _require_embedding_model(self):
+        if not self.embedding_model:
+            raise ValueError(
+                f"No embedding model configured for provider '{self.name}'."
+            )
+        return self.embedding_model
+
+
+class OpenAICompatibleProvider(Provider):
+    """OpenAI chat completions API, also spoken by Groq."""
+
+    def __init__(self, name, model, client, async_client, embedding_model=None):
+        super().__init__(name, model, embedding_model)
+        self.client = client
+        self.async_client = async_client
+
+    def generate(self, messages):
+        completion = self.client.chat.completions.create(
+            model=self.model, messages=self.outgoing(messages)
+        )
+        return {"role": "assistant", "content": completion.choices[0].message.content}
+
+    def stream(self, messages, result=None):
+        response = ""
+        chunks = self.client.chat.completions.create(
+            model=self.model, messages=self.outgoing(messages), stream=True
+        )
+        if result is not None:
+            result["stream"] = chunks
+        for chunk in chunks:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content or ""
+            response += delta
+            yield delta
+        if result is not None:
+            result["message"] = {"role": "assistant", "content": response}
+
+    async def agenerate(self, messages):
+        completion = await self.async_client.chat.completions.create(
+            model=self.model, messages=self.outgoing(messages)
+        )
+        return {"role": "assistant", "content": completion.choices[0].message.content}
+
+    async def astream(self, messages, result=None):
+        response = ""
+        async for chunk in await self.async_client.chat.completions.create(
+            model=self.model, messages=self.outgoing(messages), stream=True
+        ):
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content or ""
+            response += delta
+            yield delta
+        if result is not None:
+            result["message"] = {"role": "assistant", "content": response}
+
+    def embed(self, texts):
+        response = self.client.embeddings.create(
+            model=self._require_embedding_model(), input=texts
+        )
+        return [item.embedding for item in response.data]
+
+
+class LlamaStackProvider(Provider):
+    """Llama Stack inference API; assistant messages carry a stop_reason."""
+
+    def __init__(self, name, model, client, async_client, embedding_model=None):
+        super().__init__(name, model, embedding_model)
+        self.client = client
+        self.async_client = async_client
+
+    def outgoing(self, messages):
+        # Llama Stack requires a stop_reason on assistant messages
+        return [
+            (
+                {"role": m["role"], "content": m["content"]}
+                if m["role"] != "assistant"
+                else {
+                    "role": "assistant",
+                    "content": m["content"],
+                    "stop_reason": m.get("stop_reason") or "end_of_turn",
+                }
+            )
+            for m in messages
+        ]
+
+    @staticmethod
+    def _message(content, stop_reason):
+        return {"role": "assistant", "content": content, "stop_reason": stop_reason}
+
+    def generate(self, messages):
+        response = self.client.inference.chat_completion(
+            model_id=self.model, messages=self.outgoing(messages)
+        )
+        message = response.completion_message
+        return self._message(message.content.text, message.stop_reason)
+
+    def stream(self, messages, result=None):
+        response = ""
+        stop_reason = None
+        chunks = self.client.inference.chat_completion(
+            model_id=self.model, messages=self.outgoing(messages), stream=True
+        )
+        if result is not None:
+            result["stream"] = chunks
+        for chunk in chunks:
+            delta = getattr(chunk.event.delta, "text", "") or ""
+            response += delta
+            stop_reason = chunk.event.stop_reason or stop_reason
+            yield delta
+        if result is not None:
+            result["message"] = self._message(response, stop_reason)
+
+    async def agenerate(self, messages):
+        response = await self.async_client.inference.chat_completion(
+            model_id=self.model, messages=self.outgoing(messages)
+        )
+        message = response.completion_message
+        return self._message(message.content.text, message.stop_reason)
+
+    async def astream(self, messages, result=None):
+        response = ""
+        stop_reason = None
+        async for chunk in await self.async_client.inference.chat_completion(
+            model_id=self.model, messages=self.outgoing(messages), stream=True
+        ):
+            delta = getattr(chunk.event.delta, "text", "") or ""
+            response += delta
+            stop_reason = chunk.event.stop_reason or stop_reason
+            yield delta
+        if result is not None:
+            result["message"] = self._message(response, stop_reason)
+
+    def embed(self, texts):
+        response = self.client.inference.embeddings(
+            model_id=self._require_embedding_model(), contents=texts
+        )
+        return response.embeddings
+
+
+class OllamaProvider(Provider):
+    """Ollama chat API."""
+
+    def __init__(self, name, model, client, async_client, embedding_model=None):
+        super().__init__(name, model, embedding_model)
+        self.client = client
+        self.async_client = async_client
+
+    def generate(self, messages):
+        response = self.client.chat(model=self.model, messages=self.outgoing(messages))
+        return {"role": "assistant", "content": response["message"]["content"]}
+
+    def stream(self, messages, result=None):
+        response = ""
+        for chunk in self.client.chat(
+            model=self.model, messages=self.outgoing(messages), stream=True
+        ):
+            delta = chunk["message"]["content"]
+            response += delta
+            yield delta
+        if result is not None:
+            result["message"] = {"role": "assistant", "content": response}
+
+    async def agenerate(self, messages):
+        response = await self.async_client.chat(
+            model=self.model, messages=self.outgoing(messages)
+        )
+        return {"role": "assistant", "content": response["message"]["content"]}
+
+    async def astream(self, messages, result=None):
+        response = ""
+        async for chunk in await self.async_client.chat(
+            model=self.model, messages=self.outgoing(messages), stream=True
+        ):
+            delta = chunk["message"]["content"]
+            response += delta
+            yield delta
+        if result is not None:
+            result["message"] = {"role": "assistant", "content": response}
+
+    def embed(self, texts):
+        response = self.client.embed(model=self._require_embedding_model(), input=texts)
+        return response["embeddings"]
+
+
+# The factories import their SDK on first use, so providers that are never
+# selected never pay for (or require) their SDK.
+
+
+def require_settings(name, **settings):
+    missing = [key for key, value in settings.items() if not value]
+    if missing:
+        raise ValueError(f"Missing {', '.join(missing)} for provider '{name}'.")
+
+
+def groq_provider(registry, name, model, api_key, embedding_model=None):
+    from groq import AsyncGroq, Groq
+
+    require_settings(name, api_key=api_key)
+    return OpenAICompatibleProvider(
+        name,
+        model,
+        Groq(api_key=api_key, **registry.sdk_options()),
+        AsyncGroq(api_key=api_key, **registry.sdk_options(asynchronous=True)),
+        embedding_model,
+    )
+
+
+def openai_provider(
+    registry, name, model, api_key, base_url=None, embedding_model=None
+):
+    from openai import AsyncOpenAI, OpenAI
+
+    require_settings(name, api_key=api_key, base_url=base_url)
+    return OpenAICompatibleProvider(
+        name,
+        model,
+        OpenAI(base_url=base_url, api_key=api_key, **registry.sdk_options()),
+        AsyncOpenAI(
+            base_url=base_url,
+            api_key=api_key,
+            **registry.sdk_options(asynchronous=True),
+        ),
+        embedding_model,
+    )
+
+
+def llama_stack_provider(
+    registry, name, model, api_key, base_url, embedding_model=None
+):
+    from llama_stack_client import AsyncLlamaStackClient, LlamaStackClient
+
+    require_settings(name, api_key=api_key, base_url=base_url)
+    return LlamaStackProvider(
+        name,
+        model,
+        LlamaStackClient(base_url=base_url, api_key=api_key, **registry.sdk_options()),
+        AsyncLlamaStackClient(
+            base_url=base_url,
+            api_key=api_key,
+            **registry.sdk_options(asynchronous=True),
+        ),
+        embedding_model,
+    )
+
+
+def ollama_provider(registry, name, model, host=None, embedding_model=None):
+    import ollama
+
+    # The Ollama SDK builds its own httpx client, so it gets the registry's
+    # limits, timeout and retrying transports rather than the shared pool.
+    return OllamaProvider(
+        name,
+        model,
+        ollama.Client(
+            host=host, timeout=registry.timeout, transport=registry.transport()
+        ),
+        ollama.AsyncClient(
+            host=host,
+            timeout=registry.timeout,
+            transport=registry.transport(asynchronous=True),
+        ),
+        embedding_model,
+    )
+
+
+class ProviderRegistry:
+    """Owns the providers and the HTTP layer they share.
+
+    All SDK clients send their requests through one sync and one async httpx
+    connection pool, with tuned pool sizes, keep-alive, timeouts and retries,
+    instead of each SDK creating its own defaults. Providers, and the pools,
+    are created on first use. `max_retries` applies to failed connection
+    attempts and, unless `sdk_max_retries` is given, to the SDKs' retries of
+    429 and 5xx responses.
+    """
+
+    def __init__(
+        self,
+        max_connections=100,
+        max_keepalive_connections=20,
+        keepalive_expiry=30.0,
+        timeout=120.0,
+        connect_timeout=10.0,
+        max_retries=2,
+        sdk_max_retries=None,
+    ):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.max_retries = max_retries
+        if sdk_max_retries is None:
+            sdk_max_retries = max_retries
+        self.sdk_max_retries = sdk_max_retries
+        self._http_client = None
+        self._async_http_client = None
+        self._factories = {}
+        self._providers = {}
+        self._lock = threading.RLock()
+
+    @property
+    def http_client(self):
+        with self._lock:
+            if self._http_client is None:
+                self._http_client = httpx.Client(
+                    limits=self.limits, timeout=self.timeout, transport=self.transport()
+                )
+            return self._http_client
+
+    @property
+    def async_http_client(self):
+        with self._lock:
+            if self._async_http_client is None:
+                self._async_http_client = httpx.AsyncClient(
+                    limits=self.limits,
+                    timeout=self.timeout,
+                    transport=self.transport(asynchronous=True),
+                )
+            return self._async_http_client
+
+    def transport(self, asynchronous=False):
+        """A transport that retries failed connection attempts."""
+        cls = httpx.AsyncHTTPTransport if asynchronous else httpx.HTTPTransport
+        return cls(limits=self.limits, retries=self.max_retries)
+
+    def sdk_options(self, asynchronous=False):
+        """Keyword arguments that put an SDK client on the shared pool.
+
+        The SDKs retry 429 and 5xx responses with backoff themselves, up to
+        `sdk_max_retries` times.
+        """
+        return {
+            "http_client": self.async_http_client if asynchronous else self.http_client,
+            "timeout": self.timeout,
+            "max_retries": self.sdk_max_retries,
+        }
+
+    def register(self, name, factory, **config):
+        """Registers a provider, built by `factory(registry, name, **config)` when first used."""
+        with self._lock:
+            self._factories[name] = (factory, config)
+            self._providers.pop(name, None)
+
+    def select(self, names):
+        """Drops every registered provider not in `names`."""
+        unknown = set(names) - set(self._factories)
+        if unknown:
+            raise ValueError(f"Unknown providers: {', '.join(sorted(unknown))}.")
+        with self._lock:
+            for name in list(self._factories):
+                if name not in names:
+                    del self._factories[name]
+                    self._providers.pop(name, None)
+
+    def get(self, name):
+        provider = self._providers.get(name)
+        if provider is not None:
+            return provider
+        with self._lock:
+            if name not in self._factories:
+                raise ValueError(f"Unknown provider '{name}'.")
+            if name not in self._providers:
+                factory, config = self._factories[name]
+                self._providers[name] = factory(self, name, **config)
+            return self._providers[name]
+
+    def warm_up(self, names=None):
+        """Creates the given providers (default: all) ahead of their first request."""
+        for name in names or self.names():
+            try:
+                self.get(name)
+            except Exception as e:
+                print(f"[WARNING] Could not initialize provider '{name}': {e}")
+
+    def __contains__(self, name):
+        return name in self._factories
+
+    def names(self):
+        return list(self._factories)
+
+    def close(self):
+        if self._http_client is not None:
+            self._http_client.close()
+
+    async def aclose(self):
+        if self._async_http_client is not None:
+            await self._async_http_client.aclose()
@@ -1,79 +1,669 @@
 import os
 import pickle
+import threading
+import time
 import warnings
+from contextlib import contextmanager
 
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
+from filelock import FileLock, Timeout
+
+from chunking import Hit, chunk_spans, merge_adjacent
+from config import getenv
+from doc_store import DocStore
+from embedding_batcher import EmbeddingBatcher
+from index_factory import (
+    base_index,
+    build_index,
+    cosine_scores,
+    ids_of,
+    index_type_of,
+    metric_of,
+    migrate_index,
+    min_train_size,
+    set_search_params,
+    wrap_ids,
+)
+from lexical_index import LexicalIndex
+from live_index import LiveIndex
+from metrics import embedding_batch_size, record_cache, span
+from query_cache import QueryCache, normalize_query
 
 warnings.simplefilter("ignore")  # Suppress unwanted warnings
 
-# Load sentence transformer model
-embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+EMBEDDING_DIM = 384  # 384 is the embedding size for MiniLM
+# Embedding backend: "sentence_transformers" (PyTorch, fp32) or "onnx", which
+# runs the model exported by onnx_embedding.py on ONNX Runtime, int8 quantized
+# unless RAG_ONNX_QUANTIZED=0.
+EMBEDDING_BACKEND = getenv("RAG_EMBEDDING_BACKEND", "sentence_transformers")
+ONNX_MODEL_DIR = getenv(
+    "RAG_ONNX_MODEL_DIR", os.path.join("models", f"{EMBEDDING_MODEL_NAME}-onnx")
+)
+ONNX_QUANTIZED = getenv("RAG_ONNX_QUANTIZED", "1") == "1"
+ONNX_THREADS = int(getenv("RAG_ONNX_THREADS", "0"))  # 0: ONNX Runtime's default
+
+# Knowledge base location: native FAISS index snapshot, the write-ahead log of
+# changes since, a memory-mapped doc store and its BM25 index
+KNOWLEDGE_BASE_DIR = getenv("RAG_KNOWLEDGE_BASE_DIR", "knowledge_base")
+FAISS_INDEX_FILE = os.path.join(KNOWLEDGE_BASE_DIR, "index.faiss")
+WAL_FILE = os.path.join(KNOWLEDGE_BASE_DIR, "index.wal")
+# Held by the one process writing to the knowledge base at a time
+WRITE_LOCK_FILE = os.path.join(KNOWLEDGE_BASE_DIR, "write.lock")
+DOC_STORE_PATH = os.path.join(KNOWLEDGE_BASE_DIR, "docs")
+LEXICAL_INDEX_FILE = os.path.join(KNOWLEDGE_BASE_DIR, "lexical.bm25")
+# Memory-map the index when reading it, so startup does not deserialize it
+INDEX_MMAP = getenv("RAG_INDEX_MMAP", "1") == "1"
+# The log is compacted into a new snapshot once it holds this many added or
+# deleted chunks. Other processes check the log for changes at most every
+# RAG_WAL_POLL_SECONDS.
+COMPACT_AFTER = int(getenv("RAG_COMPACT_AFTER", "10000"))
+WAL_POLL_SECONDS = float(getenv("RAG_WAL_POLL_SECONDS", "1"))
+
+# Index type: flat (exact), ivf_flat, ivf_pq or hnsw. A knowledge base starts
+# flat and is migrated to the configured type once it has enough vectors to train.
+INDEX_TYPE = getenv("RAG_INDEX_TYPE", "flat")
+# Metric for new indexes: "ip" (cosine, since embeddings are normalized) or "l2".
+# Existing indexes keep the metric they were built with.
+INDEX_METRIC = getenv("RAG_INDEX_METRIC", "ip")
+IVF_NLIST = int(getenv("RAG_IVF_NLIST", "1024"))
+PQ_M = int(getenv("RAG_PQ_M", "48"))
+HNSW_M = int(getenv("RAG_HNSW_M", "32"))
+TRAIN_SAMPLE_SIZE = int(getenv("RAG_TRAIN_SAMPLE_SIZE", "100000"))
+# Query-time tunables: IVF lists to probe and HNSW candidate list size
+NPROBE = int(getenv("RAG_NPROBE", "16"))
+EF_SEARCH = int(getenv("RAG_EF_SEARCH", "64"))
+# Retrieved documents with a cosine score below this are left out of the prompt
+MIN_SCORE = float(getenv("RAG_MIN_SCORE", "0.2"))
+# Hybrid retrieval: FAISS and BM25 rankings are combined by reciprocal rank
+# fusion, each hit scoring weight / (RAG_RRF_K + rank) in each ranking. Each
+# ranking contributes top_k * RAG_FUSION_CANDIDATES candidates. A lexical
+# weight of 0 (the default) leaves retrieval dense-only.
+DENSE_WEIGHT = float(getenv("RAG_DENSE_WEIGHT", "1"))
+LEXICAL_WEIGHT = float(getenv("RAG_LEXICAL_WEIGHT", "0"))
+RRF_K = int(getenv("RAG_RRF_K", "60"))
+FUSION_CANDIDATES = int(getenv("RAG_FUSION_CANDIDATES", "4"))
+# BM25 hits must match query terms holding this fraction of the query's idf;
+# terms found in more than RAG_LEXICAL_MAX_DF of the chunks are not searched
+# (only once there are lexical_index.PRUNE_MIN_DOCS chunks)
+LEXICAL_MIN_MATCH = float(getenv("RAG_LEXICAL_MIN_MATCH", "0.5"))
+LEXICAL_MAX_DF = float(getenv("RAG_LEXICAL_MAX_DF", "0.5"))
+
+# Documents are split into overlapping token windows that fit the embedding
+# model (MiniLM truncates at 256 tokens) before they are embedded.
+CHUNK_TOKENS = int(getenv("RAG_CHUNK_TOKENS", "200"))
+CHUNK_OVERLAP = int(getenv("RAG_CHUNK_OVERLAP", "32"))
+MERGE_ADJACENT_CHUNKS = getenv("RAG_MERGE_ADJACENT_CHUNKS", "1") == "1"
+
+# Query caches: embeddings depend only on the query text, search results also
+# on the index, so the latter are dropped whenever documents are added.
+QUERY_CACHE_SIZE = int(getenv("RAG_QUERY_CACHE_SIZE", "1024"))
+QUERY_CACHE_TTL = float(getenv("RAG_QUERY_CACHE_TTL", "3600"))
+CACHE_SEARCH_RESULTS = getenv("RAG_CACHE_SEARCH_RESULTS", "1") == "1"
+embedding_cache = QueryCache(max_size=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL)
+search_cache = QueryCache(
+    max_size=QUERY_CACHE_SIZE if CACHE_SEARCH_RESULTS else 0, ttl=QUERY_CACHE_TTL
+)
+
+# Concurrent query embeddings are gathered for up to RAG_EMBED_BATCH_WAIT_MS
+# milliseconds and encoded together, in one forward pass per micro-batch.
+EMBED_BATCHING = getenv("RAG_EMBED_BATCHING", "1") == "1"
+EMBED_BATCH_SIZE = int(getenv("RAG_EMBED_BATCH_SIZE", "64"))
+EMBED_BATCH_WAIT_MS = float(getenv("RAG_EMBED_BATCH_WAIT_MS", "2"))
 
-# Define FAISS index file path
-FAISS_INDEX_FILE = "faiss_index.pkl"
+# Legacy single-file format, migrated on first load
+LEGACY_INDEX_FILE = "faiss_index.pkl"
 
-# Initialize or Load FAISS Index
-if os.path.exists(FAISS_INDEX_FILE):
+
+def migrate_legacy_index():
+    """Converts a pickled (faiss_index, doc_store) file to the native format."""
+    with open(LEGACY_INDEX_FILE, "rb") as f:
+        index, docs = pickle.load(f)
+    store = DocStore(DOC_STORE_PATH)
+    store.truncate(0)
+    store.extend(docs)
+    store.flush()
+    write_index(index)
+    print(f"[INFO] Migrated {len(docs)} documents from {LEGACY_INDEX_FILE}.")
+
+
+def write_index(index):
+    """Writes the FAISS index atomically, so readers never see a partial file."""
+    tmp_path = f"{FAISS_INDEX_FILE}.tmp"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, FAISS_INDEX_FILE)
+
+
+def needs_upgrade():
+    """Whether the index files predate the native format or stable ids."""
+    if not os.path.exists(FAISS_INDEX_FILE):
+        return os.path.exists(LEGACY_INDEX_FILE)
     with open(FAISS_INDEX_FILE, "rb") as f:
-        faiss_index, doc_store = pickle.load(f)
-    print(f"[INFO] Loaded existing FAISS index with {len(doc_store)} documents.")
-else:
-    faiss_index = faiss.IndexFlatL2(384)  # 384 is the embedding size for MiniLM
-    doc_store = []  # Store documents as list
-    print("[INFO] Initialized new FAISS index.")
+        return f.read(4) != b"IxM2"  # Not an IndexIDMap2
+
+
+def upgrade_index_file(store):
+    """Gives an index written before stable ids the ids it implied: positions."""
+    index = faiss.read_index(FAISS_INDEX_FILE)
+    # Documents flushed after the index was written have no vectors; drop them
+    store.truncate(index.ntotal)
+    write_index(wrap_ids(index))
+    print(f"[INFO] Upgraded the FAISS index of {index.ntotal} chunks to stable ids.")
+
+
+def new_index():
+    return wrap_ids(build_index("flat", EMBEDDING_DIM, metric=INDEX_METRIC))
+
+
+def configure_index(index):
+    set_search_params(index, nprobe=NPROBE, ef_search=EF_SEARCH)
+
+
+def load_knowledge_base():
+    """Opens the FAISS index and document store, creating them if needed.
+
+    Chunk ids are their positions in the doc store, and stay stable as
+    documents are updated and deleted. Files are only upgraded or repaired
+    under the write lock: while another process holds it, they are opened
+    as they are, since that process has already done so.
+    """
+    os.makedirs(KNOWLEDGE_BASE_DIR, exist_ok=True)
+    try:
+        file_lock().acquire(blocking=needs_upgrade())
+        maintain = True
+    except Timeout:
+        maintain = False
+    try:
+        if maintain and not os.path.exists(FAISS_INDEX_FILE):
+            if os.path.exists(LEGACY_INDEX_FILE):
+                migrate_legacy_index()
+        store = DocStore(DOC_STORE_PATH, repair=maintain)
+        if maintain and needs_upgrade():
+            upgrade_index_file(store)
+    finally:
+        if maintain:
+            file_lock().release()
+    index = LiveIndex(
+        FAISS_INDEX_FILE,
+        WAL_FILE,
+        EMBEDDING_DIM,
+        new_index,
+        mmap=INDEX_MMAP,
+        configure=configure_index,
+    )
+    print(f"[INFO] Loaded FAISS index with {index.ntotal} chunks ({index.stats()}).")
+    if migration_due(index.snapshot):
+        print(
+            f"[INFO] The index is flat; it moves to RAG_INDEX_TYPE={INDEX_TYPE} at "
+            "the next compaction, or now with `python rag_ingest.py --compact`."
+        )
+    return index, store
+
+
+def load_lexical_index(index, store):
+    """Opens the BM25 index, writing its first snapshot if the store predates it."""
+    lexical = LexicalIndex(LEXICAL_INDEX_FILE)
+    lexical.refresh(store)
+    if not os.path.exists(LEXICAL_INDEX_FILE) and len(store):
+        try:
+            file_lock().acquire(blocking=False)
+        except Timeout:
+            return lexical  # The writer will write it at its next compaction
+        try:
+            lexical.compact(index.contains)
+        finally:
+            file_lock().release()
+        print(f"[INFO] Built the BM25 index of {len(store)} chunks.")
+    return lexical
+
+
+def migration_due(index):
+    """Whether a flat index holds enough vectors to move to RAG_INDEX_TYPE."""
+    if INDEX_TYPE == "flat" or index_type_of(index) != "flat":
+        return False
+    return index.ntotal >= max(min_train_size(INDEX_TYPE, IVF_NLIST), 1)
+
+
+def maybe_migrate_index(index):
+    """Moves a flat index to the configured ANN type once it can be trained.
+
+    Runs at compaction, every RAG_COMPACT_AFTER changes or when asked for
+    with `rag_ingest.py --compact`.
+    """
+    if not migration_due(index):
+        return index
+    flat = base_index(index)
+    target = build_index(
+        INDEX_TYPE,
+        EMBEDDING_DIM,
+        metric=metric_of(index),
+        nlist=IVF_NLIST,
+        pq_m=PQ_M,
+        hnsw_m=HNSW_M,
+    )
+    migrate_index(flat, target, sample_size=TRAIN_SAMPLE_SIZE)
+    print(f"[INFO] Migrated {index.ntotal} vectors from flat to {INDEX_TYPE} index.")
+    return wrap_ids(target, ids_of(index))
+
+
+# The embedding model (which imports torch) and the knowledge base are loaded
+# on first use rather than at import, keeping app startup and worker forks fast.
+embedding_model = None
+faiss_index = None
+doc_store = None
+lexical_index = None
+_model_lock = threading.Lock()
+_knowledge_base_lock = threading.Lock()
+# Serialize writers, within and across processes: chunk ids are allocated
+# from the doc store's length
+_write_lock = threading.RLock()
+_file_lock = None
+_file_lock_pid = None
+_last_refresh = 0.0
+_refresh_lock = threading.Lock()
+
+
+def load_embedding_model(
+    backend=EMBEDDING_BACKEND, quantized=ONNX_QUANTIZED, threads=ONNX_THREADS
+):
+    """Loads the embedding model with the given backend.
+
+    `quantized` and `threads` only apply to the ONNX backend.
+    """
+    if backend == "sentence_transformers":
+        from sentence_transformers import SentenceTransformer
+
+        return SentenceTransformer(EMBEDDING_MODEL_NAME)
+    if backend == "onnx":
+        from onnx_embedding import OnnxEmbeddingModel
+
+        model = OnnxEmbeddingModel(
+            ONNX_MODEL_DIR, quantized=quantized, threads=threads or None
+        )
+        # Embeddings of another model would not match those in the index
+        if model.info["model"] != EMBEDDING_MODEL_NAME:
+            raise ValueError(
+                f"{ONNX_MODEL_DIR} holds {model.info['model']}, "
+                f"not {EMBEDDING_MODEL_NAME}."
+            )
+        return model
+    raise ValueError(f"Unknown embedding backend '{backend}'.")
+
+
+def get_embedding_model():
+    """Returns the embedding model, loading it on first use."""
+    global embedding_model
+    if embedding_model is None:
+        with _model_lock:
+            if embedding_model is None:
+                embedding_model = load_embedding_model()
+    return embedding_model
+
+
+def ensure_knowledge_base():
+    """Opens the FAISS index and document store on first use."""
+    global faiss_index, doc_store, lexical_index
+    if faiss_index is None:
+        with _knowledge_base_lock:
+            if faiss_index is None:
+                index, doc_store = load_knowledge_base()
+                lexical_index = load_lexical_index(index, doc_store)
+                faiss_index = index
+    return faiss_index, doc_store
+
+
+def refresh_knowledge_base(force=False):
+    """Picks up changes logged by other processes, at most every WAL_POLL_SECONDS."""
+    global _last_refresh
+    ensure_knowledge_base()
+    if not force and time.monotonic() - _last_refresh < WAL_POLL_SECONDS:
+        return
+    with _refresh_lock:
+        # Another thread may have refreshed while this one waited
+        now = time.monotonic()
+        if not force and now - _last_refresh < WAL_POLL_SECONDS:
+            return
+        _last_refresh = now
+        if faiss_index.refresh():
+            doc_store.refresh()
+            search_cache.clear()
+        lexical_index.refresh(doc_store)
+
+
+def warm_up():
+    """Loads the embedding model and the knowledge base ahead of the first query."""
+    get_embedding_model()
+    ensure_knowledge_base()
+
+
+def file_lock():
+    """The write lock file, opened anew in a forked child, which must not share it."""
+    global _file_lock, _file_lock_pid
+    if _file_lock_pid != os.getpid():
+        _file_lock = FileLock(WRITE_LOCK_FILE, thread_local=False)
+        _file_lock_pid = os.getpid()
+    return _file_lock
+
 
+@contextmanager
+def writing():
+    """Makes the caller the knowledge base's only writer, across processes.
 
-def save_faiss():
-    """Save FAISS index and document store to disk."""
-    with open(FAISS_INDEX_FILE, "wb") as f:
-        pickle.dump((faiss_index, doc_store), f)
-    print("[DEBUG] FAISS index saved.")
+    Reentrant. On entry, the doc store and index are brought up to date with
+    changes written by other processes, and anything a crashed writer left
+    half-written is cut off.
+    """
+    ensure_knowledge_base()
+    with _write_lock, file_lock():
+        doc_store.repair()
+        refresh_knowledge_base(force=True)
+        yield
+
+
+def compact_index():
+    """Writes the logged index changes into a new snapshot, migrating its type if due."""
+    with writing():
+        pending = faiss_index.pending
+        faiss_index.compact(transform=maybe_migrate_index)
+        if pending or lexical_index.end > lexical_index.num_docs:
+            lexical_index.compact(faiss_index.contains)
+    search_cache.clear()
+    print(f"[DEBUG] FAISS index compacted ({faiss_index.ntotal} chunks).")
+
+
+def maybe_compact_index():
+    if faiss_index.pending >= COMPACT_AFTER:
+        compact_index()
 
 
 def add_document(text):
-    """Embeds a document and adds it to the FAISS index."""
-    global faiss_index, doc_store
-    embedding = (
-        embedding_model.encode(text, normalize_embeddings=True)
+    """Embeds a document and adds it to the FAISS index; returns its source id."""
+    with writing():
+        source = doc_store.new_source_id()
+        add_chunks(list(iter_chunks(text, source)))
+        maybe_compact_index()
+    return source
+
+
+def iter_chunks(text, source):
+    """Yields (chunk text, (source, start, end)) for each token window of `text`."""
+    for start, end in chunk_spans(
+        text,
+        get_embedding_model().tokenizer,
+        max_tokens=CHUNK_TOKENS,
+        overlap=CHUNK_OVERLAP,
+    ):
+        yield text[start:end], (source, start, end)
+
+
+def add_chunks(chunks, batch_size=64):
+    """Embeds (text, meta) chunks, stores them and logs their vectors.
+
+    Returns the chunk ids, which are their doc store positions. The caller
+    holds `writing()`.
+    """
+    ids = []
+    for start in range(0, len(chunks), batch_size):
+        texts, metas = zip(*chunks[start : start + batch_size])
+        embeddings = (
+            get_embedding_model()
+            .encode(list(texts), batch_size=batch_size, normalize_embeddings=True)
+            .astype(np.float32)
+        )
+        first = len(doc_store)
+        doc_store.extend(texts, metas)
+        # Texts go first, so every logged vector has its text on disk
+        doc_store.flush()
+        batch_ids = np.arange(first, first + len(texts), dtype=np.int64)
+        faiss_index.add(batch_ids, embeddings)
+        lexical_index.refresh(doc_store)
+        search_cache.clear()
+        ids.extend(batch_ids.tolist())
+        print(f"[DEBUG] Added {len(texts)} chunks (Embeddings: {embeddings.shape})")
+    return ids
+
+
+def add_documents(documents, batch_size=64, checkpoint_every=None):
+    """Chunks and embeds documents in batches and adds them to the FAISS index.
+
+    `documents` may be any iterable (including a generator), so large corpora
+    are streamed rather than materialized. Every document is split into
+    overlapping token windows, each stored with its source id and offsets.
+    Each batch of chunks goes through a single `encode` call and is appended
+    to the write-ahead log. The log is compacted into the index snapshot
+    every RAG_COMPACT_AFTER changes, and additionally every
+    `checkpoint_every` chunks if set. The write lock is held throughout, as
+    source ids are allocated before their chunks are stored. Returns the
+    number of documents.
+    """
+    added = 0
+    since_checkpoint = 0
+    batch = []
+
+    with writing():
+        for text in documents:
+            source = doc_store.new_source_id()
+            for chunk in iter_chunks(text, source):
+                batch.append(chunk)
+                if len(batch) < batch_size:
+                    continue
+                add_chunks(batch, batch_size)
+                since_checkpoint += len(batch)
+                batch = []
+                if checkpoint_every and since_checkpoint >= checkpoint_every:
+                    compact_index()
+                    since_checkpoint = 0
+                else:
+                    maybe_compact_index()
+            added += 1
+
+        if batch:
+            add_chunks(batch, batch_size)
+            maybe_compact_index()
+    return added
+
+
+def live_chunk_ids(source):
+    """Ids of the indexed chunks of a source document."""
+    ids = doc_store.ids_of_source(source)
+    return ids[faiss_index.contains(ids)]
+
+
+def update_document(source, text):
+    """Replaces the text of a source document, keeping its source id.
+
+    The new chunks are added before the old ones are deleted, so a crash in
+    between leaves both versions indexed rather than neither.
+    """
+    with writing():
+        old_ids = live_chunk_ids(source)
+        if not len(old_ids):
+            raise KeyError(f"Unknown document {source}.")
+        add_chunks(list(iter_chunks(text, source)))
+        faiss_index.remove(old_ids)
+        search_cache.clear()
+        maybe_compact_index()
+
+
+def delete_document(source):
+    """Removes a source document's chunks from the FAISS index."""
+    with writing():
+        old_ids = live_chunk_ids(source)
+        if not len(old_ids):
+            raise KeyError(f"Unknown document {source}.")
+        faiss_index.remove(old_ids)
+        search_cache.clear()
+        maybe_compact_index()
+
+
+def encode_queries(queries):
+    """Embeds a batch of queries with a single `encode` call."""
+    return (
+        get_embedding_model()
+        .encode(queries, batch_size=len(queries), normalize_embeddings=True)
         .astype(np.float32)
-        .reshape(1, -1)
     )
 
-    faiss_index.add(embedding)
-    doc_store.append(text)
-    save_faiss()
 
-    print(f"[DEBUG] Document added: '{text[:50]}...' (Embedding: {embedding.shape})")
+embedding_batcher = (
+    EmbeddingBatcher(
+        encode_queries,
+        max_batch_size=EMBED_BATCH_SIZE,
+        max_wait=EMBED_BATCH_WAIT_MS / 1000,
+        on_batch=embedding_batch_size.observe,
+    )
+    if EMBED_BATCHING
+    else None
+)
+
+
+def embed_query(query):
+    """Embeds a query, reusing the embedding of an equivalent earlier query."""
+    return _embed_query(query)[0]
+
+
+def _embed_query(query):
+    """Returns (embedding, whether it came from the cache)."""
+    cache_key = normalize_query(query)
+    query_embedding = embedding_cache.get(cache_key)
+    record_cache("embedding", query_embedding is not None)
+    if query_embedding is not None:
+        return query_embedding, True
+    if embedding_batcher is not None:
+        get_embedding_model()  # Loaded here, so model loading is not timed
+        with span("embedding"):
+            # Copied out of the batch, which the cache would otherwise keep alive
+            query_embedding = embedding_batcher.embed(query).reshape(1, -1).copy()
+    else:
+        model = get_embedding_model()
+        with span("embedding"):
+            query_embedding = (
+                model.encode(query, normalize_embeddings=True)
+                .astype(np.float32)
+                .reshape(1, -1)
+            )
+    query_embedding.setflags(write=False)
+    embedding_cache.put(cache_key, query_embedding)
+    return query_embedding, False
+
 
+def fuse_rankings(rankings, weights, k=RRF_K):
+    """Reciprocal rank fusion of several rankings of ids, best first.
 
-def retrieve_context(query, top_k=3):
-    """Retrieves the most relevant documents for a given query, with debug output."""
+    Each id scores the sum of weight / (k + rank) over the rankings it is in.
+    Returns [(id, score)], best first.
+    """
+    scores = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, i in enumerate(ranking, 1):
+            scores[i] = scores.get(i, 0.0) + weight / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def retrieve_hits(query, top_k=3, min_score=None, merge=MERGE_ADJACENT_CHUNKS):
+    """Retrieves the most relevant chunks for a given query, with debug output.
+
+    Hits whose cosine score is below `min_score` (default: RAG_MIN_SCORE) are
+    skipped, so weak matches do not pad the prompt. With a RAG_LEXICAL_WEIGHT
+    above 0, the remaining ones are fused with the best BM25 matches, which
+    catch exact identifiers and numbers embeddings miss (BM25 matches are
+    held to their own floor, RAG_LEXICAL_MIN_MATCH); hits are then
+    scored by reciprocal rank fusion rather than cosine similarity. With
+    `merge`, hits on neighbouring chunks of the same source are joined into
+    one passage. Returns (hits, debug info).
+    """
+    if min_score is None:
+        min_score = MIN_SCORE
     debug_info = f"[INFO] Retrieving context for query: '{query}'\n"
+    refresh_knowledge_base()
 
-    if len(doc_store) == 0:
+    if faiss_index.ntotal == 0:
         debug_info += "[WARNING] No documents in FAISS index.\n"
         print(debug_info)
-        return "", debug_info
+        return [], debug_info
 
-    query_embedding = (
-        embedding_model.encode(query, normalize_embeddings=True)
-        .astype(np.float32)
-        .reshape(1, -1)
-    )
-    distances, indices = faiss_index.search(query_embedding, top_k)
+    cache_key = normalize_query(query)
+    query_embedding, cached = _embed_query(query)
+    if cached:
+        debug_info += "[DEBUG] Query embedding cache hit\n"
+
+    candidates = top_k * FUSION_CANDIDATES if LEXICAL_WEIGHT else top_k
+    cached_results = search_cache.get((cache_key, candidates))
+    record_cache("search", cached_results is not None)
+    if cached_results is None:
+        with span("search"):
+            distances, indices = faiss_index.search(query_embedding, candidates)
+        search_cache.put((cache_key, candidates), (distances, indices))
+    else:
+        distances, indices = cached_results
+        debug_info += "[DEBUG] Search results cache hit\n"
 
     debug_info += f"[DEBUG] Query embedding shape: {query_embedding.shape}\n"
     debug_info += f"[DEBUG] Retrieved indices: {indices.tolist()}\n"
     debug_info += f"[DEBUG] Distances: {distances.tolist()}\n"
 
-    retrieved_texts = [doc_store[i] for i in indices[0] if i < len(doc_store)]
-    retrieved_context = "\n\n".join(retrieved_texts)
+    scores = cosine_scores(faiss_index, distances[0])
+    debug_info += f"[DEBUG] Scores: {scores.tolist()} (min_score: {min_score})\n"
 
-    debug_info += f"[INFO] Retrieved documents: {len(retrieved_texts)}\n"
-    for i, text in enumerate(retrieved_texts):
-        debug_info += f"  {i+1}. {text[:100]}...\n"
+    ranked = [
+        (int(i), score)
+        for i, score in zip(indices[0], scores)
+        if 0 <= i < len(doc_store) and score >= min_score
+    ]
+    if LEXICAL_WEIGHT:
+        with span("lexical_search"):
+            lexical_ids, bm25_scores = lexical_index.search(
+                query,
+                candidates,
+                is_live=faiss_index.contains,
+                max_df=LEXICAL_MAX_DF,
+                min_match=LEXICAL_MIN_MATCH,
+            )
+        debug_info += f"[DEBUG] BM25 indices: {lexical_ids.tolist()}\n"
+        debug_info += f"[DEBUG] BM25 scores: {bm25_scores.tolist()}\n"
+        ranked = fuse_rankings(
+            [[i for i, _ in ranked], lexical_ids.tolist()],
+            [DENSE_WEIGHT, LEXICAL_WEIGHT],
+        )[:top_k]
+        debug_info += f"[DEBUG] Fused: {ranked}\n"
+
+    hits = [Hit(score, i, *doc_store.meta(i), doc_store[i]) for i, score in ranked]
+    if merge:
+        hits = merge_adjacent(hits)
+
+    debug_info += f"[INFO] Retrieved passages: {len(hits)}\n"
+    for i, hit in enumerate(hits):
+        debug_info += (
+            f"  {i+1}. [source {hit.source}, chars {hit.start}-{hit.end}] "
+            f"{hit.text[:100]}...\n"
+        )
 
     print(debug_info)  # Print debug info for logging
-    return retrieved_context, debug_info  # Return retrieved context and debug info
+    return hits, debug_info
+
+
+def retrieve_context(query, top_k=3, min_score=None, merge=MERGE_ADJACENT_CHUNKS):
+    """Retrieves the most relevant passages for a query, joined into one context.
+
+    Returns (context, debug info); see retrieve_hits.
+    """
+    hits, debug_info = retrieve_hits(query, top_k, min_score, merge)
+    return "\n\n".join(hit.text for hit in hits), debug_info
+
+
+def index_stats():
+    """This process's view of the knowledge base, or None before it is loaded."""
+    if faiss_index is None:
+        return None
+    return {"pid": os.getpid(), "documents": len(doc_store), **faiss_index.stats()}
+
+
+def cache_stats():
+    """Hit/miss counters of the query caches, for monitoring."""
+    return {"embeddings": embedding_cache.stats(), "search": search_cache.stats()}
+
+
+def batching_stats():
+    """Micro-batch counters of the query embedding batcher, for monitoring."""
+    return embedding_batcher.stats() if embedding_batcher is not None else None
@@ -1,12 +1,50 @@
-from rag import add_document
-
-# Add knowledge base documents
-add_document(
-    "Python is a programming language widely used for AI and machine learning."
-)
-add_document(
-    "FAISS is a library developed by Facebook AI Research for fast similarity search."
-)
-add_document("OpenAI developed the GPT models which power modern chat applications.")
-
-print("Documents added successfully.")
+import argparse
+
+from rag import add_documents, compact_index
+
+# Sample knowledge base documents, used when no corpus file is given
+SAMPLE_DOCUMENTS = [
+    "Python is a programming language widely used for AI and machine learning.",
+    "FAISS is a library developed by Facebook AI Research for fast similarity search.",
+    "OpenAI developed the GPT models which power modern chat applications.",
+]
+
+
+def read_corpus(path):
+    """Streams documents from a text file, one document per non-empty line."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield line
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Populate the Hagakure knowledge base.")
+    parser.add_argument("corpus", nargs="?", help="Text file with one document per line")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument(
+        "--checkpoint-every",
+        type=int,
+        default=None,
+        help="Compact the write-ahead log into the index every N chunks "
+        "(default: every RAG_COMPACT_AFTER changes)",
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Compact the index after adding the corpus, if any, migrating a "
+        "flat index to RAG_INDEX_TYPE",
+    )
+    args = parser.parse_args()
+
+    if args.corpus or not args.compact:
+        documents = read_corpus(args.corpus) if args.corpus else SAMPLE_DOCUMENTS
+        count = add_documents(
+            documents,
+            batch_size=args.batch_size,
+            checkpoint_every=args.checkpoint_every,
+        )
+        print(f"{count} documents added successfully.")
+    if args.compact:
+        compact_index()
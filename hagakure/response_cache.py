@@ -0,0 +1,243 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+import faiss
+import numpy as np
+
+from query_cache import normalize_query
+
+
+def conversation_tail(history, n):
+    """The last `n` turns of a history as (role, normalized text) pairs.
+
+    Old user turns are keyed on the prompt the user typed, not on the
+    retrieved context they were sent with.
+    """
+    turns = [m for m in history if m.get("role") != "system"][-n:] if n else []
+    return [
+        (m["role"], normalize_query(m.get("prompt") or m.get("content") or ""))
+        for m in turns
+    ]
+
+
+class ResponseCache:
+    """Completions cached in a local SQLite database.
+
+    Entries are grouped by scope, a hash of (provider, model, conversation
+    tail, retrieved doc ids): a cached reply is only reused when all of them
+    match. Within a scope, the exact tier matches the normalized prompt. The
+    semantic tier, enabled by passing `embed` (text in, normalized embedding
+    out), also matches prompts whose embedding has a cosine similarity of at
+    least `threshold` with a cached one, using a FAISS index of the past
+    prompts of each scope, so entries of other scopes never crowd out a match.
+    Beyond `max_entries`, the least recently used entries are evicted.
+
+    The FAISS indexes are built from the database on first use, so with
+    several processes sharing one database, each sees the others' entries in
+    the exact tier at once and in the semantic tier after a restart.
+    """
+
+    def __init__(
+        self, path, dim, max_entries=10_000, embed=None, threshold=0.95, candidates=8
+    ):
+        self.path = path
+        self.dim = dim
+        self.max_entries = max_entries
+        self.embed = embed
+        self.threshold = threshold
+        self.candidates = candidates
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._indexes = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT UNIQUE, scope TEXT, "
+                "message TEXT, embedding BLOB, last_used REAL)"
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)"
+            )
+
+    @property
+    def semantic(self):
+        return self.embed is not None
+
+    def _connect(self):
+        """Returns this thread's connection; sqlite3 connections are not shareable."""
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=30)
+        return db
+
+    def _new_index(self):
+        return faiss.IndexIDMap2(faiss.IndexFlatIP(self.dim))
+
+    def _semantic_indexes(self):
+        """FAISS indexes of cached prompt embeddings by scope, keyed by row id.
+
+        Callers hold `_lock`: a FAISS index must not be searched while it is
+        modified.
+        """
+        if self._indexes is None:
+            rows = (
+                self._connect()
+                .execute(
+                    "SELECT id, scope, embedding FROM responses "
+                    "WHERE embedding IS NOT NULL"
+                )
+                .fetchall()
+            )
+            by_scope = {}
+            for row_id, scope, embedding in rows:
+                by_scope.setdefault(scope, []).append((row_id, embedding))
+            self._indexes = {}
+            for scope, entries in by_scope.items():
+                ids = np.array([row_id for row_id, _ in entries], dtype=np.int64)
+                vectors = np.frombuffer(
+                    b"".join(embedding for _, embedding in entries), dtype=np.float32
+                ).reshape(len(entries), self.dim)
+                index = self._indexes[scope] = self._new_index()
+                index.add_with_ids(vectors, ids)
+        return self._indexes
+
+    @staticmethod
+    def scope(provider, model, tail, doc_ids):
+        payload = json.dumps([provider, model, tail, sorted(doc_ids)])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _key(scope, prompt):
+        payload = f"{scope}\0{normalize_query(prompt)}"
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _embedding(self, prompt):
+        return np.asarray(self.embed(prompt), dtype=np.float32).reshape(1, self.dim)
+
+    def get(self, scope, prompt):
+        """Returns (assistant message, "exact" or "semantic", similarity), or None."""
+        db = self._connect()
+        row = db.execute(
+            "SELECT id, message FROM responses WHERE key = ?",
+            (self._key(scope, prompt),),
+        ).fetchone()
+        match = (row, "exact", 1.0) if row else None
+
+        if match is None and self.semantic:
+            embedding = self._embedding(prompt)
+            scores = ids = None
+            with self._lock:
+                index = self._semantic_indexes().get(scope)
+                if index is not None and index.ntotal:
+                    scores, ids = index.search(embedding, self.candidates)
+            if ids is not None:
+                # Candidates after the first only matter if another process
+                # evicted it from the database
+                for score, i in zip(scores[0], ids[0]):
+                    if i < 0 or score < self.threshold:
+                        break
+                    row = db.execute(
+                        "SELECT id, message FROM responses WHERE id = ? AND scope = ?",
+                        (int(i), scope),
+                    ).fetchone()
+                    if row:
+                        match = (row, "semantic", float(score))
+                        break
+
+        if match is None:
+            self.misses += 1
+            return None
+        (row_id, message), kind, score = match
+        if kind == "exact":
+            self.exact_hits += 1
+        else:
+            self.semantic_hits += 1
+        with db:
+            db.execute(
+                "UPDATE responses SET last_used = ? WHERE id = ?", (time.time(), row_id)
+            )
+        return json.loads(message), kind, score
+
+    def put(self, scope, prompt, message):
+        """Caches the reply to `prompt`, evicting old entries beyond max_entries."""
+        if self.max_entries <= 0:
+            return
+        key = self._key(scope, prompt)
+        embedding = None
+        if self.semantic:
+            embedding = self._embedding(prompt)
+            # Built before the insert, so the new row is added exactly once below
+            with self._lock:
+                self._semantic_indexes()
+        db = self._connect()
+        with db:
+            row = db.execute(
+                "SELECT id FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row:
+                db.execute(
+                    "UPDATE responses SET message = ?, last_used = ? WHERE id = ?",
+                    (json.dumps(message), time.time(), row[0]),
+                )
+                return
+            row_id = db.execute(
+                "INSERT INTO responses (key, scope, message, embedding, last_used) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (
+                    key,
+                    scope,
+                    json.dumps(message),
+                    embedding.tobytes() if embedding is not None else None,
+                    time.time(),
+                ),
+            ).lastrowid
+            evicted = db.execute(
+                "SELECT id, scope FROM responses ORDER BY last_used DESC "
+                "LIMIT -1 OFFSET ?",
+                (self.max_entries,),
+            ).fetchall()
+            db.executemany(
+                "DELETE FROM responses WHERE id = ?", [(i,) for i, _ in evicted]
+            )
+        self.evictions += len(evicted)
+
+        if embedding is not None:
+            with self._lock:
+                indexes = self._semantic_indexes()
+                if row_id not in [i for i, _ in evicted]:
+                    if scope not in indexes:
+                        indexes[scope] = self._new_index()
+                    indexes[scope].add_with_ids(
+                        embedding, np.array([row_id], dtype=np.int64)
+                    )
+                for i, evicted_scope in evicted:
+                    index = indexes.get(evicted_scope)
+                    if index is not None:
+                        index.remove_ids(np.array([i], dtype=np.int64))
+                        if not index.ntotal:
+                            del indexes[evicted_scope]
+
+    def clear(self):
+        with self._connect() as db:
+            db.execute("DELETE FROM responses")
+        with self._lock:
+            self._indexes = {}
+
+    def stats(self):
+        (size,) = self._connect().execute("SELECT COUNT(*) FROM responses").fetchone()
+        return {
+            "size": size,
+            "max_entries": self.max_entries,
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
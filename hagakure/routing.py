@@ -0,0 +1,300 @@
+import asyncio
+import queue
+import threading
+import time
+
+
+class CircuitBreaker:
+    """Stops sending requests to a provider that keeps failing.
+
+    After `failure_threshold` consecutive failures the breaker opens and the
+    provider is skipped. Once `reset_timeout` seconds have passed, a single
+    trial request is let through (half-open): success closes the breaker,
+    failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=3, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Whether a request may be sent now."""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if (
+                self.state == "open"
+                and time.monotonic() >= self.opened_at + self.reset_timeout
+            ):
+                self.state = "half_open"
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def release(self):
+        """Ends a half-open trial that was cancelled before it succeeded or failed."""
+        with self._lock:
+            if self.state == "half_open":
+                self.state = "open"
+                self.opened_at = time.monotonic() - self.reset_timeout
+
+
+class Router:
+    """Streams a completion from the first healthy provider of a route.
+
+    The first provider of the route is the primary. If it has produced no
+    token `hedge_after` seconds after it was sent the request, the next
+    provider is sent the same request as a hedge; whichever streams a token
+    first is used and the others are cancelled. A provider that fails before
+    its first token is replaced by the next one. Providers whose circuit
+    breaker is open are skipped. Once a token has been streamed the provider
+    is committed to, so a later error is raised rather than retried.
+
+    `messages_for(name)` returns the messages to send to each provider. On
+    completion, `result` holds the assistant "message", the answering
+    "provider" and the "routing" decisions, for debug output.
+    """
+
+    def __init__(
+        self, registry, hedge_after=2.0, failure_threshold=3, reset_timeout=30.0
+    ):
+        self.registry = registry
+        self.hedge_after = hedge_after
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.breakers = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, name):
+        with self._lock:
+            if name not in self.breakers:
+                self.breakers[name] = CircuitBreaker(
+                    self.failure_threshold, self.reset_timeout
+                )
+            return self.breakers[name]
+
+    def _next_provider(self, pending, decisions):
+        """Pops the next provider of the route whose circuit lets a request through."""
+        while pending:
+            name = pending.pop(0)
+            if self.breaker(name).allow():
+                return name
+            decisions.append(f"skipped {name}: circuit open")
+        return None
+
+    def _hedge_deadline(self, pending):
+        if self.hedge_after and pending:
+            return time.monotonic() + self.hedge_after
+        return None
+
+    def _pick(self, winner, started, decisions):
+        """Records the winner and releases the breakers of the cancelled requests."""
+        cancelled = [name for name in started if name != winner]
+        for name in cancelled:
+            self.breaker(name).release()
+        decisions.append(
+            f"{winner} answered first"
+            + (f", cancelled {', '.join(cancelled)}" if cancelled else "")
+        )
+
+    def stream(self, route, messages_for, result):
+        """Yields response deltas; see the class docstring."""
+        decisions = result.setdefault("routing", [])
+        pending = list(route)
+        events = queue.Queue()
+        cancels = {}
+        attempts = {}
+        failed = set()
+
+        def pump(name, messages, cancelled, attempt):
+            try:
+                deltas = self.registry.get(name).stream(messages, attempt)
+                for delta in deltas:
+                    if cancelled.is_set():
+                        deltas.close()
+                        return
+                    if delta:
+                        events.put((name, "delta", delta))
+                if not cancelled.is_set():
+                    events.put((name, "done", attempt["message"]))
+            except Exception as e:
+                if not cancelled.is_set():
+                    events.put((name, "error", e))
+
+        def cancel(name):
+            """Stops a request, closing its SDK stream if it is still waiting."""
+            cancels[name].set()
+            stream = attempts[name].get("stream")
+            if stream is not None:
+                try:
+                    stream.close()
+                except Exception as e:
+                    print(f"[WARNING] Could not close the {name} stream: {e}")
+
+        def launch(reason=None):
+            """Sends the request to the next available provider, if any."""
+            name = self._next_provider(pending, decisions)
+            if name is None:
+                return None
+            if reason:
+                decisions.append(f"{reason} to {name}")
+            cancels[name] = threading.Event()
+            attempts[name] = {}
+            threading.Thread(
+                target=pump,
+                args=(name, messages_for(name), cancels[name], attempts[name]),
+                name=f"route-{name}",
+                daemon=True,
+            ).start()
+            return self._hedge_deadline(pending)
+
+        deadline = launch()
+        if not cancels:
+            raise RuntimeError(f"No provider available, all circuits open: {route}")
+        try:
+            winner = None
+            while winner is None:
+                timeout = (
+                    None if deadline is None else max(deadline - time.monotonic(), 0)
+                )
+                try:
+                    name, kind, payload = events.get(timeout=timeout)
+                except queue.Empty:
+                    deadline = launch(f"no token after {self.hedge_after}s, hedging")
+                    continue
+                if kind == "error":
+                    self.breaker(name).record_failure()
+                    failed.add(name)
+                    decisions.append(f"{name} failed: {payload}")
+                    # Replace it right away, even if another request is in flight
+                    deadline = launch("falling back")
+                    if len(failed) == len(cancels):
+                        raise payload
+                    continue
+                winner = name
+
+            self._pick(winner, [n for n in cancels if n not in failed], decisions)
+            for name in cancels:
+                if name != winner:
+                    cancel(name)
+            result["provider"] = winner
+
+            while True:
+                if kind == "delta":
+                    yield payload
+                elif kind == "done":
+                    self.breaker(winner).record_success()
+                    result["message"] = payload
+                    return
+                else:
+                    self.breaker(winner).record_failure()
+                    decisions.append(f"{winner} failed mid-stream: {payload}")
+                    raise payload
+                name, kind, payload = events.get()
+                while name != winner:
+                    name, kind, payload = events.get()
+        finally:
+            # Also stops the winner if the consumer goes away mid-stream
+            for name in cancels:
+                cancel(name)
+
+    async def astream(self, route, messages_for, result):
+        """Async version of `stream`; losing requests are cancelled outright."""
+        decisions = result.setdefault("routing", [])
+        pending = list(route)
+        events = asyncio.Queue()
+        tasks = {}
+        failed = set()
+
+        async def pump(name, messages):
+            attempt = {}
+            try:
+                async for delta in self.registry.get(name).astream(messages, attempt):
+                    if delta:
+                        await events.put((name, "delta", delta))
+                await events.put((name, "done", attempt["message"]))
+            except Exception as e:
+                await events.put((name, "error", e))
+
+        def launch(reason=None):
+            """Sends the request to the next available provider, if any."""
+            name = self._next_provider(pending, decisions)
+            if name is None:
+                return None
+            if reason:
+                decisions.append(f"{reason} to {name}")
+            tasks[name] = asyncio.create_task(pump(name, messages_for(name)))
+            return self._hedge_deadline(pending)
+
+        deadline = launch()
+        if not tasks:
+            raise RuntimeError(f"No provider available, all circuits open: {route}")
+        try:
+            winner = None
+            while winner is None:
+                timeout = (
+                    None if deadline is None else max(deadline - time.monotonic(), 0)
+                )
+                try:
+                    name, kind, payload = await asyncio.wait_for(events.get(), timeout)
+                except asyncio.TimeoutError:
+                    deadline = launch(f"no token after {self.hedge_after}s, hedging")
+                    continue
+                if kind == "error":
+                    self.breaker(name).record_failure()
+                    failed.add(name)
+                    decisions.append(f"{name} failed: {payload}")
+                    # Replace it right away, even if another request is in flight
+                    deadline = launch("falling back")
+                    if len(failed) == len(tasks):
+                        raise payload
+                    continue
+                winner = name
+
+            self._pick(winner, [n for n in tasks if n not in failed], decisions)
+            for name, task in tasks.items():
+                if name != winner:
+                    task.cancel()
+            result["provider"] = winner
+
+            while True:
+                if kind == "delta":
+                    yield payload
+                elif kind == "done":
+                    self.breaker(winner).record_success()
+                    result["message"] = payload
+                    return
+                else:
+                    self.breaker(winner).record_failure()
+                    decisions.append(f"{winner} failed mid-stream: {payload}")
+                    raise payload
+                name, kind, payload = await events.get()
+                while name != winner:
+                    name, kind, payload = await events.get()
+        finally:
+            for task in tasks.values():
+                task.cancel()
+
+    def stats(self):
+        """Circuit breaker state per provider, for monitoring."""
+        with self._lock:
+            breakers = dict(self.breakers)
+        return {
+            name: {"state": breaker.state, "failures": breaker.failures}
+            for name, breaker in breakers.items()
+        }
@@ -0,0 +1,85 @@
+import os
+import struct
+import zlib
+
+import numpy as np
+
+ADD = 1
+DELETE = 2
+
+# Record header: operation, number of ids, CRC32 of the payload
+HEADER = struct.Struct("<BII")
+
+
+class WriteAheadLog:
+    """Append-only log of the vectors added and deleted since the last snapshot.
+
+    Each record is a header followed by its payload: the int64 ids and, for
+    additions, their float32 vectors. A record cut short by a crash fails
+    its length or checksum check, and reading stops there. The log is
+    replaced, never truncated in place, when it is compacted, so readers
+    can tell a new log from a longer one by its inode.
+    """
+
+    def __init__(self, path, dim):
+        self.path = path
+        self.dim = dim
+        # Created by appending, so a log another process just created is kept
+        open(path, "ab").close()
+
+    def identity(self):
+        return os.stat(self.path).st_ino
+
+    def size(self):
+        return os.path.getsize(self.path)
+
+    def append(self, op, ids, vectors=None):
+        """Appends one record and syncs it to disk."""
+        payload = np.asarray(ids, dtype="<i8").tobytes()
+        if op == ADD:
+            payload += np.asarray(vectors, dtype="<f4").tobytes()
+        with open(self.path, "ab") as f:
+            f.write(HEADER.pack(op, len(ids), zlib.crc32(payload)) + payload)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def read(self, offset=0):
+        """Reads the complete records from `offset` on.
+
+        Returns ([(op, ids, vectors)], offset just past the last of them, the
+        identity of the log file they were read from).
+        """
+        with open(self.path, "rb") as f:
+            identity = os.fstat(f.fileno()).st_ino
+            f.seek(offset)
+            data = f.read()
+        records = []
+        pos = 0
+        while pos + HEADER.size <= len(data):
+            op, count, crc = HEADER.unpack_from(data, pos)
+            size = count * 8 + (count * self.dim * 4 if op == ADD else 0)
+            payload = data[pos + HEADER.size : pos + HEADER.size + size]
+            if op not in (ADD, DELETE) or len(payload) < size:
+                break
+            if zlib.crc32(payload) != crc:
+                break
+            ids = np.frombuffer(payload, dtype="<i8", count=count)
+            vectors = None
+            if op == ADD:
+                vectors = np.frombuffer(payload, dtype="<f4", offset=count * 8)
+                vectors = vectors.reshape(count, self.dim)
+            records.append((op, ids, vectors))
+            pos += HEADER.size + size
+        return records, offset + pos, identity
+
+    def truncate(self, offset):
+        """Cuts a torn record off the end, before appending after it."""
+        if self.size() > offset:
+            os.truncate(self.path, offset)
+
+    def reset(self):
+        """Atomically replaces the log with an empty one."""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)